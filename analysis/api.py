@@ -0,0 +1,351 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from analysis import (backends, campaign_analysis, dimensions, graph, ingest, kpis, snapshots, sql_source,
+                      strategy_recommendations, validation, what_if_analysis)
+
+# Latency samples kept per route for the percentile report
+LATENCY_WINDOW = 10_000
+
+# The dashboard's page graphs; routes evaluate the same nodes, memoized per data version in this process
+VIEW_GRAPHS = {
+    'campaign': campaign_analysis.GRAPH,
+    'strategy': strategy_recommendations.GRAPH,
+    'what_if': what_if_analysis.GRAPH,
+}
+
+SEGMENT_TABLES = {
+    'campaign': ['deposit_type_metrics', 'cadence_metrics', 'deposit_type_performance', 'cadence_performance',
+                 'ltv_cohorts', 'client_cohorts', 'lift_decay'],
+    'strategy': ['region_metrics', 'residence_metrics'],
+}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _records(table):
+    # Flatten MultiIndex columns and the index so every table is a list of plain JSON rows
+    table = table.copy()
+    if isinstance(table.columns, pd.MultiIndex):
+        table.columns = [' '.join(str(part) for part in column) for column in table.columns]
+    if not isinstance(table.index, pd.RangeIndex):
+        table = table.reset_index()
+    table = table.replace([np.inf, -np.inf], np.nan)
+    return json.loads(table.to_json(orient='records', date_format='iso'))
+
+
+def _row(table):
+    return _records(table)[0]
+
+
+def data_version(kind='pandas', deposits='deposit_data1.csv', clients='client_data.csv',
+                 calendar='calendar_data.csv', database=None, registry=None):
+    # Cheap fingerprint of the inputs, as app.current_data_version computes it
+    suffix = f"-d{registry.fingerprint:x}" if registry is not None else ''
+    if kind == 'sqlite':
+        return ingest.file_signature([database]) + suffix
+    return (f"{ingest.file_signature([clients, calendar])}-"
+            f"{ingest.file_signature(ingest.resolve_partitions(deposits))}{suffix}")
+
+
+def build_backend(kind='pandas', deposits='deposit_data1.csv', clients='client_data.csv',
+                  calendar='calendar_data.csv', database=None, parquet_dir='.parquet_store',
+                  quarantine_dir='.quarantine', dimensions_file=None, version=None):
+    # Same engines, data-version fingerprints, derived dimensions and ingest validation as the dashboard
+    registry = dimensions.load_registry(dimensions_file)
+    version = version or data_version(kind, deposits, clients, calendar, database,
+                                      registry if dimensions_file else None)
+    if kind == 'sqlite':
+        return sql_source.SQLiteBackend(sql_source.SQLiteSource(database), data_version=version, registry=registry)
+
+    calendar_data = pd.read_csv(calendar)
+    calendar_data['gregorian_date'] = pd.to_datetime(calendar_data['gregorian_date'])
+    client_data = pd.read_csv(clients)
+    deposit_data = ingest.load_deposits(deposits, *ingest.calendar_span(calendar_data))
+    deposit_data, counts = validation.validate_inputs(client_data, deposit_data, calendar_data,
+                                                      quarantine_dir, version)
+    if kind == 'duckdb':
+        backend = backends.DuckDBBackend.from_frames(
+            client_data, deposit_data, calendar_data, parquet_dir, data_version=version, registry=registry
+        )
+    else:
+        backend = backends.PandasBackend(client_data, deposit_data, calendar_data, data_version=version,
+                                         registry=registry)
+    backend.validation = counts
+    return backend
+
+
+class BackendLoader:
+    # build_backend's arguments, kept so the service can check the inputs' fingerprint
+    # on every request and rebuild the backend when the files change
+    def __init__(self, kind='pandas', deposits='deposit_data1.csv', clients='client_data.csv',
+                 calendar='calendar_data.csv', database=None, parquet_dir='.parquet_store',
+                 quarantine_dir='.quarantine', dimensions_file=None):
+        self.kind = kind
+        self.deposits = deposits
+        self.clients = clients
+        self.calendar = calendar
+        self.database = database
+        self.parquet_dir = parquet_dir
+        self.quarantine_dir = quarantine_dir
+        self.dimensions_file = dimensions_file
+        self.registry = dimensions.load_registry(dimensions_file) if dimensions_file else None
+
+    def data_version(self):
+        return data_version(self.kind, self.deposits, self.clients, self.calendar, self.database, self.registry)
+
+    def load(self, version=None):
+        return build_backend(self.kind, self.deposits, self.clients, self.calendar, self.database,
+                             self.parquet_dir, self.quarantine_dir, self.dimensions_file, version)
+
+
+class KPIService:
+    # Route handlers over one shared backend; serialized responses are cached by
+    # data version, route and canonical parameters, and carry that key's ETag.
+    # With a loader, the backend is rebuilt whenever the inputs' data version changes
+    def __init__(self, backend, snapshot_store=None, max_responses=1024, loader=None):
+        self.snapshot_store = snapshot_store
+        self.max_responses = max_responses
+        self.loader = loader
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.counts = defaultdict(lambda: defaultdict(int))
+        self._use(backend)
+
+        self.routes = {
+            '/api/filters': self.filters,
+            '/api/monthly': self.monthly,
+            '/api/roi': self.roi,
+            '/api/segments': self.segments,
+            '/api/scenarios': self.scenarios,
+        }
+
+    def _use(self, backend):
+        regions = backend.distinct_values('client_geographical_region')
+        statuses = backend.distinct_values('client_residence_status')
+        self.options = {'regions': regions, 'statuses': statuses, 'date_bounds': backend.date_bounds()}
+        self.backend = backend
+
+    def refresh(self):
+        # Stat the inputs and rebuild on a new fingerprint; concurrent requests wait for
+        # the one rebuild, and responses cached under the old version are dropped
+        if self.loader is None:
+            return
+        version = self.loader.data_version()
+        if version == self.backend.data_version:
+            return
+        with self._reload_lock:
+            if version != self.backend.data_version:
+                self._use(self.loader.load(version))
+                with self._lock:
+                    self._responses.clear()
+
+    def parse_filters(self, params):
+        # Canonicalized like the sidebar: the full range or every option means no restriction
+        low, high = self.options['date_bounds']
+        try:
+            start = pd.Timestamp(params['start'][0]) if 'start' in params else None
+            end = pd.Timestamp(params['end'][0]) if 'end' in params else None
+        except ValueError as e:
+            raise BadRequest(f"Invalid date: {e}") from None
+
+        def selection(name, options):
+            if name not in params:
+                return None
+            values = [value for value in params[name][0].split(',') if value]
+            unknown = set(values) - set(options or [])
+            if unknown:
+                raise BadRequest(f"Unknown {name}: {', '.join(sorted(unknown))}")
+            return None if set(values) == set(options) else values
+
+        return backends.make_filters(
+            start_date=start if start is not None and start > low else None,
+            end_date=end if end is not None and end < high else None,
+            regions=selection('regions', self.options['regions']),
+            statuses=selection('statuses', self.options['statuses']),
+        )
+
+    def _evaluate(self, view, node, inputs):
+        resources = {'backend': self.backend, 'snapshot_store': self.snapshot_store}
+        return VIEW_GRAPHS[view].evaluate(node, inputs, resources, self.backend.data_version is not None)
+
+    def _tables(self, view, filters):
+        return self._evaluate(view, 'tables', graph.filter_inputs(self.backend, filters))
+
+    def filters(self, params):
+        low, high = self.options['date_bounds']
+        return {
+            'regions': self.options['regions'],
+            'statuses': self.options['statuses'],
+            'date_bounds': [low.isoformat(), high.isoformat()],
+        }
+
+    def monthly(self, params):
+        tables = self._tables('campaign', self.parse_filters(params))
+        return {'monthly_metrics': _records(tables['monthly_metrics'])}
+
+    def roi(self, params):
+        tables = self._tables('campaign', self.parse_filters(params))
+        return {name: _row(tables[name]) for name in ['kpis', 'roi', 'success', 'month6']}
+
+    def segments(self, params):
+        view = params.get('view', ['campaign'])[0]
+        if view not in SEGMENT_TABLES:
+            raise BadRequest(f"view must be one of: {', '.join(SEGMENT_TABLES)}")
+        tables = self._tables(view, self.parse_filters(params))
+        names = SEGMENT_TABLES[view]
+        if view == 'strategy':
+            # Plus one table per derived dimension of the backend, e.g. age_group_metrics
+            names = names + [kpis.dimension_table(bucketing.name) for bucketing in self.backend.derived_dimensions]
+        return {name: _records(tables[name]) for name in names}
+
+    def scenarios(self, params):
+        # Same graph nodes as the What-If page, so slider-only changes reuse the projection
+        try:
+            pessimistic = float(params.get('pessimistic', ['-0.2'])[0])
+            optimistic = float(params.get('optimistic', ['0.2'])[0])
+        except ValueError:
+            raise BadRequest("pessimistic and optimistic must be numbers (e.g. -0.2)") from None
+        inputs = graph.filter_inputs(self.backend, self.parse_filters(params))
+        inputs.update(pessimistic_growth=pessimistic, optimistic_growth=optimistic)
+        projection = self._evaluate('what_if', 'projection', inputs)
+        return {
+            'projection': {name: float(value) for name, value in projection.items()},
+            'scenarios': self._evaluate('what_if', 'scenarios', inputs),
+            'roi': self._evaluate('what_if', 'roi_scenarios', inputs),
+        }
+
+    def metrics(self):
+        # Request counts, status codes and latency percentiles per route, in milliseconds
+        report = {}
+        for route, samples in list(self.latencies.items()):
+            values = np.fromiter(samples, dtype='float64') * 1000
+            report[route] = {
+                'requests': sum(self.counts[route].values()),
+                'status': dict(self.counts[route]),
+                'p50_ms': float(np.percentile(values, 50)),
+                'p95_ms': float(np.percentile(values, 95)),
+                'p99_ms': float(np.percentile(values, 99)),
+            }
+        return {'data_version': self.backend.data_version, 'cached_responses': len(self._responses),
+                'routes': report}
+
+    def respond(self, path, query):
+        # -> (status, body bytes, etag); bodies are built once per cache key
+        params = parse_qs(query)
+        if path == '/api/metrics':
+            return 200, json.dumps(self.metrics()).encode(), None
+        if path not in self.routes:
+            return 404, json.dumps({'error': f"Unknown route {path}"}).encode(), None
+
+        self.refresh()
+
+        key = (self.backend.data_version, path, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is not None:
+                self._responses.move_to_end(key)
+                return (200,) + cached
+
+        try:
+            payload = self.routes[path](params)
+        except BadRequest as e:
+            return 400, json.dumps({'error': str(e)}).encode(), None
+
+        body = json.dumps(payload, default=str).encode()
+        etag = '"' + hashlib.sha1(repr(key).encode() + body).hexdigest()[:20] + '"'
+        with self._lock:
+            self._responses[key] = (body, etag)
+            while len(self._responses) > self.max_responses:
+                self._responses.popitem(last=False)
+        return 200, body, etag
+
+    def record(self, path, status, elapsed):
+        route = path if path in self.routes or path == '/api/metrics' else 'other'
+        self.latencies[route].append(elapsed)
+        self.counts[route][status] += 1
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out as separate writes; without this keep-alive clients stall on delayed ACKs
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            start = time.perf_counter()
+            url = urlsplit(self.path)
+            try:
+                status, body, etag = service.respond(url.path, url.query)
+            except Exception as e:
+                status, body, etag = 500, json.dumps({'error': str(e)}).encode(), None
+
+            # Conditional GET: an unchanged representation is answered without a body
+            if etag is not None and self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+
+            self.send_response(status)
+            if etag is not None:
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            service.record(url.path, status, time.perf_counter() - start)
+
+        def log_message(self, format, *args):
+            # Per-request latency is reported by /api/metrics instead of the access log
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the dashboard KPIs as JSON")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--backend', choices=['pandas', 'duckdb', 'sqlite'], default='pandas')
+    parser.add_argument('--deposits', default='deposit_data1.csv', help="Deposit file, partition directory or glob")
+    parser.add_argument('--clients', default='client_data.csv')
+    parser.add_argument('--calendar', default='calendar_data.csv')
+    parser.add_argument('--database', help="SQLite database for --backend sqlite")
+    parser.add_argument('--parquet-dir', default='.parquet_store')
+    parser.add_argument('--quarantine-dir', default='.quarantine', help="Rejected deposit rows ('' keeps none)")
+    parser.add_argument('--snapshot-dir', default='.kpi_snapshots', help="Shared KPI snapshot store ('' disables)")
+    parser.add_argument('--snapshot-versions', type=int, default=snapshots.DEFAULT_MAX_VERSIONS,
+                        help="Data versions kept in the snapshot store (0 keeps all)")
+    parser.add_argument('--dimensions', help="JSON file of derived client dimensions (default: age groups)")
+    args = parser.parse_args()
+
+    loader = BackendLoader(args.backend, args.deposits, args.clients, args.calendar,
+                           args.database, args.parquet_dir, args.quarantine_dir, args.dimensions)
+    backend = loader.load()
+    snapshot_store = snapshots.SnapshotStore(args.snapshot_dir, args.snapshot_versions) if args.snapshot_dir else None
+    service = KPIService(backend, snapshot_store, loader=loader)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving KPIs for data version {backend.data_version} on http://{args.host}:{args.port}/api/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,615 @@
+import glob
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from analysis import dimensions, ingest, sketches
+from analysis.client_index import ClientIndex
+
+# Sidebar selection pushed down to every query; None means "no restriction"
+QueryFilters = namedtuple('QueryFilters', ['start_date', 'end_date', 'regions', 'statuses'])
+QueryFilters.__new__.__defaults__ = (None, None, None, None)
+
+CLIENT_COLUMNS = ['client_geographical_region', 'client_residence_status', 'client_age']
+
+# Every segment query returns these columns, indexed by month (and the segment keys)
+SEGMENT_METRICS = ['deposit_sum', 'deposit_mean', 'deposit_count', 'deposit_std', 'unique_clients']
+DAILY_METRICS = ['deposit_sum', 'deposit_count', 'unique_clients']
+CLIENT_METRICS = ['first_date', 'last_date', 'acquisition_month', 'deposit_sum', 'deposit_count']
+HISTORY_COLUMNS = ingest.DEPOSIT_COLUMNS + ['month_name']
+
+# Rows per chunk of scan_chunks(), which streams large selections (e.g. exports)
+SCAN_CHUNK_ROWS = 250_000
+
+# Data-version directories kept in a Parquet store; older ones are removed after each write
+PARQUET_STORE_VERSIONS = 2
+STORE_FILES = ('deposits.parquet', 'clients.parquet', 'deposits_by_client.parquet')
+# Deposits are stored one file per calendar month, so a date filter reads only its months
+MONTH_FILE_FORMAT = 'deposits_{:%Y-%m}.parquet'
+
+# Row groups of the client-sorted copies are kept moderate, so the client_id statistics of a
+# drill-down lookup narrow the read to a group or two
+CLIENT_ROW_GROUP_ROWS = 131_072
+
+# First-month x active-month distinct clients over a filtered deposit query; the plain window
+# SQL runs unchanged on DuckDB and SQLite
+COHORT_SQL = """
+    SELECT acquisition_month, month_name, COUNT(DISTINCT client_id) AS clients
+    FROM (
+        SELECT client_id, month_name,
+               FIRST_VALUE(month_name) OVER (PARTITION BY client_id ORDER BY deposit_date) AS acquisition_month
+        FROM ({sql})
+    ) a
+    GROUP BY acquisition_month, month_name
+"""
+
+# Money columns of the query results, in cents: deposit_sum is an exact int64 sum, the mean
+# is derived from it and the std is a float; in_dollars() converts them for display
+MONEY_METRICS = ['deposit_sum', 'deposit_mean', 'deposit_std']
+
+
+def make_filters(start_date=None, end_date=None, regions=None, statuses=None):
+    # Normalise to hashable values so filters can double as cache keys
+    return QueryFilters(
+        pd.Timestamp(start_date) if start_date is not None else None,
+        pd.Timestamp(end_date) if end_date is not None else None,
+        tuple(sorted(regions)) if regions is not None else None,
+        tuple(sorted(statuses)) if statuses is not None else None,
+    )
+
+
+def in_dollars(result):
+    # Copy of a query result with its money columns converted from cents to dollars
+    columns = [column for column in MONEY_METRICS if column in result.columns]
+    return result.assign(**{column: ingest.to_dollars(result[column]) for column in columns})
+
+
+def finalize_segments(result, keys):
+    # Plain string keys and a fixed column order, whatever the engine. The mean is taken
+    # from the exact integer sum here, so every engine returns the same bits
+    result = result.reset_index() if keys[0] not in result.columns else result
+    for key in keys:
+        result[key] = result[key].astype(object)
+    result = result.set_index(keys).astype({
+        'deposit_sum': 'int64',
+        'deposit_count': 'int64',
+        'deposit_std': 'float64',
+        'unique_clients': 'int64',
+    })
+    result['deposit_mean'] = result['deposit_sum'] / result['deposit_count']
+    return result[SEGMENT_METRICS]
+
+
+def finalize_daily(result, dims=()):
+    keys = list(dims) + ['deposit_date']
+    result = result.reset_index() if 'deposit_date' not in result.columns else result
+    result['deposit_date'] = pd.to_datetime(result['deposit_date']).astype('datetime64[ns]')
+    for key in dims:
+        result[key] = result[key].astype(object)
+    return result.set_index(keys)[DAILY_METRICS].astype({
+        'deposit_sum': 'int64',
+        'deposit_count': 'int64',
+        'unique_clients': 'int64',
+    })
+
+
+def finalize_clients(result, attributes=()):
+    # One row per client_id, sorted, with engine-independent dtypes
+    result = result.reset_index() if 'client_id' not in result.columns else result
+    for column in ['first_date', 'last_date']:
+        result[column] = pd.to_datetime(result[column]).astype('datetime64[ns]')
+    for column in ['acquisition_month'] + list(attributes):
+        result[column] = result[column].astype(object)
+    result = result.astype({'client_id': 'int64', 'deposit_sum': 'int64', 'deposit_count': 'int64'})
+    return result.set_index('client_id').sort_index()[CLIENT_METRICS + list(attributes)]
+
+
+def finalize_cohorts(result):
+    # (acquisition_month, month_name, clients) rows pivoted to a first-month x active-month
+    # matrix of distinct clients, zero where a cohort had no active clients
+    result = result.astype({'acquisition_month': object, 'month_name': object})
+    table = result.pivot_table(index='acquisition_month', columns='month_name', values='clients',
+                               aggfunc='sum', fill_value=0)
+    return table.astype('int64').sort_index().sort_index(axis=1)
+
+
+def finalize_history(result):
+    # Engines return deposit_amount already in cents
+    history = ingest.normalize_partition(ingest.store_columns(result))
+    history['month_name'] = result['month_name'].astype(object).to_numpy()
+    return history.reset_index(drop=True)
+
+
+class QueryBackend:
+    # The handful of queries the dashboard views run
+
+    # Fingerprint of the underlying data; keys snapshots and caches (None disables them)
+    data_version = None
+
+    # True for backends that estimate aggregates from a sample (see analysis.sampling)
+    approximate = False
+
+    # Ingest validation counts (validation.validate_inputs) for the data behind this backend
+    validation = None
+
+    # Derived client dimensions (analysis.dimensions); derived_dimensions are the ones whose
+    # source column the data has, and every query accepts their names as segment keys
+    registry = dimensions.DEFAULT_REGISTRY
+    derived_dimensions = ()
+
+    @property
+    def sketch_dims(self):
+        return sketches.SKETCH_DIMS + [bucketing.name for bucketing in self.derived_dimensions]
+
+    def cache_version(self, filters):
+        # Version of the data a query under these filters reads; snapshots, graph nodes, figures
+        # and exports key on it. Backends that version each month (analysis.incremental) return
+        # one that only changes with the months inside the filters' date range
+        return self.data_version
+
+    def segment_metrics(self, filters, dims=(), month=None):
+        raise NotImplementedError
+
+    def scan(self, filters, columns=None):
+        raise NotImplementedError
+
+    def scan_chunks(self, filters, columns=None, chunk_rows=SCAN_CHUNK_ROWS):
+        # scan() in bounded chunks; engines override it to avoid materializing the selection
+        data = self.scan(filters, columns)
+        for start in range(0, len(data), chunk_rows):
+            yield data.iloc[start:start + chunk_rows]
+
+    def daily_metrics(self, filters, dims=()):
+        # Per-day deposit_sum / deposit_count / unique_clients, indexed by (dims..., date)
+        raise NotImplementedError
+
+    def distinct_values(self, column):
+        raise NotImplementedError
+
+    def client_metrics(self, filters, attributes=()):
+        # Per-client first/last deposit, acquisition month, totals and client attributes
+        data = self.scan(filters, ['client_id', 'deposit_date', 'deposit_amount', 'month_name'] + list(attributes))
+        data = data.sort_values('deposit_date', kind='stable')
+        result = data.groupby('client_id', sort=True, observed=True).agg(
+            first_date=('deposit_date', 'first'),
+            last_date=('deposit_date', 'last'),
+            acquisition_month=('month_name', 'first'),
+            deposit_sum=('deposit_amount', 'sum'),
+            deposit_count=('deposit_amount', 'count'),
+            **{attribute: (attribute, 'first') for attribute in attributes}
+        )
+        return finalize_clients(result, attributes)
+
+    def cohort_table(self, filters):
+        # Distinct clients active in each month, by the month of their first deposit
+        data = self.scan(filters, ['client_id', 'deposit_date', 'month_name'])
+        data = data.sort_values('deposit_date', kind='stable')
+        first = data.drop_duplicates('client_id').set_index('client_id')['month_name']
+        active = data.drop_duplicates(['client_id', 'month_name'])
+        result = active.groupby([active['client_id'].map(first).rename('acquisition_month'), 'month_name'])
+        return finalize_cohorts(result.size().rename('clients').reset_index())
+
+    def date_bounds(self):
+        raise NotImplementedError
+
+    def sketch_counts(self):
+        # Bucketed deposit amounts per (day, segment) cell for sketches.DepositSketches
+        columns = ['deposit_date', 'month_name', 'deposit_amount'] + self.sketch_dims
+        data = self.scan(make_filters())
+        return sketches.bucket_counts(data[[column for column in columns if column in data.columns]],
+                                      self.sketch_dims)
+
+    def client_history(self, client_id):
+        # One client's deposits in date order (HISTORY_COLUMNS), unfiltered
+        raise NotImplementedError
+
+    def client_attributes(self, client_id):
+        # The client's row from client_data as a Series, or None
+        raise NotImplementedError
+
+    def monthly_metrics(self, filters):
+        return self.segment_metrics(filters)
+
+    def by_type(self, filters, month=None):
+        return self.segment_metrics(filters, ['deposit_type'], month=month)
+
+    def by_cadence(self, filters, month=None):
+        return self.segment_metrics(filters, ['deposit_cadence'], month=month)
+
+    def by_client_attribute(self, filters, attribute, month=None):
+        # attribute is a client column or a derived dimension such as 'age_group'
+        return self.segment_metrics(filters, [attribute], month=month)
+
+
+class PandasBackend(QueryBackend):
+    def __init__(self, client_data, deposit_data, calendar_data, data_version=None, registry=None):
+        self.client_data = client_data
+        self.calendar_data = calendar_data
+        self.data_version = data_version
+        self.registry = registry or self.registry
+        self.derived_dimensions = self.registry.available(client_data.columns)
+
+        # Month assignment and the client join happen once, not on every page visit
+        self.merged = self._merge(deposit_data)
+        self.client_index = ClientIndex(self.merged[HISTORY_COLUMNS], client_data)
+        self.sketches = sketches.DepositSketches(self.sketch_counts(), self.sketch_dims)
+
+    def _merge(self, deposit_data):
+        client_data = self.client_data
+        client_columns = ['client_id'] + [c for c in CLIENT_COLUMNS if c in client_data.columns]
+        merged = ingest.assign_months(deposit_data, self.calendar_data)
+        merged = merged.merge(client_data[client_columns], on='client_id', how='inner')
+        # Derived dimensions are banded once per client and broadcast to the deposits by
+        # client position; the columns are categoricals over the int8 codes
+        positions = pd.Index(client_data['client_id']).get_indexer(merged['client_id'])
+        for name, values in self.registry.broadcast(self.registry.client_codes(client_data), positions).items():
+            merged[name] = values
+        return merged
+
+    def _mask(self, filters):
+        data = self.merged
+        mask = pd.Series(True, index=data.index)
+        if filters.start_date is not None:
+            mask &= data['deposit_date'] >= filters.start_date
+        if filters.end_date is not None:
+            mask &= data['deposit_date'] <= filters.end_date
+        if filters.regions is not None:
+            mask &= data['client_geographical_region'].isin(filters.regions)
+        if filters.statuses is not None:
+            mask &= data['client_residence_status'].isin(filters.statuses)
+        return mask
+
+    def scan(self, filters, columns=None):
+        data = self.merged[self._mask(filters)]
+        return data[columns] if columns is not None else data
+
+    def scan_chunks(self, filters, columns=None, chunk_rows=SCAN_CHUNK_ROWS):
+        # Only one chunk of the selection is copied out of the merged frame at a time
+        positions = np.flatnonzero(self._mask(filters).to_numpy())
+        data = self.merged if columns is None else self.merged[columns]
+        for start in range(0, len(positions), chunk_rows):
+            yield data.iloc[positions[start:start + chunk_rows]]
+
+    def segment_metrics(self, filters, dims=(), month=None):
+        data = self.scan(filters)
+        if month is not None:
+            data = data[data['month_name'] == month]
+            keys = list(dims) or ['month_name']
+        else:
+            keys = ['month_name'] + list(dims)
+
+        result = data.groupby(keys, observed=True).agg(
+            deposit_sum=('deposit_amount', 'sum'),
+            deposit_count=('deposit_amount', 'count'),
+            deposit_std=('deposit_amount', 'std'),
+            unique_clients=('client_id', 'nunique'),
+        )
+        return finalize_segments(result, keys)
+
+    def daily_metrics(self, filters, dims=()):
+        data = self.scan(filters)
+        keys = [data[dim] for dim in dims] + [data['deposit_date'].dt.normalize()]
+        result = data.groupby(keys, observed=True).agg(
+            deposit_sum=('deposit_amount', 'sum'),
+            deposit_count=('deposit_amount', 'count'),
+            unique_clients=('client_id', 'nunique'),
+        )
+        return finalize_daily(result, dims)
+
+    def distinct_values(self, column):
+        if column not in self.client_data.columns:
+            return None
+        return sorted(self.client_data[column].dropna().unique())
+
+    def date_bounds(self):
+        return self.merged['deposit_date'].min(), self.merged['deposit_date'].max()
+
+    def client_history(self, client_id):
+        return self.client_index.history(client_id)
+
+    def client_attributes(self, client_id):
+        return self.client_index.attributes(client_id)
+
+
+def _write_parquet(frame, path, **kwargs):
+    # Written aside and renamed, so a reader never sees a half-written file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    frame.to_parquet(tmp_path, index=False, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def prune_parquet_store(directory, keep=PARQUET_STORE_VERSIONS):
+    # Drops all but the newest data versions; only store files are removed, so a
+    # directory that also holds other data is left alone
+    versions = []
+    for name in os.listdir(directory):
+        client_path = os.path.join(directory, name, 'clients.parquet')
+        if os.path.isfile(client_path):
+            versions.append((os.path.getmtime(client_path), os.path.join(directory, name)))
+    for _, path in sorted(versions, reverse=True)[keep:]:
+        month_files = glob.glob(os.path.join(glob.escape(path), 'deposits_*.parquet'))
+        for file_path in [os.path.join(path, file_name) for file_name in STORE_FILES] + month_files:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+
+def write_parquet_store(client_data, deposit_data, directory, data_version=None):
+    # Columnar copy of the CSV inputs for the embedded engine, as <directory>/<data version>/.
+    # A rebuild never rewrites the files an older backend, or another process on other
+    # data, is still reading. Deposits are split into date-sorted monthly files, so a date
+    # filter reads only its months and row-group statistics skip whole groups within them;
+    # a second, client-sorted copy serves the drill-down lookups
+    store = os.path.join(directory, str(data_version or 'latest'))
+    os.makedirs(store, exist_ok=True)
+    _, client_path, history_path = (os.path.join(store, name) for name in STORE_FILES)
+    deposits = ingest.store_columns(deposit_data).sort_values('deposit_date')
+    months = deposits['deposit_date'].dt.to_period('M')
+    deposit_paths = []
+    for month, rows in deposits.groupby(months, sort=True):
+        deposit_paths.append(os.path.join(store, MONTH_FILE_FORMAT.format(month.start_time)))
+        _write_parquet(rows, deposit_paths[-1], row_group_size=1_000_000)
+    if months.isna().any() or not deposit_paths:
+        # Undated rows (and an empty store) go to a file without a month in its name,
+        # which every query reads
+        deposit_paths.append(os.path.join(store, 'deposits_undated.parquet'))
+        _write_parquet(deposits[months.isna()], deposit_paths[-1], row_group_size=1_000_000)
+    _write_parquet(deposits.sort_values(['client_id', 'deposit_date']), history_path,
+                   row_group_size=CLIENT_ROW_GROUP_ROWS)
+    _write_parquet(client_data.sort_values('client_id'), client_path, row_group_size=CLIENT_ROW_GROUP_ROWS)
+    prune_parquet_store(directory)
+    return deposit_paths, client_path, history_path
+
+
+class DuckDBBackend(QueryBackend):
+    def __init__(self, deposit_paths, client_path, calendar_data, threads=None, memory_limit=None,
+                 temp_directory=None, data_version=None, registry=None, history_path=None):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("The DuckDB backend requires the 'duckdb' package") from e
+
+        if isinstance(deposit_paths, str):
+            deposit_paths = ingest.resolve_partitions(deposit_paths)
+        self.data_version = data_version or ingest.file_signature(list(deposit_paths) + [client_path])
+
+        self.connection = duckdb.connect(database=':memory:')
+        self.connection.execute(f"SET threads = {int(threads or os.cpu_count() or 1)}")
+        if memory_limit:
+            # Larger-than-memory aggregations spill to temp_directory
+            self.connection.execute(f"SET memory_limit = '{memory_limit}'")
+        if temp_directory:
+            self.connection.execute(f"SET temp_directory = '{temp_directory}'")
+
+        calendar = calendar_data[['gregorian_date', 'month_name']]
+        self.connection.register('calendar_frame', calendar)
+        self.connection.execute(
+            "CREATE TABLE calendar AS "
+            "SELECT CAST(gregorian_date AS DATE) AS gregorian_date, month_name FROM calendar_frame"
+        )
+        self.connection.unregister('calendar_frame')
+        # Filtered queries read only the deposit files whose dates overlap the filter
+        self.deposit_paths = list(deposit_paths)
+        self.deposit_bounds = [ingest.partition_date_bounds(path) for path in self.deposit_paths]
+        self.deposit_select = self._amount_select(self.deposit_paths)
+        self._deposit_view('deposits_raw', self.deposit_paths)
+        # Drill-down lookups read the client-sorted copy when there is one; without it
+        # (deposit files given directly) each lookup scans the deposits
+        self._deposit_view('client_deposits', [history_path] if history_path else deposit_paths)
+        self.connection.execute(f"CREATE VIEW clients AS SELECT * FROM read_parquet({_sql_list([client_path])})")
+
+        self.client_columns = [
+            row[0] for row in self.connection.execute("DESCRIBE clients").fetchall()
+        ]
+
+        # The per-client join side, with the derived dimensions banded once here and stored
+        # as ENUM columns; queries join it instead of re-banding every deposit row
+        self.registry = registry or self.registry
+        self.derived_dimensions = self.registry.available(self.client_columns)
+        columns = ['client_id'] + [column for column in CLIENT_COLUMNS if column in self.client_columns]
+        client_rows = self.connection.execute(f"SELECT {', '.join(columns)} FROM clients").df()
+        positions = np.arange(len(client_rows))
+        for name, values in self.registry.broadcast(self.registry.client_codes(client_rows), positions).items():
+            client_rows[name] = values
+        self.connection.register('client_rows_frame', client_rows)
+        self.connection.execute("CREATE TABLE client_rows AS SELECT * FROM client_rows_frame")
+        self.connection.unregister('client_rows_frame')
+        self.calendar_bounds = self.connection.execute(
+            "SELECT MIN(gregorian_date), MAX(gregorian_date) FROM calendar"
+        ).fetchone()
+        self.sketches = sketches.DepositSketches(self.sketch_counts(), self.sketch_dims)
+
+    def _amount_select(self, paths):
+        columns = [row[0] for row in self.connection.execute(
+            f"DESCRIBE SELECT * FROM read_parquet({_sql_list(paths)})"
+        ).fetchall()]
+        if ingest.CENTS_COLUMN in columns:
+            return f"* EXCLUDE ({ingest.CENTS_COLUMN}), CAST({ingest.CENTS_COLUMN} AS BIGINT) AS deposit_amount"
+        # Dollar amounts from exported Parquet files are read as cents, rounded half to even
+        # like ingest.to_cents (ROUND would take 0.125 to 13 cents instead of 12)
+        return (f"* REPLACE (CAST(ROUND_EVEN(CAST(deposit_amount AS DOUBLE) * {ingest.CENTS}, 0) AS BIGINT)"
+                f" AS deposit_amount)")
+
+    def _deposit_view(self, name, paths):
+        self.connection.execute(
+            f"CREATE VIEW {name} AS SELECT {self._amount_select(paths)} FROM read_parquet({_sql_list(paths)})"
+        )
+
+    def _deposit_relation(self, filters):
+        # The deposits a filtered query reads: all of them, or only the files overlapping its date range
+        paths = ingest.overlapping_partitions(self.deposit_paths, filters.start_date, filters.end_date,
+                                              self.deposit_bounds)
+        if len(paths) == len(self.deposit_paths):
+            return 'deposits_raw'
+        if not paths:
+            return '(SELECT * FROM deposits_raw LIMIT 0)'
+        return f"(SELECT {self.deposit_select} FROM read_parquet({_sql_list(paths)}))"
+
+    @classmethod
+    def from_frames(cls, client_data, deposit_data, calendar_data, directory, **kwargs):
+        deposit_paths, client_path, history_path = write_parquet_store(client_data, deposit_data, directory,
+                                                                       kwargs.get('data_version'))
+        return cls(deposit_paths, client_path, calendar_data, history_path=history_path, **kwargs)
+
+    def _filtered_sql(self, filters):
+        # Month assignment mirrors merge_asof(direction='nearest') for dates outside the calendar
+        columns = [column for column in CLIENT_COLUMNS if column in self.client_columns]
+        columns += [bucketing.name for bucketing in self.derived_dimensions]
+        client_select = ', '.join(f"c.{column}" for column in columns)
+
+        conditions, params = [], []
+        if filters.start_date is not None:
+            conditions.append("d.deposit_date >= ?")
+            params.append(filters.start_date.to_pydatetime())
+        if filters.end_date is not None:
+            conditions.append("d.deposit_date <= ?")
+            params.append(filters.end_date.to_pydatetime())
+        if filters.regions is not None:
+            conditions.append("list_contains(?, c.client_geographical_region)")
+            params.append(list(filters.regions))
+        if filters.statuses is not None:
+            conditions.append("list_contains(?, c.client_residence_status)")
+            params.append(list(filters.statuses))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        low, high = self.calendar_bounds
+        sql = f"""
+            SELECT d.client_id, d.deposit_type, d.deposit_amount, d.deposit_cadence, d.deposit_date,
+                   cal.month_name, {client_select}
+            FROM {self._deposit_relation(filters)} d
+            JOIN client_rows c ON c.client_id = d.client_id
+            JOIN calendar cal ON cal.gregorian_date =
+                LEAST(GREATEST(CAST(d.deposit_date AS DATE), DATE '{low}'), DATE '{high}')
+            {where}
+        """
+        return sql, params
+
+    def scan(self, filters, columns=None):
+        sql, params = self._filtered_sql(filters)
+        select = ', '.join(columns) if columns is not None else '*'
+        return self.connection.cursor().execute(f"SELECT {select} FROM ({sql})", params).df()
+
+    def scan_chunks(self, filters, columns=None, chunk_rows=SCAN_CHUNK_ROWS):
+        # Arrow record batches straight from the query, so the selection is never materialized
+        sql, params = self._filtered_sql(filters)
+        select = ', '.join(columns) if columns is not None else '*'
+        cursor = self.connection.cursor()
+        reader = cursor.execute(f"SELECT {select} FROM ({sql})", params).fetch_record_batch(chunk_rows)
+        for batch in reader:
+            yield batch.to_pandas()
+
+    def sketch_counts(self):
+        # Bucketing and counting run inside DuckDB; only the sparse bucket counts come back
+        sql, params = self._filtered_sql(make_filters())
+        dims = self.sketch_dims
+        keys = ', '.join(['CAST(deposit_date AS DATE) AS deposit_date', 'month_name'] + dims)
+        groups = ', '.join(str(i) for i in range(1, len(dims) + 4))
+        return self.connection.cursor().execute(f"""
+            SELECT {keys}, {sketches.bucket_sql(f'(deposit_amount / {ingest.CENTS})')} AS bucket,
+                   COUNT(*) AS count, SUM(deposit_amount) / {ingest.CENTS} AS amount,
+                   SUM(CAST(deposit_amount AS DOUBLE) * deposit_amount) / {ingest.CENTS ** 2} AS squares
+            FROM ({sql})
+            GROUP BY {groups}
+        """, params).df()
+
+    def segment_metrics(self, filters, dims=(), month=None):
+        sql, params = self._filtered_sql(filters)
+        if month is not None:
+            keys = list(dims) or ['month_name']
+            sql = f"SELECT * FROM ({sql}) WHERE month_name = ?"
+            params = params + [month]
+        else:
+            keys = ['month_name'] + list(dims)
+
+        key_list = ', '.join(keys)
+        result = self.connection.cursor().execute(f"""
+            SELECT {key_list},
+                   CAST(SUM(deposit_amount) AS BIGINT) AS deposit_sum,
+                   COUNT(deposit_amount) AS deposit_count,
+                   STDDEV_SAMP(deposit_amount) AS deposit_std,
+                   COUNT(DISTINCT client_id) AS unique_clients
+            FROM ({sql})
+            WHERE {' AND '.join(f'{key} IS NOT NULL' for key in keys)}
+            GROUP BY {key_list}
+            ORDER BY {key_list}
+        """, params).df()
+        return finalize_segments(result, keys)
+
+    def daily_metrics(self, filters, dims=()):
+        sql, params = self._filtered_sql(filters)
+        keys = list(dims) + ['CAST(deposit_date AS DATE)']
+        result = self.connection.cursor().execute(f"""
+            SELECT {''.join(f'{dim}, ' for dim in dims)}CAST(deposit_date AS DATE) AS deposit_date,
+                   CAST(SUM(deposit_amount) AS BIGINT) AS deposit_sum,
+                   COUNT(deposit_amount) AS deposit_count,
+                   COUNT(DISTINCT client_id) AS unique_clients
+            FROM ({sql})
+            {'WHERE ' + ' AND '.join(f'{dim} IS NOT NULL' for dim in dims) if dims else ''}
+            GROUP BY {', '.join(keys)}
+            ORDER BY {', '.join(keys)}
+        """, params).df()
+        return finalize_daily(result, dims)
+
+    def client_metrics(self, filters, attributes=()):
+        sql, params = self._filtered_sql(filters)
+        attribute_select = ''.join(f", MIN({attribute}) AS {attribute}" for attribute in attributes)
+        result = self.connection.cursor().execute(f"""
+            SELECT client_id,
+                   MIN(deposit_date) AS first_date,
+                   MAX(deposit_date) AS last_date,
+                   arg_min(month_name, deposit_date) AS acquisition_month,
+                   CAST(SUM(deposit_amount) AS BIGINT) AS deposit_sum,
+                   COUNT(deposit_amount) AS deposit_count{attribute_select}
+            FROM ({sql})
+            GROUP BY client_id
+        """, params).df()
+        return finalize_clients(result, attributes)
+
+    def cohort_table(self, filters):
+        sql, params = self._filtered_sql(filters)
+        result = self.connection.cursor().execute(COHORT_SQL.format(sql=sql), params).df()
+        return finalize_cohorts(result)
+
+    def distinct_values(self, column):
+        if column not in self.client_columns:
+            return None
+        rows = self.connection.cursor().execute(
+            f"SELECT DISTINCT {column} FROM clients WHERE {column} IS NOT NULL ORDER BY 1"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def client_history(self, client_id):
+        low, high = self.calendar_bounds
+        result = self.connection.cursor().execute(f"""
+            SELECT d.*, cal.month_name
+            FROM client_deposits d
+            JOIN calendar cal ON cal.gregorian_date =
+                LEAST(GREATEST(CAST(d.deposit_date AS DATE), DATE '{low}'), DATE '{high}')
+            WHERE d.client_id = ?
+            ORDER BY d.deposit_date
+        """, [int(client_id)]).df()
+        return finalize_history(result)
+
+    def client_attributes(self, client_id):
+        result = self.connection.cursor().execute(
+            "SELECT * FROM clients WHERE client_id = ?", [int(client_id)]
+        ).df()
+        return result.iloc[0] if len(result) else None
+
+    def date_bounds(self):
+        low, high = self.connection.cursor().execute(
+            "SELECT MIN(deposit_date), MAX(deposit_date) FROM deposits_raw"
+        ).fetchone()
+        return pd.Timestamp(low), pd.Timestamp(high)
+
+
+def _sql_list(paths):
+    return '[' + ', '.join("'" + str(p).replace("'", "''") + "'" for p in paths) + ']'
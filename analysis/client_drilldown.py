@@ -0,0 +1,98 @@
+import streamlit as st
+import plotly.graph_objects as go
+
+from analysis import ingest
+
+def show_drilldown(backend):
+    st.header("🔎 Client Drill-Down")
+    st.markdown("""
+        > Look up a single client's attributes and full scheduled vs. actual deposit history.
+    """)
+
+    client_input = st.text_input("Client ID", key="drilldown_client_id").strip()
+    if not client_input:
+        st.info("Enter a client ID to see their deposit history.")
+        return
+
+    try:
+        client_id = int(client_input)
+    except ValueError:
+        st.error(f"'{client_input}' is not a valid client ID.")
+        return
+
+    # Both lookups are index seeks: sorted offsets in memory, the database's client index, or
+    # the client_id row-group statistics of DuckDB's client-sorted Parquet copy
+    attributes = backend.client_attributes(client_id)
+    history = backend.client_history(client_id)
+
+    if attributes is None and history.empty:
+        st.warning(f"No client found with ID {client_id}.")
+        return
+
+    # Client attributes
+    st.subheader("👤 Client Profile")
+    if attributes is not None:
+        profile = attributes.drop(labels='client_id', errors='ignore')
+        profile_cols = st.columns(max(len(profile), 1))
+        for col, (name, value) in zip(profile_cols, profile.items()):
+            with col:
+                st.metric(name.replace('client_', '').replace('_', ' ').title(), f"{value}")
+    else:
+        st.write("No attributes on file for this client.")
+
+    if history.empty:
+        st.write("This client has no deposits.")
+        return
+
+    # Scheduled vs. actual summary
+    st.subheader("💰 Deposit Summary")
+    by_type = history.groupby('deposit_type', observed=True)['deposit_amount'].agg(['sum', 'count'])
+    scheduled = ingest.to_dollars(by_type['sum'].get('Scheduled Deposit', 0))
+    actual = ingest.to_dollars(by_type['sum'].get('Actual Deposit', 0))
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Actual Deposits", f"${actual:,.2f}")
+    with col2:
+        st.metric("Scheduled Deposits", f"${scheduled:,.2f}")
+    with col3:
+        st.metric(
+            "Actual vs. Scheduled",
+            f"{actual / scheduled * 100:,.1f}%" if scheduled else "N/A"
+        )
+    with col4:
+        st.metric(
+            "Active Period",
+            f"{history['deposit_date'].min():%Y-%m-%d} to {history['deposit_date'].max():%Y-%m-%d}"
+        )
+
+    # Cumulative history per deposit type
+    fig = go.Figure()
+    for deposit_type, deposits in history.groupby('deposit_type', observed=True):
+        fig.add_trace(go.Scatter(
+            x=deposits['deposit_date'],
+            y=ingest.to_dollars(deposits['deposit_amount'].cumsum()),
+            name=f"{deposit_type} (cumulative)",
+            mode='lines+markers',
+            line=dict(shape='hv')
+        ))
+    fig.update_layout(
+        height=400,
+        title_text="Cumulative Deposits by Type",
+        xaxis_title="Date",
+        yaxis_title="Cumulative Deposits ($)"
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    # Full history
+    st.subheader("📜 Deposit History")
+    st.dataframe(
+        history.assign(deposit_amount=ingest.to_dollars(history['deposit_amount'])).rename(columns={
+            'deposit_date': 'Date', 'month_name': 'Month', 'deposit_type': 'Type',
+            'deposit_cadence': 'Cadence', 'deposit_amount': 'Amount ($)'
+        })[['Date', 'Month', 'Type', 'Cadence', 'Amount ($)']].style.format({
+            'Date': '{:%Y-%m-%d}',
+            'Amount ($)': '${:,.2f}'
+        }),
+        hide_index=True
+    )
@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class ClientIndex:
+    # Deposits sorted by (client_id, deposit_date) plus an offsets array, so one
+    # client's history is a binary search and a contiguous slice instead of a scan
+    def __init__(self, deposit_data, client_data):
+        ids = deposit_data['client_id'].to_numpy()
+        order = np.lexsort((deposit_data['deposit_date'].to_numpy(), ids))
+        self.deposits = deposit_data.iloc[order].reset_index(drop=True)
+
+        sorted_ids = ids[order]
+        self.client_ids, starts = np.unique(sorted_ids, return_index=True)
+        self.offsets = np.append(starts, len(sorted_ids))
+
+        self.clients = client_data.sort_values('client_id').reset_index(drop=True)
+        self._client_keys = self.clients['client_id'].to_numpy()
+
+    def __len__(self):
+        return len(self.client_ids)
+
+    def _find(self, keys, client_id):
+        position = int(np.searchsorted(keys, client_id))
+        if position < len(keys) and keys[position] == client_id:
+            return position
+        return None
+
+    def history(self, client_id):
+        position = self._find(self.client_ids, client_id)
+        if position is None:
+            return self.deposits.iloc[0:0]
+        return self.deposits.iloc[self.offsets[position]:self.offsets[position + 1]]
+
+    def attributes(self, client_id):
+        position = self._find(self._client_keys, client_id)
+        return self.clients.iloc[position] if position is not None else None
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+# Post-campaign lift is bucketed into weeks and projected over this many weeks
+BUCKET_DAYS = 7
+HORIZON_WEEKS = 52
+
+MODELS = ['exponential', 'power_law']
+
+
+def incremental_matrix(daily, segment, baseline_months, campaign_month, post_months):
+    # Segments x weeks-since-campaign-start matrix of deposits above each segment's
+    # baseline daily run rate, from daily_metrics(filters, dims=['month_name', segment])
+    frame = daily['deposit_sum'].reset_index()
+    days = frame.groupby('month_name')['deposit_date'].nunique()
+
+    in_baseline = frame['month_name'].isin(baseline_months)
+    baseline_days = days.reindex(baseline_months).sum()
+    baseline_rate = frame[in_baseline].groupby(segment)['deposit_sum'].sum() / baseline_days
+
+    post = frame[frame['month_name'].isin([campaign_month] + list(post_months))]
+    if post.empty:
+        return pd.DataFrame(dtype='float64')
+    start = post.loc[post['month_name'] == campaign_month, 'deposit_date'].min()
+    if pd.isna(start):
+        start = post['deposit_date'].min()
+    week = ((post['deposit_date'] - start).dt.days // BUCKET_DAYS).rename('week')
+
+    # Days actually covered by each bucket, so a short final week is not under-counted
+    bucket_days = post.groupby(week)['deposit_date'].nunique()
+    totals = post.groupby([post[segment], week])['deposit_sum'].sum().unstack('week', fill_value=0.0)
+    expected = baseline_rate.reindex(totals.index).fillna(0).to_numpy()[:, None] * bucket_days.to_numpy()[None, :]
+    return totals - expected
+
+
+def _batched_line(x, y, mask):
+    # Least-squares slope and intercept of y on x for every row at once, using only masked points
+    w = mask.astype('float64')
+    n = w.sum(axis=1)
+    sx, sy = (w * x).sum(axis=1), (w * y).sum(axis=1)
+    sxx, sxy = (w * x * x).sum(axis=1), (w * x * y).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx ** 2)
+        intercept = (sy - slope * sx) / n
+    return slope, intercept, n
+
+
+def fit_decay(incremental, horizon=HORIZON_WEEKS):
+    # Fit y = A * exp(-k t) and y = A * (t + 1) ** -b to every segment's weekly lift in
+    # two batched log-linear least-squares solves; keep the better model per segment
+    y = incremental.to_numpy(dtype='float64')
+    t = np.broadcast_to(incremental.columns.to_numpy(dtype='float64'), y.shape)
+    mask = y > 0
+    log_y = np.log(np.where(mask, y, 1.0))
+
+    fits = {}
+    for model, x in [('exponential', t), ('power_law', np.log(t + 1))]:
+        slope, intercept, n = _batched_line(x, log_y, mask)
+        amplitude, rate = np.exp(intercept), -slope
+        curve = amplitude[:, None] * np.exp(-rate[:, None] * x)
+        sse = np.where(np.isfinite(curve), (y - curve) ** 2, np.inf).sum(axis=1)
+        fits[model] = amplitude, rate, np.where(n >= 2, sse, np.inf)
+
+    use_power = fits['power_law'][2] < fits['exponential'][2]
+    amplitude = np.where(use_power, fits['power_law'][0], fits['exponential'][0])
+    rate = np.where(use_power, fits['power_law'][1], fits['exponential'][1])
+    sse = np.where(use_power, fits['power_law'][2], fits['exponential'][2])
+    decaying = np.isfinite(sse) & (rate > 0)
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        half_life = np.where(use_power, 2 ** (1 / rate) - 1, np.log(2) / rate)
+        exponential_value = amplitude * (1 - np.exp(-rate * horizon)) / rate
+        power_value = np.where(
+            np.isclose(rate, 1),
+            amplitude * np.log(horizon + 1),
+            amplitude * ((horizon + 1) ** (1 - rate) - 1) / (1 - rate)
+        )
+        long_run = np.where(use_power, power_value, exponential_value)
+
+    return pd.DataFrame({
+        'model': np.where(use_power, 'power_law', 'exponential'),
+        'amplitude': amplitude,
+        'decay_rate': rate,
+        'half_life_weeks': np.where(decaying, half_life, np.inf),
+        'observed_incremental': y.sum(axis=1),
+        'long_run_incremental': np.where(decaying, long_run, np.nan),
+        'weeks_fitted': mask.sum(axis=1),
+    }, index=incremental.index)
+
+
+def lift_decay(daily, segment, baseline_months, campaign_month, post_months, horizon=HORIZON_WEEKS):
+    # Per-segment curves plus an 'All' row fitted to the summed lift
+    incremental = incremental_matrix(daily, segment, baseline_months, campaign_month, post_months)
+    if incremental.empty:
+        return fit_decay(incremental, horizon)
+    incremental.loc['All'] = incremental.sum()
+    return fit_decay(incremental, horizon)
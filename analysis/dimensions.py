@@ -0,0 +1,112 @@
+import json
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# A client column cut into right-closed (low, high] bands, like pd.cut(column, bins, labels)
+Bucketing = namedtuple('Bucketing', ['name', 'title', 'column', 'bins', 'labels'])
+
+AGE_GROUP = Bucketing('age_group', 'Age Group', 'client_age',
+                      [0, 25, 35, 45, 55, 100], ['18-25', '26-35', '36-45', '46-55', '55+'])
+
+# Code of a client outside every band or missing the source value; reads back as NaN
+MISSING_CODE = -1
+
+
+def check_bucketing(bucketing):
+    bins = np.asarray(bucketing.bins, dtype='float64')
+    if len(bins) < 2 or not (np.diff(bins) > 0).all():
+        raise ValueError(f"Dimension '{bucketing.name}': bins must be increasing")
+    if len(bucketing.labels) != len(bins) - 1:
+        raise ValueError(f"Dimension '{bucketing.name}': expected {len(bins) - 1} labels, got {len(bucketing.labels)}")
+    if len(bucketing.labels) > np.iinfo('int8').max:
+        raise ValueError(f"Dimension '{bucketing.name}': too many bands")
+    return bucketing
+
+
+def band_codes(values, bins):
+    # int8 band of every value, the same (low, high] intervals as pd.cut
+    values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy('float64')
+    bins = np.asarray(bins, dtype='float64')
+    codes = np.searchsorted(bins, values, side='left') - 1
+    inside = (values > bins[0]) & (values <= bins[-1])
+    return np.where(inside, codes, MISSING_CODE).astype('int8')
+
+
+class DimensionRegistry:
+    # Derived client dimensions. Each is banded once per client at load time into compact
+    # int8 codes and broadcast to the deposits by client position, so views and rollups
+    # group by it like any stored column instead of re-cutting every deposit row
+    def __init__(self, bucketings=(AGE_GROUP,)):
+        self.bucketings = {bucketing.name: check_bucketing(bucketing) for bucketing in bucketings}
+
+    def __iter__(self):
+        return iter(self.bucketings.values())
+
+    def __len__(self):
+        return len(self.bucketings)
+
+    @property
+    def names(self):
+        return list(self.bucketings)
+
+    @property
+    def fingerprint(self):
+        # Stable digest of the configuration, for data versions and cache keys
+        config = json.dumps([bucketing._asdict() for bucketing in self], sort_keys=True, default=float)
+        return pd.util.hash_pandas_object(pd.Series([config]), index=False).iloc[0].item()
+
+    def available(self, columns):
+        # The dimensions whose source column is present
+        return [bucketing for bucketing in self if bucketing.column in columns]
+
+    def client_codes(self, client_data):
+        # {name: int8 codes aligned with client_data's rows}
+        return {
+            bucketing.name: band_codes(client_data[bucketing.column], bucketing.bins)
+            for bucketing in self.available(client_data.columns)
+        }
+
+    def decode(self, name, codes):
+        # Categorical over the band labels; the codes are used as they are, without a copy
+        return pd.Categorical.from_codes(codes, categories=self.bucketings[name].labels)
+
+    def broadcast(self, codes, positions):
+        # Per-row categoricals from per-client codes; positions index the client rows
+        # (-1 where a row has no client)
+        return {
+            name: self.decode(name, np.where(positions >= 0, client_codes[positions], MISSING_CODE).astype('int8'))
+            for name, client_codes in codes.items()
+        }
+
+    def band_sql(self, name, column):
+        # The band label computed from the source column, for engines that cannot store codes
+        bucketing = self.bucketings[name]
+        cases = ' '.join(
+            f"WHEN {column} > {low} AND {column} <= {high} THEN '{label}'"
+            for low, high, label in zip(bucketing.bins[:-1], bucketing.bins[1:], bucketing.labels)
+        )
+        return f"CASE {cases} END"
+
+    @classmethod
+    def from_file(cls, path):
+        # JSON list of {"name", "title", "column", "bins", "labels"} objects
+        with open(path, encoding='utf-8') as handle:
+            config = json.load(handle)
+        try:
+            return cls([Bucketing(**entry) for entry in config])
+        except TypeError as e:
+            raise ValueError(f"Invalid dimension in {path}: {e}") from e
+
+
+DEFAULT_REGISTRY = DimensionRegistry()
+
+
+def load_registry(path=None):
+    return DimensionRegistry.from_file(path) if path else DEFAULT_REGISTRY
+
+
+def titles(bucketings):
+    # {display title: column name}, for breakdown selectors
+    return {bucketing.title: bucketing.name for bucketing in bucketings}
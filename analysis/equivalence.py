@@ -0,0 +1,683 @@
+import argparse
+import os
+import tempfile
+import time
+from collections import defaultdict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from analysis import (backends, campaign_analysis, decay, dimensions, export, figure_cache, forecast, graph, ingest,
+                      kpis, loadtest, ltv, sampling, sketches, snapshots, sql_source, strategy_recommendations,
+                      validation, what_if_analysis)
+
+# Every optimized path must reproduce the reference tables within these tolerances; the
+# KPI tables are rounded to cents, so a value may land one cent away on a rounding boundary
+RTOL = 1e-9
+ATOL = 0.01
+
+# Approximate paths pass when at least this share of their 95% intervals cover the exact value
+MIN_COVERAGE = 0.9
+
+PATHS = ['pandas', 'duckdb', 'sqlite', 'snapshots', 'graph', 'figures', 'sampled']
+VIEWS = ['campaign', 'strategy', 'what_if']
+
+# Page graph node holding each view's tables; the What-If view is checked node by node
+VIEW_NODES = {
+    'campaign': (campaign_analysis.GRAPH, 'tables'),
+    'strategy': (strategy_recommendations.GRAPH, 'tables'),
+    'what_if': (what_if_analysis.GRAPH, 'monthly_metrics'),
+}
+
+# The What-If sliders' default growth rates, at which the scenario nodes are checked
+SCENARIO_GROWTH = {'pessimistic_growth': -0.2, 'optimistic_growth': 0.2}
+
+# Segmentations whose sampled estimates are checked against their error bars, besides the
+# derived dimensions
+COVERAGE_DIMS = [(), ('deposit_type',), ('deposit_cadence',), ('client_geographical_region',),
+                 ('client_residence_status',)]
+
+# (path, view, filters, table, description) of a table that differs from the reference
+Mismatch = namedtuple('Mismatch', ['path', 'view', 'filters', 'table', 'problem'])
+
+# prepare(view, filters) runs untimed before each timed compute(view, filters) -> tables;
+# approximate paths are checked by the coverage of their error bars instead of table diffs
+ComputePath = namedtuple('ComputePath', ['name', 'backend', 'build_seconds', 'prepare', 'compute', 'approximate'])
+
+
+class ReferenceBackend:
+    # The straightforward computation the optimized paths must reproduce, sharing none of
+    # their query code: amounts are plain dollar floats, each deposit takes the month of its
+    # calendar day, derived dimensions are cut per row with pd.cut, and every table masks the
+    # rows afresh and aggregates them with a plain groupby. Only the LTV, lift-decay and
+    # forecast models are shared, fed with the reference's own aggregates
+    def __init__(self, client_data, deposit_data, calendar_data, registry=None):
+        registry = registry or dimensions.DEFAULT_REGISTRY
+        self.derived_dimensions = registry.available(client_data.columns)
+        rows = deposit_data[['client_id', 'deposit_type', 'deposit_cadence', 'deposit_date']].astype(
+            {'deposit_type': object, 'deposit_cadence': object}
+        )
+        # The inputs hold the dashboard's integer cents; the reference works on the dollars
+        rows['deposit_amount'] = deposit_data['deposit_amount'].to_numpy('float64') / 100
+
+        calendar = calendar_data.set_index(calendar_data['gregorian_date'].dt.normalize())['month_name']
+        days = rows['deposit_date'].dt.normalize().clip(calendar.index.min(), calendar.index.max())
+        rows['month_name'] = days.map(calendar).astype(object)
+
+        rows = rows.merge(client_data, on='client_id', how='inner')
+        for bucketing in self.derived_dimensions:
+            rows[bucketing.name] = pd.cut(rows[bucketing.column], bins=bucketing.bins,
+                                          labels=bucketing.labels).astype(object)
+        self.rows = rows
+        self.client_data = client_data
+
+    def select(self, filters):
+        rows = self.rows
+        mask = np.ones(len(rows), dtype=bool)
+        if filters.start_date is not None:
+            mask &= (rows['deposit_date'] >= filters.start_date).to_numpy()
+        if filters.end_date is not None:
+            mask &= (rows['deposit_date'] <= filters.end_date).to_numpy()
+        if filters.regions is not None:
+            mask &= rows['client_geographical_region'].isin(filters.regions).to_numpy()
+        if filters.statuses is not None:
+            mask &= rows['client_residence_status'].isin(filters.statuses).to_numpy()
+        return rows[mask]
+
+    def distinct_values(self, column):
+        if column not in self.client_data.columns:
+            return None
+        return sorted(self.client_data[column].dropna().unique())
+
+    def date_bounds(self):
+        return self.rows['deposit_date'].min(), self.rows['deposit_date'].max()
+
+    @staticmethod
+    def _segments(data, keys):
+        # Dollar totals, counts, means, sample stds and distinct clients per group
+        return data.groupby(keys, sort=True).agg(
+            deposit_sum=('deposit_amount', 'sum'),
+            deposit_mean=('deposit_amount', 'mean'),
+            deposit_count=('deposit_amount', 'count'),
+            deposit_std=('deposit_amount', 'std'),
+            unique_clients=('client_id', 'nunique'),
+        )
+
+    @staticmethod
+    def _daily(data, keys=()):
+        day = data['deposit_date'].dt.normalize().rename('deposit_date')
+        return data.groupby([data[key] for key in keys] + [day], sort=True).agg(
+            deposit_sum=('deposit_amount', 'sum'),
+            deposit_count=('deposit_amount', 'count'),
+            unique_clients=('client_id', 'nunique'),
+        )
+
+    def segments(self, filters, dims=()):
+        return self._segments(self.select(filters), ['month_name'] + list(dims))
+
+    def quantiles(self, filters, by=(), q=sketches.DEFAULT_QUANTILES):
+        # Exact counterpart of DepositSketches.quantiles: the sketches read the bucket of the
+        # element at rank q * (n - 1), rounded down
+        data = self.select(filters)
+        amount = data['deposit_amount']
+        grouped = amount.groupby([data[key] for key in by] if by else np.zeros(len(data)))
+        result = pd.DataFrame({'deposit_count': grouped.count(), 'deposit_mean': grouped.mean()})
+        for quantile in q:
+            result[f"p{quantile * 100:g}"] = grouped.quantile(quantile, interpolation='lower')
+        return result if by else result.reset_index(drop=True)
+
+    def tables(self, view, filters):
+        data = self.select(filters)
+        if view == 'campaign':
+            return self._campaign_tables(data)
+        if view == 'strategy':
+            tables = {
+                'region_metrics': self._attribute_table(data, 'client_geographical_region'),
+                'residence_metrics': self._attribute_table(data, 'client_residence_status'),
+            }
+            for bucketing in self.derived_dimensions:
+                tables[kpis.dimension_table(bucketing.name)] = self._attribute_table(data, bucketing.name)
+            return tables
+        return node_tables(self._what_if_nodes(data))
+
+    def figure_tables(self, view, filters):
+        # The values the What-If figures plot, built straight from the reference nodes
+        if view != 'what_if':
+            return {}
+        nodes = self._what_if_nodes(self.select(filters))
+        return figure_tables(nodes, lambda name, build, **widgets: build())
+
+    def _campaign_tables(self, data):
+        monthly = self._segments(data, ['month_name'])
+        monthly_metrics = pd.DataFrame({
+            'Total Deposits ($)': monthly['deposit_sum'],
+            'Average Deposit ($)': monthly['deposit_mean'],
+            'Number of Deposits': monthly['deposit_count'],
+            'Deposit Std ($)': monthly['deposit_std'],
+            'Unique Clients': monthly['unique_clients'],
+            'Total Transactions': monthly['deposit_count'],
+        }).round(2)
+
+        totals = monthly_metrics['Total Deposits ($)']
+        baseline = totals[kpis.BASELINE_MONTHS].mean()
+        campaign = totals[kpis.CAMPAIGN_MONTH]
+        clients = monthly_metrics['Unique Clients']
+        averages = monthly_metrics['Average Deposit ($)']
+        incremental_campaign = campaign - baseline
+        incremental_post = (totals[kpis.POST_CAMPAIGN_MONTHS] - baseline).sum()
+        total_incremental = incremental_campaign + incremental_post
+        projected_baseline = baseline * (1 + totals.pct_change().mean()) ** 5
+        lift = (campaign - baseline) / baseline
+
+        # Per-client totals feed the shared LTV model
+        ordered = data.sort_values('deposit_date', kind='stable')
+        client_rows = ordered.groupby('client_id', sort=True).agg(
+            first_date=('deposit_date', 'min'),
+            last_date=('deposit_date', 'max'),
+            acquisition_month=('month_name', 'first'),
+            deposit_sum=('deposit_amount', 'sum'),
+            deposit_count=('deposit_amount', 'count'),
+            **{attribute: (attribute, 'first') for attribute in ltv.SEGMENT_ATTRIBUTES}
+        )
+        client_ltv = ltv.client_ltv(client_rows, segment=kpis.LTV_SEGMENT)
+        acquired = client_ltv.loc[client_ltv['acquisition_month'] == kpis.CAMPAIGN_MONTH, 'ltv']
+        acquisition_cost = kpis.CAMPAIGN_COST / len(acquired) if len(acquired) else float('inf')
+        lifetime_value = acquired.mean() if len(acquired) else 0.0
+
+        first_month = ordered.groupby('client_id')['month_name'].transform('first')
+        client_cohorts = pd.crosstab(first_month.rename('acquisition_month'), ordered['month_name'],
+                                     values=ordered['client_id'], aggfunc='nunique')
+
+        def segment_totals(dim):
+            segments = self._segments(data, ['month_name', dim])
+            return pd.DataFrame({'deposit_amount': segments['deposit_sum'],
+                                 'client_id': segments['unique_clients']}).round(2)
+
+        def campaign_performance(dim):
+            segments = self._segments(data[data['month_name'] == kpis.CAMPAIGN_MONTH], [dim])
+            performance = segments[['deposit_mean', 'deposit_sum', 'deposit_count', 'unique_clients']].round(2)
+            performance.columns = kpis.PERFORMANCE_COLUMNS
+            return performance
+
+        return {
+            'monthly_metrics': monthly_metrics,
+            'kpis': pd.DataFrame([{
+                'baseline_deposits': baseline,
+                'campaign_deposits': campaign,
+                'post_campaign_deposits': totals[kpis.POST_CAMPAIGN_MONTHS].mean(),
+                'growth_vs_baseline': (campaign / baseline - 1) * 100,
+                'client_growth': (clients[kpis.CAMPAIGN_MONTH] / clients[kpis.BASELINE_MONTHS].mean() - 1) * 100,
+                'avg_deposit_growth': (averages[kpis.CAMPAIGN_MONTH] / averages[kpis.BASELINE_MONTHS].mean() - 1) * 100,
+            }]),
+            'roi': pd.DataFrame([{
+                'incremental_campaign': incremental_campaign,
+                'incremental_post': incremental_post,
+                'total_incremental': total_incremental,
+                'roi': (total_incremental / kpis.CAMPAIGN_COST - 1) * 100,
+            }]),
+            'success': pd.DataFrame([{
+                'acquisition_cost': acquisition_cost,
+                'estimated_lifetime_value': lifetime_value,
+                'roi_multiple': lifetime_value / acquisition_cost if acquisition_cost > 0 else 0,
+            }]),
+            'month6': pd.DataFrame([{
+                'projected_baseline': projected_baseline,
+                'current_total_impact': total_incremental,
+                'projected_impact': projected_baseline * lift,
+            }]),
+            'daily_metrics': self._daily(data),
+            'deposit_type_metrics': segment_totals('deposit_type'),
+            'cadence_metrics': segment_totals('deposit_cadence'),
+            'deposit_type_performance': campaign_performance('deposit_type'),
+            'cadence_performance': campaign_performance('deposit_cadence'),
+            'ltv_cohorts': ltv.ltv_by_cohort(client_ltv, kpis.LTV_SEGMENT, kpis.CAMPAIGN_MONTH, kpis.CAMPAIGN_COST),
+            'client_cohorts': client_cohorts.fillna(0).astype('int64'),
+            'lift_decay': decay.lift_decay(
+                self._daily(data, ['month_name', kpis.DECAY_SEGMENT]), kpis.DECAY_SEGMENT,
+                kpis.BASELINE_MONTHS, kpis.CAMPAIGN_MONTH, kpis.POST_CAMPAIGN_MONTHS
+            ),
+        }
+
+    def _attribute_table(self, data, attribute):
+        segments = self._segments(data, ['month_name', attribute])
+        return pd.DataFrame({
+            'Total Deposits': segments['deposit_sum'],
+            'Average Deposit': segments['deposit_mean'],
+            'Unique Clients': segments['unique_clients'],
+        }).round(2).reset_index()
+
+    def _what_if_nodes(self, data):
+        monthly = self._segments(data, ['month_name'])
+        monthly_metrics = pd.DataFrame({
+            'Total Deposits': monthly['deposit_sum'],
+            'Average Deposit': monthly['deposit_mean'],
+            'Std Deposit': monthly['deposit_std'],
+            'Unique Clients': monthly['unique_clients'],
+        }).round(2)
+        totals = monthly_metrics['Total Deposits']
+
+        month6 = forecast.forecast_segments(monthly_metrics[['Total Deposits']].T, horizon=1, level=0.95).iloc[0]
+        projection = {
+            'avg_growth': month6['growth'],
+            'month5_deposits': month6['last_actual'],
+            'projected_month6': month6['forecast'],
+            'lower_bound': month6['lower'],
+            'upper_bound': month6['upper'],
+        }
+        scenarios = {
+            'Pessimistic': month6['last_actual'] * (1 + SCENARIO_GROWTH['pessimistic_growth']),
+            'Expected': month6['forecast'],
+            'Optimistic': month6['last_actual'] * (1 + SCENARIO_GROWTH['optimistic_growth']),
+        }
+        baseline = totals[kpis.BASELINE_MONTHS].mean()
+        realized = (totals[[kpis.CAMPAIGN_MONTH] + kpis.POST_CAMPAIGN_MONTHS] - baseline).sum()
+        roi_scenarios = {
+            scenario: ((realized + value - baseline) / kpis.CAMPAIGN_COST - 1) * 100
+            for scenario, value in scenarios.items()
+        }
+
+        segment_forecasts = {}
+        for label, dim in forecast_dimensions(self).items():
+            series = data.groupby([dim, 'month_name'])['deposit_amount'].sum().unstack('month_name')
+            result = forecast.forecast_segments(series, horizon=1, level=0.95)
+            months = series.reindex(columns=kpis.BASELINE_MONTHS + [kpis.CAMPAIGN_MONTH])
+            segment_baseline = months[kpis.BASELINE_MONTHS].mean(axis=1)
+            result['campaign_lift'] = (months[kpis.CAMPAIGN_MONTH] - segment_baseline) / segment_baseline
+            result['projected_campaign_return'] = result['forecast'] * result['campaign_lift']
+            segment_forecasts[label] = result
+
+        return {
+            'monthly_metrics': monthly_metrics,
+            'projection': projection,
+            'scenarios': scenarios,
+            'roi_scenarios': roi_scenarios,
+            'segment_forecast': segment_forecasts,
+        }
+
+
+def forecast_dimensions(backend):
+    # {label: column} of the What-If forecast selector
+    return {**what_if_analysis.FORECAST_DIMENSIONS, **dimensions.titles(backend.derived_dimensions)}
+
+
+def what_if_nodes(backend, filters, snapshot_store=None):
+    # The What-If page's graph nodes as the page evaluates them: the scenarios at the
+    # sliders' default growth rates and a segment forecast per forecast dimension
+    inputs = {**graph.filter_inputs(backend, filters), **SCENARIO_GROWTH}
+    resources = {'backend': backend, 'snapshot_store': snapshot_store}
+    memoize = backend.data_version is not None
+    nodes = {
+        name: what_if_analysis.GRAPH.evaluate(name, inputs, resources, memoize)
+        for name in ['monthly_metrics', 'projection', 'scenarios', 'roi_scenarios']
+    }
+    nodes['segment_forecast'] = {}
+    for label, dim in forecast_dimensions(backend).items():
+        inputs['forecast_dimension'] = dim
+        nodes['segment_forecast'][label] = what_if_analysis.GRAPH.evaluate('segment_forecast', inputs, resources,
+                                                                          memoize)
+    return nodes
+
+
+def node_tables(nodes):
+    # What-If nodes as tables: dict nodes become one-row tables
+    tables = {name: pd.DataFrame([nodes[name]]) for name in ['projection', 'scenarios', 'roi_scenarios']}
+    tables['monthly_metrics'] = nodes['monthly_metrics']
+    for label, segment_forecast in nodes['segment_forecast'].items():
+        tables[f"segment_forecast ({label})"] = segment_forecast
+    return tables
+
+
+def figure_table(fig):
+    # One row per plotted point: trace, x, y and the ends of its error bar (NaN without one)
+    frames = []
+    for trace in fig.to_plotly_json()['data']:
+        y = np.asarray(trace['y'], dtype='float64')
+        error = trace.get('error_y') or {}
+        frames.append(pd.DataFrame({
+            'trace': trace.get('name'),
+            'x': [str(value) for value in trace['x']],
+            'y': y,
+            'upper': y + np.asarray(error['array'], dtype='float64') if 'array' in error else np.nan,
+            'lower': y - np.asarray(error['arrayminus'], dtype='float64') if 'arrayminus' in error else np.nan,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def figure_tables(nodes, figure):
+    # The What-If figures of a node set, as plotted values; figure(name, build, **widgets)
+    # returns the figure, e.g. through figure_cache.cached_figure
+    growth = {'pessimistic': SCENARIO_GROWTH['pessimistic_growth'], 'optimistic': SCENARIO_GROWTH['optimistic_growth']}
+    tables = {
+        'scenarios figure': figure_table(figure(
+            'scenarios', lambda: what_if_analysis.scenario_figure(nodes['scenarios']), **growth
+        )),
+        'roi figure': figure_table(figure(
+            'roi', lambda: what_if_analysis.roi_figure(nodes['roi_scenarios']), **growth
+        )),
+    }
+    for label, segment_forecast in nodes['segment_forecast'].items():
+        tables[f"segment_forecast figure ({label})"] = figure_table(figure(
+            'segment_forecast',
+            lambda: what_if_analysis.segment_forecast_figure(segment_forecast, label),
+            dimension=label
+        ))
+    return tables
+
+
+def _canonical(table):
+    # Flat columns and rows sorted by their keys, so engines that order groups differently
+    # (e.g. SQLite sorting band labels as text) still line up
+    table = export.flat_table(table)
+    keys = [
+        column for column in table.columns
+        if not pd.api.types.is_numeric_dtype(table[column]) or pd.api.types.is_bool_dtype(table[column])
+    ]
+    # Categorical keys sort by label like the plain ones, not by category order
+    table = table.astype({column: object for column in keys if isinstance(table[column].dtype, pd.CategoricalDtype)})
+    if keys:
+        table = table.sort_values(keys, kind='stable').reset_index(drop=True)
+    return table, keys
+
+
+def table_diff(expected, actual, rtol=RTOL, atol=ATOL):
+    # None when the tables agree within tolerance, else a one-line description of the first difference
+    (expected, keys), (actual, _) = _canonical(expected), _canonical(actual)
+    if list(expected.columns) != list(actual.columns):
+        return f"columns {list(actual.columns)} instead of {list(expected.columns)}"
+    if len(expected) != len(actual):
+        return f"{len(actual)} rows instead of {len(expected)}"
+    for column in expected.columns:
+        want, got = expected[column], actual[column]
+        if pd.api.types.is_numeric_dtype(want) and pd.api.types.is_numeric_dtype(got):
+            want, got = want.to_numpy('float64'), got.to_numpy('float64')
+            close = np.isclose(got, want, rtol=rtol, atol=atol, equal_nan=True)
+        elif pd.api.types.is_datetime64_any_dtype(want):
+            close = (pd.to_datetime(got) == want).to_numpy() | (want.isna() & got.isna()).to_numpy()
+            want, got = want.to_numpy(), got.to_numpy()
+        else:
+            want, got = want.astype(object).to_numpy(), got.astype(object).to_numpy()
+            close = (want == got) | (pd.isna(want) & pd.isna(got))
+        if not close.all():
+            row = int(np.flatnonzero(~close)[0])
+            where = f" at {tuple(expected.loc[row, keys])}" if keys else ''
+            return (f"{column}: {int((~close).sum())} of {len(close)} values differ, "
+                    f"first {got[row]!r} vs {want[row]!r}{where}")
+    return None
+
+
+def sketch_diff(reference, backend, filters, by):
+    # Counts and means are exact; quantiles must fall within the sketches' relative accuracy
+    expected = reference.quantiles(filters, by)
+    actual = backend.sketches.quantiles(filters, by)[list(expected.columns)]
+    quantile_columns = [column for column in expected.columns if column.startswith('p')]
+    moments = table_diff(expected.drop(columns=quantile_columns), actual.drop(columns=quantile_columns))
+    if moments is not None:
+        return moments
+    return table_diff(expected[quantile_columns], actual[quantile_columns],
+                      rtol=sketches.RELATIVE_ACCURACY * (1 + 1e-9), atol=0)
+
+
+def coverage(reference, sampled, filters, dims, z=sampling.Z_95):
+    # (cells, cells whose 95% interval covers the exact value) over the deposit totals,
+    # counts and means of one segmentation
+    expected = reference.segments(filters, dims)
+    estimate = backends.in_dollars(sampled.segment_metrics(filters, dims)).reindex(expected.index)
+    errors = backends.in_dollars(sampled.segment_errors(filters, dims)).reindex(expected.index)
+    cells = covered = 0
+    for column in ['deposit_sum', 'deposit_count', 'deposit_mean']:
+        deviation = (estimate[column] - expected[column]).abs().to_numpy('float64')
+        # Estimates are rounded to whole cents and deposits; fully sampled cells match exactly
+        rounding = 1 if column == 'deposit_count' else 0.01
+        margin = z * errors[column].fillna(0).to_numpy('float64') + rounding
+        cells += len(deviation)
+        covered += int((deviation <= margin).sum())
+    return cells, covered
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def clear_graphs():
+    for compute_graph, _ in VIEW_NODES.values():
+        compute_graph.clear()
+
+
+def view_tables(view, backend, filters, snapshot_store=None):
+    # A view's tables as the dashboard computes them; the What-If ones are its graph nodes
+    if view == 'what_if':
+        return node_tables(what_if_nodes(backend, filters, snapshot_store))
+    return kpis.load_tables(view, backend, filters, snapshot_store)
+
+
+def build_paths(client_data, deposit_data, calendar_data, workdir, names=PATHS, registry=None,
+                fraction=sampling.DEFAULT_FRACTION, data_version='equivalence'):
+    # The compute paths under test, each timed as it is built; paths whose engine is not
+    # installed are skipped with a note
+    paths, notes = [], []
+    pandas_backend, seconds = _timed(
+        lambda: backends.PandasBackend(client_data, deposit_data, calendar_data,
+                                       data_version=data_version, registry=registry)
+    )
+
+    def plain(backend):
+        return lambda view, filters: view_tables(view, backend, filters)
+
+    def cold(view, filters):
+        # Every path starts from empty graph memos, so it never reads another path's nodes
+        clear_graphs()
+
+    if 'pandas' in names:
+        paths.append(ComputePath('pandas', pandas_backend, seconds, cold, plain(pandas_backend), False))
+    if 'duckdb' in names:
+        try:
+            backend, seconds = _timed(lambda: backends.DuckDBBackend.from_frames(
+                client_data, deposit_data, calendar_data, os.path.join(workdir, 'parquet'),
+                data_version=f"{data_version}-duckdb", registry=registry
+            ))
+            paths.append(ComputePath('duckdb', backend, seconds, cold, plain(backend), False))
+        except ImportError as e:
+            notes.append(f"duckdb skipped: {e}")
+    if 'sqlite' in names:
+        def build_sqlite():
+            database = os.path.join(workdir, 'equivalence.db')
+            sql_source.build_database(database, client_data, deposit_data, calendar_data)
+            return sql_source.SQLiteBackend(sql_source.SQLiteSource(database),
+                                            data_version=f"{data_version}-sqlite", registry=registry)
+        backend, seconds = _timed(build_sqlite)
+        paths.append(ComputePath('sqlite', backend, seconds, cold, plain(backend), False))
+    if 'snapshots' in names:
+        # Timed on the second load, which reads the snapshot the first one wrote
+        store = snapshots.SnapshotStore(os.path.join(workdir, 'snapshots'))
+
+        def write_snapshot(view, filters):
+            view_tables(view, pandas_backend, filters, store)
+            clear_graphs()
+        paths.append(ComputePath(
+            'snapshots', pandas_backend, 0.0, write_snapshot,
+            lambda view, filters: view_tables(view, pandas_backend, filters, store), False
+        ))
+    if 'graph' in names:
+        # Timed on the memoized evaluation of the page nodes, after a cold one
+        def evaluate(view, filters):
+            if view == 'what_if':
+                return node_tables(what_if_nodes(pandas_backend, filters))
+            compute_graph, node = VIEW_NODES[view]
+            resources = {'backend': pandas_backend, 'snapshot_store': None}
+            return compute_graph.evaluate(node, graph.filter_inputs(pandas_backend, filters), resources)
+
+        def evaluate_cold(view, filters):
+            clear_graphs()
+            evaluate(view, filters)
+        paths.append(ComputePath('graph', pandas_backend, 0.0, evaluate_cold, evaluate, False))
+    if 'figures' in names:
+        # The What-If figures read back from the figure cache, after a cold page built them
+        cache = figure_cache.FigureCache()
+
+        def figures(view, filters):
+            if view != 'what_if':
+                return {}
+
+            def figure(name, build, **widgets):
+                return figure_cache.cached_figure(cache, pandas_backend, filters, view, name, build, **widgets)
+            return figure_tables(what_if_nodes(pandas_backend, filters), figure)
+
+        def build_figures(view, filters):
+            clear_graphs()
+            cache.clear()
+            figures(view, filters)
+        paths.append(ComputePath('figures', pandas_backend, 0.0, build_figures, figures, False))
+    if 'sampled' in names:
+        backend, seconds = _timed(lambda: sampling.SampledBackend(pandas_backend, fraction))
+        paths.append(ComputePath('sampled', backend, seconds, cold, plain(backend), True))
+    return paths, notes
+
+
+def run(client_data, deposit_data, calendar_data, names=PATHS, views=VIEWS, n_filters=6, seed=0,
+        registry=None, fraction=sampling.DEFAULT_FRACTION, rtol=RTOL, atol=ATOL, min_coverage=MIN_COVERAGE,
+        data_version='equivalence'):
+    # -> (per-path timing and result table, mismatches, notes)
+    clear_graphs()
+    reference, reference_seconds = _timed(lambda: ReferenceBackend(client_data, deposit_data, calendar_data, registry))
+    pool = loadtest.filter_pool(reference, size=n_filters, seed=seed)
+
+    timings = defaultdict(lambda: defaultdict(list))
+    golden = []
+    for filters in pool:
+        tables = {}
+        for view in views:
+            tables[view], seconds = _timed(reference.tables, view, filters)
+            timings['reference'][view].append(seconds)
+            if 'figures' in names:
+                tables[view].update(reference.figure_tables(view, filters))
+        golden.append(tables)
+
+    mismatches, rows = [], [{'path': 'reference', 'build (s)': reference_seconds}]
+    with tempfile.TemporaryDirectory(prefix='equivalence_') as workdir:
+        paths, notes = build_paths(client_data, deposit_data, calendar_data, workdir, names, registry, fraction,
+                                   data_version)
+        for path in paths:
+            checked = cells = covered = 0
+            sketch_by = [('month_name',), ('deposit_type',)] + [(b.name,) for b in path.backend.derived_dimensions]
+            for filters, expected in zip(pool, golden):
+                for view in views:
+                    path.prepare(view, filters)
+                    tables, seconds = _timed(path.compute, view, filters)
+                    timings[path.name][view].append(seconds)
+                    if path.approximate:
+                        continue
+                    for name, table in expected[view].items():
+                        if name not in tables:
+                            continue
+                        checked += 1
+                        problem = table_diff(table, tables[name], rtol, atol)
+                        if problem is not None:
+                            mismatches.append(Mismatch(path.name, view, filters, name, problem))
+                if path.approximate:
+                    for dims in COVERAGE_DIMS + [(b.name,) for b in path.backend.derived_dimensions]:
+                        total, hits = coverage(reference, path.backend, filters, dims)
+                        cells, covered = cells + total, covered + hits
+                elif path.name in ('pandas', 'duckdb', 'sqlite'):
+                    for by in sketch_by:
+                        checked += 1
+                        problem = sketch_diff(reference, path.backend, filters, list(by))
+                        if problem is not None:
+                            mismatches.append(Mismatch(path.name, 'sketches', filters, f"quantiles by {by[0]}", problem))
+
+            row = {'path': path.name, 'build (s)': path.build_seconds, 'tables': checked,
+                   'mismatches': sum(m.path == path.name for m in mismatches)}
+            if path.approximate:
+                row['coverage'] = covered / cells if cells else np.nan
+                if cells and row['coverage'] < min_coverage:
+                    mismatches.append(Mismatch(path.name, 'coverage', None, 'error bars',
+                                               f"{row['coverage']:.1%} of 95% intervals cover the exact value"))
+                    row['mismatches'] = 1
+            rows.append(row)
+
+    clear_graphs()
+
+    # Median milliseconds per view and filter selection, and the speedup over the reference
+    for row in rows:
+        for view in views:
+            row[f"{view} (ms)"] = np.median(timings[row['path']][view]) * 1000
+        total = sum(np.sum(timings[row['path']][view]) for view in views)
+        reference_total = sum(np.sum(timings['reference'][view]) for view in views)
+        row['speedup'] = reference_total / total if total else np.nan
+    return pd.DataFrame(rows).set_index('path'), mismatches, notes
+
+
+def bundled_data(deposits, clients, calendar):
+    # The dashboard's input files, validated the way the app loads them
+    calendar_data = pd.read_csv(calendar)
+    calendar_data['gregorian_date'] = pd.to_datetime(calendar_data['gregorian_date'])
+    client_data = pd.read_csv(clients)
+    deposit_data = ingest.load_deposits(deposits, *ingest.calendar_span(calendar_data))
+    deposit_data, _ = validation.validate_inputs(client_data, deposit_data, calendar_data)
+    return client_data, deposit_data, calendar_data
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check every optimized compute path against a standalone pandas reference, and time them"
+    )
+    parser.add_argument('--datasets', default='synthetic,bundled', help="Comma-separated: synthetic, bundled")
+    parser.add_argument('--paths', default=','.join(PATHS), help=f"Comma-separated subset of {', '.join(PATHS)}")
+    parser.add_argument('--views', default=','.join(VIEWS))
+    parser.add_argument('--filters', type=int, default=6, help="Randomized filter selections per dataset")
+    parser.add_argument('--synthetic-clients', type=int, default=20_000)
+    parser.add_argument('--synthetic-deposits', type=int, default=200_000)
+    parser.add_argument('--deposits', default='deposit_data1.csv', help="Bundled deposit file, partition directory or glob")
+    parser.add_argument('--clients', default='client_data.csv')
+    parser.add_argument('--calendar', default='calendar_data.csv')
+    parser.add_argument('--dimensions', help="JSON file of derived client dimensions (default: age groups)")
+    parser.add_argument('--sample-fraction', type=float, default=sampling.DEFAULT_FRACTION)
+    parser.add_argument('--rtol', type=float, default=RTOL)
+    parser.add_argument('--atol', type=float, default=ATOL)
+    parser.add_argument('--min-coverage', type=float, default=MIN_COVERAGE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the timing table to this CSV")
+    args = parser.parse_args()
+
+    registry = dimensions.load_registry(args.dimensions)
+    failed = False
+    results = []
+    for dataset in args.datasets.split(','):
+        if dataset == 'synthetic':
+            data = loadtest.synthetic_data(args.synthetic_clients, args.synthetic_deposits, args.seed)
+        elif dataset == 'bundled':
+            try:
+                data = bundled_data(args.deposits, args.clients, args.calendar)
+            except FileNotFoundError as e:
+                print(f"[bundled] skipped: {e}")
+                continue
+        else:
+            parser.error(f"unknown dataset '{dataset}'")
+
+        print(f"[{dataset}] {len(data[1]):,} deposits for {len(data[0]):,} clients, {args.filters} filter selections")
+        table, mismatches, notes = run(
+            *data, names=args.paths.split(','), views=args.views.split(','), n_filters=args.filters,
+            seed=args.seed, registry=registry, fraction=args.sample_fraction, rtol=args.rtol, atol=args.atol,
+            min_coverage=args.min_coverage, data_version=f"equivalence-{dataset}-{args.seed}"
+        )
+        for note in notes:
+            print(f"[{dataset}] {note}")
+        for mismatch in mismatches[:20]:
+            print(f"[{dataset}] MISMATCH {mismatch.path} {mismatch.view}/{mismatch.table} "
+                  f"{mismatch.filters}: {mismatch.problem}")
+        if len(mismatches) > 20:
+            print(f"[{dataset}] ... {len(mismatches) - 20} more mismatches")
+        print(table.round(3).to_string())
+        failed |= bool(mismatches)
+        results.append(table.assign(dataset=dataset))
+
+    if args.output and results:
+        pd.concat(results).to_csv(args.output)
+    print("FAILED" if failed else "OK: every path matches the reference")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
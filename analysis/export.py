@@ -0,0 +1,193 @@
+import io
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from analysis import ingest, kpis, snapshots
+
+# Deposit-level columns of a row export, in file order, followed by the backend's derived
+# dimensions; amounts are written in dollars
+ROW_COLUMNS = [
+    'client_id', 'deposit_date', 'month_name', 'deposit_type', 'deposit_cadence', 'deposit_amount',
+    'client_geographical_region', 'client_residence_status',
+]
+
+FORMATS = {'csv': '.csv', 'parquet': '.parquet'}
+
+# Row exports stop here and are marked truncated
+DEFAULT_MAX_ROWS = 5_000_000
+
+PARQUET_COMPRESSION = 'zstd'
+
+
+def row_columns(backend):
+    return ROW_COLUMNS + [bucketing.name for bucketing in backend.derived_dimensions]
+
+
+def _row_schema(columns):
+    import pyarrow as pa
+    types = {'client_id': pa.int64(), 'deposit_date': pa.timestamp('ns'), 'deposit_amount': pa.float64()}
+    return pa.schema([(column, types.get(column, pa.string())) for column in columns])
+
+
+def prepare_rows(chunk, columns=ROW_COLUMNS):
+    # Fixed columns and plain dtypes whatever the engine, so every chunk matches the file schema
+    chunk = chunk.reindex(columns=columns)
+    for column in columns:
+        if column not in ('client_id', 'deposit_date', 'deposit_amount'):
+            chunk[column] = chunk[column].astype(object).where(chunk[column].notna(), None)
+    chunk['deposit_date'] = pd.to_datetime(chunk['deposit_date']).astype('datetime64[ns]')
+    chunk['deposit_amount'] = ingest.to_dollars(chunk['deposit_amount'].astype('int64'))
+    return chunk
+
+
+def flat_table(table):
+    # KPI tables with MultiIndex columns or a keyed index become plain columnar tables
+    table = table.copy()
+    if isinstance(table.columns, pd.MultiIndex):
+        table.columns = [' '.join(str(part) for part in column) for column in table.columns]
+    if not isinstance(table.index, pd.RangeIndex):
+        table = table.reset_index()
+    return table
+
+
+class ExportJob:
+    # Progress of one export; written by the worker thread, read by the UI
+    def __init__(self, path, total=None):
+        self.path = path
+        self.total = total
+        self.rows = 0
+        self.truncated = False
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def progress(self):
+        if self.finished is not None:
+            return 1.0
+        return min(self.rows / self.total, 1.0) if self.total else 0.0
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if self.finished is not None else None
+
+
+def write_rows(job, backend, filters, fmt, max_rows=DEFAULT_MAX_ROWS):
+    # Streams the filtered deposits chunk by chunk into a temporary file, renamed on success
+    # so a partial export is never served
+    # The monthly counts give the row total for progress without touching the rows
+    job.total = min(int(backend.monthly_metrics(filters)['deposit_count'].sum()), max_rows)
+    columns = row_columns(backend)
+    tmp_path = job.path + '.tmp'
+    writer = None
+    try:
+        if fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            schema = _row_schema(columns)
+            writer = pq.ParquetWriter(tmp_path, schema, compression=PARQUET_COMPRESSION)
+        else:
+            writer = open(tmp_path, 'w', newline='', encoding='utf-8')
+
+        for chunk in backend.scan_chunks(filters):
+            if job.rows + len(chunk) > max_rows:
+                chunk = chunk.iloc[:max_rows - job.rows]
+                job.truncated = True
+            chunk = prepare_rows(chunk, columns)
+            if fmt == 'parquet':
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            else:
+                chunk.to_csv(writer, header=job.rows == 0, index=False, date_format='%Y-%m-%d')
+            job.rows += len(chunk)
+            if job.truncated:
+                break
+
+        if fmt != 'parquet' and job.rows == 0:
+            prepare_rows(pd.DataFrame(columns=columns), columns).to_csv(writer, index=False)
+        writer.close()
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, job.path)
+    job.finished = time.time()
+    return job
+
+
+def write_tables(job, view, backend, filters, fmt, snapshot_store=None):
+    # One file per KPI table of the view, zipped; the tables are small once computed
+    tables = kpis.load_tables(view, backend, filters, snapshot_store)
+    tmp_path = job.path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name in kpis.view_table_names(view, backend):
+            table = flat_table(tables[name])
+            if fmt == 'parquet':
+                buffer = io.BytesIO()
+                table.to_parquet(buffer, index=False, compression=PARQUET_COMPRESSION)
+                archive.writestr(f"{name}.parquet", buffer.getvalue())
+            else:
+                archive.writestr(f"{name}.csv", table.to_csv(index=False))
+            job.rows += 1
+    os.replace(tmp_path, job.path)
+    job.finished = time.time()
+    return job
+
+
+class ExportManager:
+    # Exports run on a small pool of their own, off the Streamlit script threads, so a large
+    # download neither blocks the requesting session nor the other ones. Jobs are keyed by
+    # data version, filters and content; asking again for the same export returns the same job.
+    def __init__(self, directory, max_rows=DEFAULT_MAX_ROWS, max_workers=2):
+        self.directory = directory
+        self.max_rows = max_rows
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key, suffix):
+        # <content>_<data version>_<filter key>, e.g. deposits_<version>_<key>.csv
+        data_version, filters, content, _ = key
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{content}_{data_version}_{snapshots.filter_key(filters)}{suffix}")
+
+    def _submit(self, key, path, total, func, *args):
+        with self._lock:
+            entry = self._jobs.get(key)
+            if entry is not None and not (entry[1].done() and entry[1].exception() is not None):
+                return entry[0]
+            job = ExportJob(path, total)
+            self._jobs[key] = (job, self._executor.submit(func, job, *args))
+            return job
+
+    def row_key(self, backend, filters, fmt):
+        return (backend.cache_version(filters), filters, 'deposits', fmt)
+
+    def table_key(self, view, backend, filters, fmt):
+        return (backend.cache_version(filters), filters, f"{view}_tables", fmt)
+
+    def submit_rows(self, backend, filters, fmt):
+        key = self.row_key(backend, filters, fmt)
+        return self._submit(key, self._path(key, FORMATS[fmt]), None, write_rows,
+                            backend, filters, fmt, self.max_rows)
+
+    def submit_tables(self, view, backend, filters, fmt, snapshot_store=None):
+        key = self.table_key(view, backend, filters, fmt)
+        return self._submit(key, self._path(key, f".{fmt}.zip"), len(kpis.view_table_names(view, backend)), write_tables,
+                            view, backend, filters, fmt, snapshot_store)
+
+    def status(self, key):
+        # (job, None | 'running' | 'done' | 'failed', exception)
+        entry = self._jobs.get(key)
+        if entry is None:
+            return None, None, None
+        job, future = entry
+        if not future.done():
+            return job, 'running', None
+        error = future.exception()
+        return job, 'failed' if error is not None else 'done', error
@@ -0,0 +1,82 @@
+import json
+import threading
+from collections import OrderedDict
+
+import plotly.graph_objects as go
+
+try:
+    # plotly imports its JSON engine lazily; doing it here keeps concurrent first
+    # serializations on the section pool from seeing a half-imported module
+    import orjson  # noqa: F401
+except ImportError:
+    pass
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def figure_key(data_version, filters, view, name, widgets=None):
+    # Everything a figure depends on: the data, the sidebar filters and the view's own widgets
+    return (str(data_version), tuple(filters), view, name, tuple(sorted((widgets or {}).items())))
+
+
+class FigureCache:
+    # Serialized figure specs shared across sessions, evicted least-recently-used by total size
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._specs = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._specs)
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, key):
+        with self._lock:
+            spec = self._specs.get(key)
+            if spec is None:
+                self.misses += 1
+                return None
+            self._specs.move_to_end(key)
+            self.hits += 1
+        # The spec was validated when first built; skip plotly's per-property validation
+        return go.Figure(json.loads(spec), _validate=False)
+
+    def put(self, key, fig):
+        spec = fig.to_json().encode()
+        if len(spec) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._specs.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._specs[key] = spec
+            self._size += len(spec)
+            while self._size > self.max_bytes:
+                _, evicted = self._specs.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_or_build(self, key, build):
+        fig = self.get(key)
+        if fig is None:
+            fig = build()
+            self.put(key, fig)
+        return fig
+
+    def clear(self):
+        with self._lock:
+            self._specs.clear()
+            self._size = 0
+
+
+def cached_figure(cache, backend, filters, view, name, build, **widgets):
+    # Views call this around each figure; without a cache or a data version it just builds
+    version = backend.cache_version(filters)
+    if cache is None or version is None:
+        return build()
+    return cache.get_or_build(figure_key(version, filters, view, name, widgets), build)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from analysis import backends
+
+# Smoothing grid searched for every segment at once; beta is a fraction of alpha
+# (keeps 0 <= beta <= alpha) and phi = 1 is Holt's undamped linear trend
+ALPHAS = np.linspace(0.1, 0.9, 9)
+BETA_FRACTIONS = np.array([0.0, 0.1, 0.25, 0.5])
+PHIS = np.array([0.8, 0.9, 0.98, 1.0])
+
+
+def _parameter_grid():
+    alpha, beta_fraction, phi = np.meshgrid(ALPHAS, BETA_FRACTIONS, PHIS, indexing='ij')
+    alpha = alpha.ravel()
+    return alpha, alpha * beta_fraction.ravel(), phi.ravel()
+
+
+def _damped_sums(phi, horizon):
+    # phi + phi^2 + ... + phi^h for h = 1..horizon, shape (horizon, n_params)
+    powers = phi[None, :] ** np.arange(1, horizon + 1)[:, None]
+    return np.cumsum(powers, axis=0)
+
+
+def damped_trend(values, horizon=1, level=0.95):
+    # Additive damped-trend exponential smoothing (ETS(A,Ad,N)) fitted to every row
+    # of `values` (segments x periods) in one pass over time; NaNs are skipped
+    values = np.asarray(values, dtype='float64')
+    if values.ndim == 1:
+        values = values[None, :]
+    n_series, n_periods = values.shape
+    alpha, beta, phi = _parameter_grid()
+
+    # Initial state from the first two observations, broadcast over the grid
+    first = np.nan_to_num(values[:, 0])
+    second = values[:, 1] if n_periods > 1 else first
+    level_state = np.repeat(first[:, None], len(alpha), axis=1)
+    trend_state = np.repeat(np.nan_to_num(second - first)[:, None], len(alpha), axis=1)
+    sse = np.zeros_like(level_state)
+    n_errors = np.zeros(n_series)
+
+    for t in range(1, n_periods):
+        observed = values[:, t]
+        present = ~np.isnan(observed)
+        fitted = level_state + phi * trend_state
+        error = np.where(present[:, None], observed[:, None] - fitted, 0.0)
+        sse += error ** 2
+        n_errors += present
+        level_state = fitted + alpha * error
+        trend_state = phi * trend_state + beta * error
+
+    # Best parameters per series by in-sample one-step squared error
+    best = np.argmin(sse, axis=1)
+    rows = np.arange(n_series)
+    alpha, beta, phi = alpha[best], beta[best], phi[best]
+    level_state, trend_state = level_state[rows, best], trend_state[rows, best]
+    sigma2 = sse[rows, best] / np.maximum(n_errors - 1, 1)
+
+    damped = _damped_sums(phi, horizon)
+    forecast = level_state[None, :] + damped * trend_state[None, :]
+
+    # h-step variance: sigma^2 * (1 + sum_{j<h} (alpha + beta * phi_j)^2)
+    coefficients = (alpha[None, :] + beta[None, :] * damped) ** 2
+    spread = 1 + np.concatenate([np.zeros((1, n_series)), np.cumsum(coefficients, axis=0)[:-1]])
+    margin = stats.norm.ppf((1 + level) / 2) * np.sqrt(sigma2[None, :] * spread)
+
+    return {
+        'forecast': forecast.T,
+        'lower': (forecast - margin).T,
+        'upper': (forecast + margin).T,
+        'alpha': alpha,
+        'beta': beta,
+        'phi': phi,
+        'sigma': np.sqrt(sigma2),
+    }
+
+
+def forecast_segments(series, horizon=1, level=0.95):
+    # series: one row per segment, one column per period in time order. Returns the
+    # `horizon`-step forecast with its interval and the fitted parameters per segment
+    fit = damped_trend(series.to_numpy(dtype='float64'), horizon=horizon, level=level)
+    result = pd.DataFrame({
+        'last_actual': series.iloc[:, -1].to_numpy(dtype='float64'),
+        'forecast': fit['forecast'][:, -1],
+        'lower': fit['lower'][:, -1],
+        'upper': fit['upper'][:, -1],
+        'alpha': fit['alpha'],
+        'beta': fit['beta'],
+        'phi': fit['phi'],
+        'sigma': fit['sigma'],
+    }, index=series.index)
+    result['growth'] = result['forecast'] / result['last_actual'] - 1
+    return result
+
+
+def monthly_segment_series(backend, filters, dims, column='deposit_sum'):
+    # Segments x months matrix of a segment metric (money in dollars); missing months are NaN
+    metrics = backends.in_dollars(backend.segment_metrics(filters, dims))[column]
+    return metrics.unstack('month_name').sort_index(axis=1)
@@ -0,0 +1,99 @@
+import threading
+from collections import Counter, OrderedDict, namedtuple
+
+from analysis import backends
+
+# Root inputs every view's tables depend on; widget values are added per view
+FILTER_INPUTS = ('data_version', 'date_range', 'regions', 'statuses')
+
+Node = namedtuple('Node', ['name', 'inputs', 'resources', 'compute'])
+
+
+def filter_inputs(backend, filters):
+    return {
+        'data_version': backend.cache_version(filters),
+        'date_range': (filters.start_date, filters.end_date),
+        'regions': filters.regions,
+        'statuses': filters.statuses,
+    }
+
+
+def filters_from(date_range, regions, statuses):
+    return backends.QueryFilters(date_range[0], date_range[1], regions, statuses)
+
+
+class ComputeGraph:
+    # Named derived tables with declared inputs; a node is recomputed only when
+    # one of the root inputs it (transitively) depends on has changed
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self.nodes = {}
+        self._results = {}
+        self._roots = {}
+        self._lock = threading.Lock()
+        self.compute_counts = Counter()
+
+    def node(self, name, inputs=(), resources=()):
+        # Decorator: inputs name root inputs or other nodes, resources are passed
+        # through unkeyed (the backend, whose identity data_version stands in for)
+        def register(compute):
+            self.nodes[name] = Node(name, tuple(inputs), tuple(resources), compute)
+            self._results[name] = OrderedDict()
+            self._roots.clear()
+            return compute
+        return register
+
+    def root_inputs(self, name):
+        if name not in self._roots:
+            if name not in self.nodes:
+                self._roots[name] = (name,)
+            else:
+                roots = []
+                for dependency in self.nodes[name].inputs:
+                    roots.extend(root for root in self.root_inputs(dependency) if root not in roots)
+                self._roots[name] = tuple(roots)
+        return self._roots[name]
+
+    def _key(self, name, inputs):
+        try:
+            return tuple(inputs[root] for root in self.root_inputs(name))
+        except KeyError as e:
+            raise KeyError(f"Node '{name}' needs input {e.args[0]!r}") from None
+
+    def evaluate(self, name, inputs, resources=None, memoize=True):
+        resources = resources or {}
+        if name not in self.nodes:
+            return inputs[name]
+
+        node = self.nodes[name]
+        key = self._key(name, inputs) if memoize else None
+        if memoize:
+            with self._lock:
+                results = self._results[name]
+                if key in results:
+                    results.move_to_end(key)
+                    return results[key]
+
+        arguments = {dependency: self.evaluate(dependency, inputs, resources, memoize)
+                     for dependency in node.inputs}
+        arguments.update({resource: resources[resource] for resource in node.resources})
+        value = node.compute(**arguments)
+
+        with self._lock:
+            self.compute_counts[name] += 1
+            if memoize:
+                results = self._results[name]
+                results[key] = value
+                while len(results) > self.max_entries:
+                    results.popitem(last=False)
+        return value
+
+    def downstream(self, changed):
+        # Nodes that a change to the given root inputs invalidates
+        changed = set(changed)
+        return [name for name in self.nodes if changed & set(self.root_inputs(name))]
+
+    def clear(self):
+        with self._lock:
+            for results in self._results.values():
+                results.clear()
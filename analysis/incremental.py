@@ -0,0 +1,509 @@
+import argparse
+import os
+import pickle
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from analysis import backends, ingest, sketches, validation
+from analysis.client_index import ClientIndex
+
+STATE_FILE = 'state.pkl'
+CHUNK_DIR = 'chunks'
+
+# Bumped when the persisted state changes meaning; older state is rebuilt from the source.
+# 2: deposit sums are integer cents
+# 3: parsed chunks name their amount column deposit_amount_cents
+# 4: only the parsed chunks are kept; the aggregates live in IncrementalBackend
+# 5: rewrites of the source are counted (generation)
+STATE_VERSION = 5
+
+# A CSV whose last line has no trailing newline is only taken as complete once the file has
+# gone this long without changing; until then the line may still be being written
+TAIL_SETTLE_SECONDS = 2.0
+
+# Totals IncrementalBackend keeps up to date on every refresh: month plus an optional segment
+SEGMENT_GROUPINGS = {
+    'month': [],
+    'deposit_type': ['deposit_type'],
+    'deposit_cadence': ['deposit_cadence'],
+}
+
+# Appended rows get a client index of their own until they reach this share of the indexed
+# rows; then the whole index is rebuilt, so its cost stays proportional to what was appended
+RECENT_INDEX_SHARE = 0.125
+
+
+def _settled(stat):
+    return time.time() - stat.st_mtime >= TAIL_SETTLE_SECONDS
+
+
+def _empty_state():
+    return {
+        'state_version': STATE_VERSION,
+        'data_version': 0,
+        # Bumped whenever the source is rewritten and re-read from scratch
+        'generation': 0,
+        # path -> size, mtime and bytes already consumed
+        'files': {},
+        'chunk_count': 0,
+    }
+
+
+class IncrementalIngestor:
+    def __init__(self, source, state_dir):
+        self.source = source
+        self.state_dir = state_dir
+        self._lock = threading.Lock()
+        self._chunks = []
+        self._deposits = None
+        self._load_state()
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def _state_path(self):
+        return os.path.join(self.state_dir, STATE_FILE)
+
+    def _chunk_dir(self):
+        return os.path.join(self.state_dir, CHUNK_DIR)
+
+    def _load_state(self):
+        os.makedirs(self._chunk_dir(), exist_ok=True)
+        if os.path.exists(self._state_path()):
+            with open(self._state_path(), 'rb') as f:
+                self.state = pickle.load(f)
+            if self.state.get('state_version') != STATE_VERSION:
+                self._reset()
+            elif self.state['chunk_count']:
+                self._chunks = [ingest.load_deposits(self._chunk_dir())]
+        else:
+            self.state = _empty_state()
+
+    def _save_state(self):
+        # Write then rename so a crashed refresh never leaves a torn state file
+        tmp_path = self._state_path() + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._state_path())
+
+    def _reset(self):
+        shutil.rmtree(self._chunk_dir(), ignore_errors=True)
+        os.makedirs(self._chunk_dir(), exist_ok=True)
+        data_version, generation = self.state['data_version'], self.state.get('generation', 0)
+        self.state = _empty_state()
+        self.state['data_version'] = data_version
+        self.state['generation'] = generation + 1
+        self._chunks = []
+        self._deposits = None
+
+    # ------------------------------------------------------------------
+    # Change detection
+    # ------------------------------------------------------------------
+    def _scan_changes(self):
+        # Returns (path, byte offset to read from) for every new or grown file,
+        # or None when a known file was rewritten and a full rebuild is needed
+        changes = []
+        for path in ingest.resolve_partitions(self.source):
+            stat = os.stat(path)
+            known = self.state['files'].get(path)
+            if known is None:
+                changes.append((path, 0))
+                continue
+            if stat.st_size == known['size'] and stat.st_mtime == known['mtime']:
+                # An unterminated last line held back earlier is read once the file settles
+                if known['consumed'] < stat.st_size and _settled(stat):
+                    changes.append((path, known['consumed']))
+                continue
+
+            appendable = path.endswith('.csv')
+            if not appendable or stat.st_size < known['consumed']:
+                return None
+            changes.append((path, known['consumed']))
+
+        return changes
+
+    def _read_new_rows(self, path, offset):
+        stat = os.stat(path)
+        if not path.endswith('.csv'):
+            batch = ingest.read_partition(path)
+            consumed = stat.st_size
+        else:
+            with open(path, 'rb') as f:
+                header = f.readline()
+                start = max(offset, len(header))
+                f.seek(start)
+                data = f.read(max(stat.st_size - start, 0))
+            # Only consume complete lines; a last line without a newline is taken once the
+            # file has settled, and left for a later refresh while it may still be growing
+            end = len(data) if _settled(stat) else data.rfind(b'\n') + 1
+            consumed = start + end
+            batch = ingest.read_csv_bytes(header + data[:end]) if end else None
+
+        self.state['files'][path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'consumed': consumed}
+        return batch
+
+    def refresh(self):
+        # Parse only what arrived since the last refresh and append it to the parsed chunks
+        with self._lock:
+            changes = self._scan_changes()
+            rewritten = changes is None
+            if rewritten:
+                self._reset()
+                changes = self._scan_changes()
+
+            new_rows = 0
+            for path, offset in changes:
+                batch = self._read_new_rows(path, offset)
+                if batch is None or not len(batch):
+                    continue
+
+                new_rows += len(batch)
+                chunk_path = os.path.join(self._chunk_dir(), f"chunk_{self.state['chunk_count']}.parquet")
+                ingest.store_columns(batch).to_parquet(chunk_path, index=False)
+                self.state['chunk_count'] += 1
+                self._chunks.append(batch)
+                self._deposits = None
+
+            # A rewrite is a new version even when the new source has no rows
+            if new_rows or rewritten:
+                self.state['data_version'] += 1
+            if changes or rewritten:
+                self._save_state()
+
+            return new_rows
+
+    # ------------------------------------------------------------------
+    # Accessors
+    # ------------------------------------------------------------------
+    @property
+    def data_version(self):
+        return self.state['data_version']
+
+    @property
+    def generation(self):
+        return self.state['generation']
+
+    @property
+    def row_count(self):
+        with self._lock:
+            return sum(len(chunk) for chunk in self._chunks)
+
+    def _offsets(self):
+        return np.cumsum([0] + [len(chunk) for chunk in self._chunks])
+
+    def rows_since(self, start):
+        # The parsed rows from position `start` on, in arrival order
+        with self._lock:
+            offsets = self._offsets()
+            parts = [chunk.iloc[max(start - offset, 0):] for chunk, offset in zip(self._chunks, offsets)
+                     if offset + len(chunk) > start]
+        if not parts:
+            return pd.DataFrame(columns=ingest.DEPOSIT_COLUMNS).astype(ingest.DEPOSIT_DTYPES)
+        return ingest.concat_partitions(parts)
+
+    def take(self, positions):
+        # Parsed rows at the given (sorted) positions, across chunks
+        with self._lock:
+            offsets = self._offsets()
+            chunk_of = np.searchsorted(offsets, positions, side='right') - 1
+            parts = [self._chunks[i].iloc[positions[chunk_of == i] - offsets[i]] for i in np.unique(chunk_of)]
+        return ingest.concat_partitions(parts)
+
+    @property
+    def deposits(self):
+        with self._lock:
+            if self._deposits is None:
+                if self._chunks:
+                    self._deposits = ingest.concat_partitions(self._chunks)
+                    self._chunks = [self._deposits]
+                else:
+                    self._deposits = pd.DataFrame(columns=ingest.DEPOSIT_COLUMNS).astype(ingest.DEPOSIT_DTYPES)
+            return self._deposits
+
+
+def _combine(totals, batch):
+    # Per-cell sums and counts add; the sums of squared deviations merge with the
+    # between-means term of Chan et al.'s pairwise update, so no raw rows are revisited
+    if totals is None:
+        return batch
+    index = totals.index.union(batch.index)
+    a, b = totals.reindex(index, fill_value=0), batch.reindex(index, fill_value=0)
+    count_a, count_b = a['deposit_count'].to_numpy('float64'), b['deposit_count'].to_numpy('float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = b['deposit_sum'] / count_b - a['deposit_sum'] / count_a
+        between = np.where((count_a > 0) & (count_b > 0), delta ** 2 * count_a * count_b / (count_a + count_b), 0)
+    return pd.DataFrame({
+        'deposit_sum': a['deposit_sum'] + b['deposit_sum'],
+        'deposit_count': a['deposit_count'] + b['deposit_count'],
+        'deposit_m2': a['deposit_m2'] + b['deposit_m2'] + between,
+    }, index=index)
+
+
+def _append_rows(frame, rows):
+    # Row-wise concat that keeps categorical columns categorical: the rows are recoded to the
+    # frame's categories, or both sides to the union when the rows bring new labels
+    rows = rows[frame.columns].copy()
+    widened = {}
+    for column in frame.columns:
+        dtype = frame[column].dtype
+        if not isinstance(dtype, pd.CategoricalDtype) or rows[column].dtype == dtype:
+            continue
+        if rows[column].isin(dtype.categories).all() or rows[column].isna().all():
+            rows[column] = pd.Categorical(rows[column], dtype=dtype)
+        else:
+            union = union_categoricals([frame[column], rows[column]], sort_categories=True)
+            widened[column] = pd.Series(union)
+    combined = pd.concat([frame, rows], ignore_index=True)
+    return combined.assign(**widened) if widened else combined
+
+
+class IncrementalBackend(backends.PandasBackend):
+    # The pandas backend over an IncrementalIngestor, kept current in place. refresh() validates
+    # and merges only the rows parsed since the last refresh, appends them with their sketch
+    # cells, and folds them into the month/segment totals, the per-client activity and the
+    # cohort matrix, which serve the unfiltered segment and cohort queries. Each month records
+    # the data version that last changed it; cache_version() keys cached results on the months
+    # a filter's date range reads, so an append only invalidates results that include its months.
+    # The backend owns the ingestor's refreshes.
+    def __init__(self, ingestor, client_data, calendar_data, version_prefix, registry=None,
+                 quarantine_dir=None):
+        self.ingestor = ingestor
+        self.client_data = client_data
+        self.calendar_data = calendar_data
+        self.version_prefix = version_prefix
+        self.quarantine_dir = quarantine_dir
+        self.registry = registry or self.registry
+        self.derived_dimensions = self.registry.available(client_data.columns)
+
+        calendar = calendar_data.sort_values('gregorian_date')
+        self.months = list(pd.unique(calendar['month_name']))
+        self._month_days = calendar.groupby('month_name', sort=False)['gregorian_date'].agg(['min', 'max'])
+        self._calendar_bounds = (calendar['gregorian_date'].min(), calendar['gregorian_date'].max())
+        self._client_positions = pd.Index(client_data['client_id'])
+        self._lock = threading.Lock()
+        with self._lock:
+            ingestor.refresh()
+            self._build()
+
+    def _version(self, version):
+        return f"{self.version_prefix}-v{version}"
+
+    def _build(self):
+        # Everything the ingestor holds, validated and merged in one go; also how a rewritten
+        # source is picked up
+        ingestor = self.ingestor
+        version = ingestor.data_version
+        self.generation = ingestor.generation
+        self._keys = validation.KeyHistory(ingestor.take)
+        deposit_data = ingestor.deposits
+        self._folded = len(deposit_data)
+        deposit_data, self.validation = validation.validate_inputs(
+            self.client_data, deposit_data, self.calendar_data, self.quarantine_dir, self._version(version),
+            self._keys
+        )
+
+        self.merged = self._merge(deposit_data)
+        self._client_index = ClientIndex(self.merged[backends.HISTORY_COLUMNS], self.client_data)
+        self._recent_index = None
+        self.sketches = sketches.DepositSketches(self.sketch_counts(), self.sketch_dims)
+
+        self._totals, self._values, self._active, self._unique = {}, {}, {}, {}
+        self._cohorts = np.zeros((len(self.months), len(self.months)), dtype='int64')
+        self._fold(self.merged)
+        self.month_versions = dict.fromkeys(self.months, version)
+        self.data_version = self._version(version)
+
+    def refresh(self):
+        # Folds in what the ingestor parsed since the last refresh; returns the months touched
+        with self._lock:
+            ingestor = self.ingestor
+            ingestor.refresh()
+            if ingestor.generation != self.generation:
+                self._build()
+                return set(self.months)
+
+            batch = ingestor.rows_since(self._folded)
+            version = ingestor.data_version
+            if not len(batch):
+                return set()
+            self._folded += len(batch)
+
+            result = validation.validate_deposits(batch, self.client_data['client_id'], self._calendar_bounds,
+                                                  self._keys)
+            self._add_counts(result.counts, result.quarantine, version)
+            rows = self._merge(result.clean).reset_index(drop=True)
+            if len(rows):
+                self._append(rows)
+                self._fold(rows)
+            touched = set(rows['month_name'].unique())
+            self.month_versions = {**self.month_versions, **dict.fromkeys(touched, version)}
+            self.data_version = self._version(version)
+            return touched
+
+    def _add_counts(self, counts, quarantine, version):
+        totals = dict(self.validation)
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+        if self.quarantine_dir:
+            path = validation.write_quarantine(quarantine, self.quarantine_dir, self._version(version))
+            totals['quarantine_path'] = path or totals.get('quarantine_path')
+        self.validation = totals
+
+    def _append(self, rows):
+        self.merged = _append_rows(self.merged, rows)
+        indexed = len(self._client_index.deposits)
+        recent = self.merged.iloc[indexed:][backends.HISTORY_COLUMNS]
+        if len(recent) > RECENT_INDEX_SHARE * indexed:
+            self._client_index = ClientIndex(self.merged[backends.HISTORY_COLUMNS], self.client_data)
+            self._recent_index = None
+        else:
+            self._recent_index = ClientIndex(recent, self.client_data)
+
+        columns = [column for column in ['deposit_date', 'month_name', 'deposit_amount'] + self.sketch_dims
+                   if column in rows.columns]
+        self.sketches = self.sketches.merged(sketches.bucket_counts(rows[columns], self.sketch_dims))
+
+    def _segment_codes(self, name, values):
+        # Codes into the grouping's segment values, widening its activity arrays for new ones
+        known = self._values.setdefault(name, [])
+        new = [value for value in pd.unique(values) if value not in known]
+        if new:
+            known.extend(new)
+            if name in self._active:
+                active, unique = self._active[name], self._unique[name]
+                self._active[name] = np.concatenate(
+                    [active, np.zeros(active.shape[:2] + (len(new),), dtype=bool)], axis=2)
+                self._unique[name] = np.concatenate([unique, np.zeros((len(self.months), len(new)), dtype='int64')],
+                                                    axis=1)
+        return pd.Index(known).get_indexer(values)
+
+    def _fold(self, rows):
+        # Totals per grouping cell, plus one activity flag per (client, month, segment value):
+        # distinct clients grow by the flags a batch sets, and the cohort matrix moves each
+        # client whose activity changed from its old first-month row to its new one
+        n_months = len(self.months)
+        months = pd.Index(self.months).get_indexer(rows['month_name'])
+        clients = self._client_positions.get_indexer(rows['client_id'])
+        amount = rows['deposit_amount'].to_numpy('int64')
+
+        for name, dims in SEGMENT_GROUPINGS.items():
+            keys = [rows[key].astype(object) for key in ['month_name'] + dims]
+            grouped = pd.Series(amount, index=rows.index).groupby(keys)
+            deviations = (amount - grouped.transform('mean')) ** 2
+            batch = pd.DataFrame({
+                'deposit_sum': grouped.sum(),
+                'deposit_count': grouped.count(),
+                'deposit_m2': deviations.groupby(keys).sum(),
+            })
+            self._totals[name] = _combine(self._totals.get(name), batch)
+
+            codes = self._segment_codes(name, rows[dims[0]]) if dims else np.zeros(len(rows), dtype='int64')
+            n_values = max(len(self._values.setdefault(name, [])), 1)
+            if name not in self._active:
+                self._active[name] = np.zeros((len(self.client_data), n_months, n_values), dtype=bool)
+                self._unique[name] = np.zeros((n_months, n_values), dtype='int64')
+            active = self._active[name]
+            flags = active.reshape(-1)
+            cells = np.unique((clients.astype('int64') * n_months + months) * n_values + codes)
+            new = cells[~flags[cells]]
+
+            changed = np.unique(new // (n_months * n_values))
+            before = active[changed, :, 0].copy() if name == 'month' else None
+            flags[new] = True
+
+            unique = self._unique[name].copy()
+            np.add.at(unique.reshape(-1), new % (n_months * n_values), 1)
+            self._unique[name] = unique
+
+            if name == 'month':
+                after = active[changed, :, 0]
+                cohorts = self._cohorts.copy()
+                had = before.any(axis=1)
+                np.add.at(cohorts, before[had].argmax(axis=1), -before[had].astype('int64'))
+                np.add.at(cohorts, after.argmax(axis=1), after.astype('int64'))
+                self._cohorts = cohorts
+
+    def months_between(self, start_date=None, end_date=None):
+        # Calendar months with at least one day inside the range
+        days = self._month_days
+        mask = np.ones(len(days), dtype=bool)
+        if start_date is not None:
+            mask &= (days['max'] + pd.Timedelta(days=1) > start_date).to_numpy()
+        if end_date is not None:
+            mask &= (days['min'] <= end_date).to_numpy()
+        return list(days.index[mask])
+
+    def cache_version(self, filters):
+        # The newest version among the months the date range reads; months are versioned with
+        # the increasing data version that last changed them, so this moves exactly when one does
+        versions = self.month_versions
+        months = self.months_between(filters.start_date, filters.end_date)
+        return self._version(max((versions[month] for month in months), default=0))
+
+    def segment_metrics(self, filters, dims=(), month=None):
+        name = next((name for name, keys in SEGMENT_GROUPINGS.items() if keys == list(dims)), None)
+        if name is None or filters != backends.make_filters():
+            return super().segment_metrics(filters, dims, month)
+
+        totals = self._totals[name]
+        month_codes = pd.Index(self.months).get_indexer(totals.index.get_level_values(0))
+        value_codes = (pd.Index(self._values[name]).get_indexer(totals.index.get_level_values(1)) if dims
+                       else np.zeros(len(totals), dtype='int64'))
+        count = totals['deposit_count']
+        result = pd.DataFrame({
+            'deposit_sum': totals['deposit_sum'],
+            'deposit_count': count,
+            'deposit_std': np.sqrt(totals['deposit_m2'] / (count - 1)).where(count > 1),
+            'unique_clients': self._unique[name][month_codes, value_codes],
+        }, index=totals.index)
+
+        if month is not None:
+            result = result[result.index.get_level_values(0) == month]
+            keys = list(dims) or ['month_name']
+            if dims:
+                result = result.droplevel(0)
+        else:
+            keys = ['month_name'] + list(dims)
+        return backends.finalize_segments(result.sort_index(), keys)
+
+    def cohort_table(self, filters):
+        if filters != backends.make_filters():
+            return super().cohort_table(filters)
+        cohorts = self._cohorts
+        first, active = np.nonzero(cohorts)
+        months = np.array(self.months, dtype=object)
+        return backends.finalize_cohorts(pd.DataFrame({
+            'acquisition_month': months[first],
+            'month_name': months[active],
+            'clients': cohorts[first, active],
+        }))
+
+    def client_history(self, client_id):
+        history = self._client_index.history(client_id)
+        recent = self._recent_index.history(client_id) if self._recent_index is not None else history.iloc[0:0]
+        if not len(recent):
+            return history
+        return pd.concat([history, recent], ignore_index=True).sort_values('deposit_date', kind='stable')
+
+    def client_attributes(self, client_id):
+        return self._client_index.attributes(client_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold newly arrived deposit rows into the incremental state")
+    parser.add_argument('source', help="Deposit file, partition directory or glob")
+    parser.add_argument('state_dir', help="Directory holding the ingest state and parsed chunks")
+    args = parser.parse_args()
+
+    ingestor = IncrementalIngestor(args.source, args.state_dir)
+    new_rows = ingestor.refresh()
+    print(f"Data version {ingestor.data_version}; {new_rows:,} new deposit rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+import glob
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Columns every deposit partition must provide, in canonical order
+DEPOSIT_COLUMNS = ['client_id', 'deposit_type', 'deposit_amount', 'deposit_cadence', 'deposit_date']
+
+# Compact in-memory schema shared by all partitions
+DEPOSIT_DTYPES = {
+    'client_id': 'int64',
+    'deposit_type': 'category',
+    'deposit_amount': 'int64',
+    'deposit_cadence': 'category',
+}
+
+# Amounts are held as whole cents so every sum is an exact integer on every engine.
+# Deposit files carry dollars; results go back to dollars (to_dollars) for display only
+CENTS = 100
+
+# Our own Parquet and SQLite stores keep the cents under this name. A deposit_amount
+# column always holds dollars, whatever its dtype, so whole-dollar integer files load as dollars
+CENTS_COLUMN = 'deposit_amount_cents'
+
+# Stand-in for a missing or non-finite amount in the integer column; validation
+# quarantines these rows before anything aggregates them
+MISSING_CENTS = np.iinfo('int64').min
+
+# The same for a blank or non-numeric client_id; validation quarantines these rows too
+MISSING_CLIENT_ID = np.iinfo('int64').min
+
+# CSV amounts are always dollars, even when every value in a file happens to be whole
+CSV_DTYPES = {'deposit_amount': 'float64'}
+
+PARTITION_EXTENSIONS = ('.csv', '.csv.gz', '.parquet')
+
+# Daily (deposits_2019-06-01.csv) or monthly (deposits_201906.csv) partition names
+PARTITION_DATE_PATTERN = re.compile(r'(?<!\d)(\d{4})[-_]?(\d{2})(?:[-_]?(\d{2}))?(?!\d)')
+
+
+def _csv_engine():
+    # pyarrow parses each file on all cores; fall back to the C parser without it
+    try:
+        import pyarrow  # noqa: F401
+        return 'pyarrow'
+    except ImportError:
+        return 'c'
+
+
+def resolve_partitions(source):
+    # Accept a single file, a directory of partitions or a glob pattern
+    if os.path.isdir(source):
+        paths = [
+            os.path.join(source, name) for name in os.listdir(source)
+            if name.endswith(PARTITION_EXTENSIONS)
+        ]
+    elif glob.has_magic(source):
+        paths = glob.glob(source)
+    else:
+        paths = [source]
+
+    if not paths:
+        raise FileNotFoundError(f"No deposit partitions found for '{source}'")
+
+    return sorted(paths)
+
+
+def file_signature(paths):
+    # Cheap data version: changes whenever any file's size or modification time does
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+def partition_date_bounds(path):
+    # Date span covered by a partition, from its file name or its Parquet footer;
+    # (None, None) when neither tells
+    match = PARTITION_DATE_PATTERN.search(os.path.basename(path))
+    if match:
+        year, month, day = match.groups()
+        try:
+            if day:
+                start = pd.Timestamp(int(year), int(month), int(day))
+                return start, start
+            start = pd.Timestamp(int(year), int(month), 1)
+            return start, start + pd.offsets.MonthEnd(0)
+        except ValueError:
+            # Digits that only look like a date, e.g. an export batch number
+            pass
+
+    if path.endswith('.parquet'):
+        return _parquet_footer_bounds(path)
+
+    return None, None
+
+
+def _parquet_footer_bounds(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None, None
+
+    metadata = pq.ParquetFile(path).metadata
+    if 'deposit_date' not in metadata.schema.names:
+        return None, None
+    column_index = metadata.schema.names.index('deposit_date')
+    mins, maxs = [], []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(column_index).statistics
+        if stats is None or not stats.has_min_max:
+            return None, None
+        mins.append(pd.Timestamp(stats.min))
+        maxs.append(pd.Timestamp(stats.max))
+
+    if not mins:
+        return None, None
+    return min(mins), max(maxs)
+
+
+def overlapping_partitions(paths, start_date=None, end_date=None, bounds=None):
+    # The partitions that may hold deposits dated inside [start_date, end_date]; those whose
+    # span is unknown are kept. bounds are the paths' partition_date_bounds, if already known
+    if start_date is None and end_date is None:
+        return list(paths)
+    if bounds is None:
+        bounds = [partition_date_bounds(path) for path in paths]
+    start = pd.Timestamp(start_date).normalize() if start_date is not None else None
+    end = pd.Timestamp(end_date) if end_date is not None else None
+
+    kept = []
+    for path, (first, last) in zip(paths, bounds):
+        if first is not None and ((start is not None and last < start) or (end is not None and first > end)):
+            continue
+        kept.append(path)
+    return kept
+
+
+def to_cents(amounts):
+    # Dollar amounts -> int64 cents, rounded half to even
+    amounts = np.asarray(amounts, dtype='float64')
+    with np.errstate(invalid='ignore'):
+        cents = np.rint(amounts * CENTS)
+    return np.where(np.isfinite(cents), cents, MISSING_CENTS).astype('int64')
+
+
+def to_dollars(cents):
+    # Inverse of to_cents for display; exact integers divide to the nearest double
+    return cents / CENTS
+
+
+def amounts_in_cents(partition):
+    # The store's cents column as it is, otherwise the dollar column converted
+    if CENTS_COLUMN in partition.columns:
+        return partition[CENTS_COLUMN].astype('int64')
+    return pd.Series(to_cents(partition['deposit_amount']), index=partition.index)
+
+
+def store_columns(deposit_data):
+    # Deposits as written to our own stores, with the cents column named as such
+    return deposit_data.rename(columns={'deposit_amount': CENTS_COLUMN})
+
+
+def _parquet_columns(path):
+    # DEPOSIT_COLUMNS as named in this file
+    import pyarrow.parquet as pq
+    if CENTS_COLUMN not in pq.read_schema(path).names:
+        return DEPOSIT_COLUMNS
+    return [CENTS_COLUMN if column == 'deposit_amount' else column for column in DEPOSIT_COLUMNS]
+
+
+def client_ids(values):
+    # int64 client ids; blank, non-numeric or fractional ones become MISSING_CLIENT_ID
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return values.astype('int64')
+    numbers = pd.to_numeric(values, errors='coerce').to_numpy('float64')
+    valid = np.isfinite(numbers) & (numbers == np.floor(numbers))
+    return pd.Series(np.where(valid, numbers, MISSING_CLIENT_ID).astype('int64'), index=values.index)
+
+
+def normalize_partition(partition):
+    # Bad values are coerced to their missing markers rather than raised, so one malformed
+    # row is quarantined by validation instead of aborting the whole load
+    partition = partition.assign(
+        client_id=client_ids(partition['client_id']),
+        deposit_amount=amounts_in_cents(partition),
+    )[DEPOSIT_COLUMNS]
+    partition = partition.astype(DEPOSIT_DTYPES)
+    partition['deposit_date'] = pd.to_datetime(partition['deposit_date'], errors='coerce')
+    return partition
+
+
+def read_csv_bytes(data):
+    return normalize_partition(pd.read_csv(io.BytesIO(data), usecols=DEPOSIT_COLUMNS, dtype=CSV_DTYPES,
+                                           engine=_csv_engine()))
+
+
+def read_partition(path):
+    if path.endswith('.parquet'):
+        partition = pd.read_parquet(path, columns=_parquet_columns(path))
+    else:
+        partition = pd.read_csv(path, usecols=DEPOSIT_COLUMNS, dtype=CSV_DTYPES, engine=_csv_engine())
+
+    return normalize_partition(partition)
+
+
+def concat_partitions(partitions):
+    # Union category sets so the combined frame keeps the compact schema
+    partitions = [p for p in partitions if len(p)] or partitions[:1]
+    if len(partitions) == 1:
+        return partitions[0].reset_index(drop=True)
+
+    columns = {}
+    for column in DEPOSIT_COLUMNS:
+        if DEPOSIT_DTYPES.get(column) == 'category':
+            columns[column] = pd.Series(union_categoricals([p[column] for p in partitions], sort_categories=True))
+        else:
+            columns[column] = pd.concat([p[column] for p in partitions], ignore_index=True)
+
+    return pd.DataFrame(columns)
+
+
+def load_deposits(source, start_date=None, end_date=None, max_workers=None):
+    # Partitions wholly outside [start_date, end_date] are skipped unread; the rows of those
+    # straddling it are all loaded, and validation quarantines the ones outside the calendar
+    paths = overlapping_partitions(resolve_partitions(source), start_date, end_date)
+    if not paths:
+        raise FileNotFoundError(f"No deposit partitions in '{source}' overlap the requested date range")
+
+    # Parsers release the GIL, so a thread pool scales with the core count
+    workers = max_workers or min(len(paths), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        partitions = list(executor.map(read_partition, paths))
+
+    return concat_partitions(partitions)
+
+
+def calendar_span(calendar_data):
+    # First and last calendar dates; deposits outside them are quarantined, so partitions
+    # outside them need not be read
+    return calendar_data['gregorian_date'].min(), calendar_data['gregorian_date'].max()
+
+
+def assign_months(deposit_data, calendar_data):
+    # Tag each deposit with its case-study month (nearest calendar date)
+    return pd.merge_asof(
+        deposit_data.sort_values('deposit_date'),
+        calendar_data.sort_values('gregorian_date'),
+        left_on='deposit_date',
+        right_on='gregorian_date',
+        direction='nearest'
+    )
@@ -0,0 +1,227 @@
+import pandas as pd
+
+from analysis import backends, sections, ltv, decay
+
+BASELINE_MONTHS = ['Month 1', 'Month 2']
+CAMPAIGN_MONTH = 'Month 3'
+POST_CAMPAIGN_MONTHS = ['Month 4', 'Month 5']
+CAMPAIGN_COST = 5000000  # $5M campaign cost
+
+# Segment the LTV churn hazard and cohort table are broken down by
+LTV_SEGMENT = 'client_geographical_region'
+
+# Segment the post-campaign lift-decay curves are fitted for
+DECAY_SEGMENT = 'client_geographical_region'
+
+PERFORMANCE_COLUMNS = pd.MultiIndex.from_tuples([
+    ('deposit_amount', 'mean'), ('deposit_amount', 'sum'),
+    ('deposit_amount', 'count'), ('client_id', 'nunique')
+])
+
+
+def _row(**values):
+    # Scalar KPI blocks are stored as one-row tables like every other snapshot entry
+    return pd.DataFrame([values])
+
+
+def campaign_monthly_metrics(backend, filters):
+    # Backends sum integer cents; tables are converted to dollars only here, for display
+    monthly_metrics = backends.in_dollars(backend.monthly_metrics(filters))[[
+        'deposit_sum', 'deposit_mean', 'deposit_count', 'deposit_std',
+        'unique_clients', 'deposit_count'
+    ]].round(2)
+
+    monthly_metrics.columns = [
+        'Total Deposits ($)', 'Average Deposit ($)',
+        'Number of Deposits', 'Deposit Std ($)',
+        'Unique Clients', 'Total Transactions'
+    ]
+    return monthly_metrics
+
+
+def headline_kpis(monthly_metrics):
+    baseline_deposits = monthly_metrics.loc[BASELINE_MONTHS, 'Total Deposits ($)'].mean()
+    campaign_deposits = monthly_metrics.loc[CAMPAIGN_MONTH, 'Total Deposits ($)']
+    post_campaign_deposits = monthly_metrics.loc[POST_CAMPAIGN_MONTHS, 'Total Deposits ($)'].mean()
+
+    campaign_clients = monthly_metrics.loc[CAMPAIGN_MONTH, 'Unique Clients']
+    baseline_clients = monthly_metrics.loc[BASELINE_MONTHS, 'Unique Clients'].mean()
+    campaign_avg = monthly_metrics.loc[CAMPAIGN_MONTH, 'Average Deposit ($)']
+    baseline_avg = monthly_metrics.loc[BASELINE_MONTHS, 'Average Deposit ($)'].mean()
+
+    return _row(
+        baseline_deposits=baseline_deposits,
+        campaign_deposits=campaign_deposits,
+        post_campaign_deposits=post_campaign_deposits,
+        growth_vs_baseline=((campaign_deposits - baseline_deposits) / baseline_deposits) * 100,
+        client_growth=((campaign_clients - baseline_clients) / baseline_clients) * 100,
+        avg_deposit_growth=((campaign_avg - baseline_avg) / baseline_avg) * 100,
+    )
+
+
+def roi_metrics(monthly_metrics, kpis):
+    baseline_deposits = kpis['baseline_deposits']
+
+    # Calculate incremental revenue
+    incremental_campaign = kpis['campaign_deposits'] - baseline_deposits
+    incremental_post = sum(monthly_metrics.loc[POST_CAMPAIGN_MONTHS, 'Total Deposits ($)'] - baseline_deposits)
+    total_incremental = incremental_campaign + incremental_post
+
+    return _row(
+        incremental_campaign=incremental_campaign,
+        incremental_post=incremental_post,
+        total_incremental=total_incremental,
+        roi=((total_incremental - CAMPAIGN_COST) / CAMPAIGN_COST) * 100,
+    )
+
+
+def success_metrics(client_ltv):
+    # CAC charges the campaign cost to the clients acquired in the campaign month;
+    # LTV is the per-client lifetime value of that cohort (see analysis.ltv)
+    campaign_clients = client_ltv[client_ltv['acquisition_month'] == CAMPAIGN_MONTH]
+    acquisition_cost = CAMPAIGN_COST / len(campaign_clients) if len(campaign_clients) else float('inf')
+    estimated_lifetime_value = campaign_clients['ltv'].mean() if len(campaign_clients) else 0.0
+
+    # Calculate ROI multiple
+    roi_multiple = estimated_lifetime_value / acquisition_cost if acquisition_cost > 0 else 0
+
+    return _row(
+        acquisition_cost=acquisition_cost,
+        estimated_lifetime_value=estimated_lifetime_value,
+        roi_multiple=roi_multiple,
+    )
+
+
+def month6_projection(monthly_metrics, kpis, roi):
+    baseline_deposits = kpis['baseline_deposits']
+
+    # Calculate trend-based projection for Month 6
+    monthly_growth = (monthly_metrics['Total Deposits ($)'].pct_change().mean())
+    projected_baseline = baseline_deposits * (1 + monthly_growth) ** 5  # Project to Month 6
+
+    # Calculate campaign impact if moved to Month 6
+    campaign_lift_percentage = (kpis['campaign_deposits'] - baseline_deposits) / baseline_deposits
+    projected_month6_with_campaign = projected_baseline * (1 + campaign_lift_percentage)
+
+    return _row(
+        projected_baseline=projected_baseline,
+        current_total_impact=roi['incremental_campaign'] + roi['incremental_post'],
+        projected_impact=projected_month6_with_campaign - projected_baseline,
+    )
+
+
+def segment_totals(segment_metrics):
+    return backends.in_dollars(segment_metrics)[['deposit_sum', 'unique_clients']].rename(
+        columns={'deposit_sum': 'deposit_amount', 'unique_clients': 'client_id'}
+    ).round(2)
+
+
+def segment_performance(segment_metrics):
+    performance = backends.in_dollars(segment_metrics)[
+        ['deposit_mean', 'deposit_sum', 'deposit_count', 'unique_clients']
+    ].round(2)
+    performance.columns = PERFORMANCE_COLUMNS
+    return performance
+
+
+def campaign_tables(backend, filters):
+    # The backend queries are independent of each other and run concurrently; when the
+    # tables are themselves computed in a page section they go to the nested pool
+    tables = sections.run_concurrently({
+        'monthly_metrics': lambda: campaign_monthly_metrics(backend, filters),
+        'daily_metrics': lambda: backends.in_dollars(backend.daily_metrics(filters)),
+        'deposit_type_metrics': lambda: segment_totals(backend.by_type(filters)),
+        'cadence_metrics': lambda: segment_totals(backend.by_cadence(filters)),
+        'deposit_type_performance': lambda: segment_performance(backend.by_type(filters, month=CAMPAIGN_MONTH)),
+        'cadence_performance': lambda: segment_performance(backend.by_cadence(filters, month=CAMPAIGN_MONTH)),
+        'client_metrics': lambda: backends.in_dollars(backend.client_metrics(filters, ltv.SEGMENT_ATTRIBUTES)),
+        'segment_daily': lambda: backends.in_dollars(backend.daily_metrics(filters, ['month_name', DECAY_SEGMENT])),
+        'client_cohorts': lambda: backend.cohort_table(filters),
+    })
+
+    # Per-client rows feed the LTV model but are not kept in the snapshot
+    client_ltv = ltv.client_ltv(tables.pop('client_metrics'), segment=LTV_SEGMENT)
+
+    monthly_metrics = tables['monthly_metrics']
+    kpis = headline_kpis(monthly_metrics)
+    roi = roi_metrics(monthly_metrics, kpis.iloc[0])
+    tables.update(
+        kpis=kpis,
+        roi=roi,
+        success=success_metrics(client_ltv),
+        ltv_cohorts=ltv.ltv_by_cohort(client_ltv, LTV_SEGMENT, CAMPAIGN_MONTH, CAMPAIGN_COST),
+        lift_decay=decay.lift_decay(
+            tables.pop('segment_daily'), DECAY_SEGMENT, BASELINE_MONTHS, CAMPAIGN_MONTH, POST_CAMPAIGN_MONTHS
+        ),
+        month6=month6_projection(monthly_metrics, kpis.iloc[0], roi.iloc[0]),
+    )
+    return tables
+
+
+def attribute_metrics(backend, filters, attribute):
+    metrics = backends.in_dollars(backend.by_client_attribute(filters, attribute))[
+        ['deposit_sum', 'deposit_mean', 'unique_clients']
+    ].round(2)
+    metrics.columns = ['Total Deposits', 'Average Deposit', 'Unique Clients']
+    return metrics.reset_index()
+
+
+def dimension_table(name):
+    # Strategy table of a derived dimension, e.g. 'age_group_metrics'
+    return f"{name}_metrics"
+
+
+def strategy_tables(backend, filters):
+    tasks = {
+        'region_metrics': lambda: attribute_metrics(backend, filters, 'client_geographical_region'),
+        'residence_metrics': lambda: attribute_metrics(backend, filters, 'client_residence_status'),
+    }
+    for bucketing in backend.derived_dimensions:
+        tasks[dimension_table(bucketing.name)] = lambda name=bucketing.name: attribute_metrics(backend, filters, name)
+    return sections.run_concurrently(tasks)
+
+
+def what_if_tables(backend, filters):
+    monthly_metrics = backends.in_dollars(backend.monthly_metrics(filters))[
+        ['deposit_sum', 'deposit_mean', 'deposit_std', 'unique_clients']
+    ].round(2)
+    monthly_metrics.columns = ['Total Deposits', 'Average Deposit', 'Std Deposit', 'Unique Clients']
+    return {'monthly_metrics': monthly_metrics}
+
+
+# Tables each view expects, besides the strategy tables of the derived dimensions
+# (view_table_names); older snapshots missing one are recomputed
+VIEW_TABLE_NAMES = {
+    'campaign': [
+        'monthly_metrics', 'kpis', 'roi', 'success', 'month6', 'daily_metrics',
+        'deposit_type_metrics', 'cadence_metrics', 'deposit_type_performance', 'cadence_performance',
+        'ltv_cohorts', 'client_cohorts', 'lift_decay',
+    ],
+    'strategy': ['region_metrics', 'residence_metrics'],
+    'what_if': ['monthly_metrics'],
+}
+
+VIEW_TABLES = {
+    'campaign': campaign_tables,
+    'strategy': strategy_tables,
+    'what_if': what_if_tables,
+}
+
+
+def view_table_names(view, backend):
+    names = list(VIEW_TABLE_NAMES[view])
+    if view == 'strategy':
+        names += [dimension_table(bucketing.name) for bucketing in backend.derived_dimensions]
+    return names
+
+
+def load_tables(view, backend, filters, snapshot_store=None):
+    # Serve from the snapshot store when possible, computing on a miss
+    compute = VIEW_TABLES[view]
+    version = backend.cache_version(filters)
+    if snapshot_store is None or version is None:
+        return compute(backend, filters)
+    return snapshot_store.load_or_compute(
+        version, filters, view, lambda: compute(backend, filters),
+        required=view_table_names(view, backend)
+    )
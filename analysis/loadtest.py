@@ -0,0 +1,290 @@
+import argparse
+import logging
+import os
+import resource
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from analysis import (backends, campaign_analysis, figure_cache, graph, ingest, strategy_recommendations,
+                      what_if_analysis)
+
+REGIONS = ['Midwest', 'Northeast', 'South', 'West']
+STATUSES = ['Own', 'Rent']
+MONTH_STARTS = pd.date_range('2019-06-01', periods=5, freq='MS')
+CAMPAIGN_LIFT = 1.3
+
+# Share of session actions per kind; page visits re-render a whole view
+DEFAULT_MIX = {'page': 0.4, 'filter': 0.35, 'slider': 0.2, 'lookup': 0.05}
+
+PAGES = {
+    'campaign': campaign_analysis.show_analysis,
+    'strategy': strategy_recommendations.show_analysis,
+    'what_if': what_if_analysis.show_analysis,
+}
+
+# Every graph the pages memoize into; cleared between levels so each starts cold
+GRAPHS = [campaign_analysis.GRAPH, strategy_recommendations.GRAPH, what_if_analysis.GRAPH]
+
+
+def synthetic_data(n_clients=50_000, n_deposits=1_000_000, seed=0):
+    # Client, deposit and calendar frames shaped like the CSV inputs, with a Month 3 lift
+    rng = np.random.default_rng(seed)
+    client_ids = rng.choice(10 ** 15, size=n_clients, replace=False).astype('int64')
+    client_data = pd.DataFrame({
+        'client_id': client_ids,
+        'client_geographical_region': rng.choice(REGIONS, n_clients),
+        'client_residence_status': rng.choice(STATUSES, n_clients, p=[0.4, 0.6]),
+        'client_age': rng.integers(21, 90, n_clients),
+    })
+
+    days = pd.date_range(MONTH_STARTS[0], MONTH_STARTS[-1] + pd.offsets.MonthEnd(0), freq='D')
+    calendar_data = pd.DataFrame({
+        'gregorian_date': days,
+        'month_name': [f"Month {MONTH_STARTS.get_loc(day.to_period('M').start_time) + 1}" for day in days],
+    })
+
+    dates = days[rng.integers(0, len(days), n_deposits)]
+    lift = np.where(dates.month == MONTH_STARTS[2].month, CAMPAIGN_LIFT, 1.0)
+    deposit_data = pd.DataFrame({
+        'client_id': client_ids[rng.integers(0, n_clients, n_deposits)],
+        'deposit_type': pd.Categorical(rng.choice(['Scheduled Deposit', 'Actual Deposit'], n_deposits)),
+        'deposit_amount': ingest.to_cents(rng.gamma(2.0, 150.0, n_deposits) * lift),
+        'deposit_cadence': pd.Categorical(rng.choice(['Monthly', 'Biweekly', 'Extra'], n_deposits, p=[0.6, 0.3, 0.1])),
+        'deposit_date': dates,
+    })
+    return client_data, deposit_data, calendar_data
+
+
+def synthetic_backend(kind='pandas', n_clients=50_000, n_deposits=1_000_000, seed=0, parquet_dir=None):
+    client_data, deposit_data, calendar_data = synthetic_data(n_clients, n_deposits, seed)
+    data_version = f"synthetic-{n_clients}-{n_deposits}-{seed}"
+    if kind == 'duckdb':
+        directory = parquet_dir or tempfile.mkdtemp(prefix='loadtest_parquet_')
+        return backends.DuckDBBackend.from_frames(
+            client_data, deposit_data, calendar_data, directory, data_version=data_version
+        )
+    return backends.PandasBackend(client_data, deposit_data, calendar_data, data_version=data_version)
+
+
+def filter_pool(backend, size=20, seed=0):
+    # A fixed set of filter selections sessions switch between; the first is the unfiltered default
+    rng = np.random.default_rng(seed)
+    regions = backend.distinct_values('client_geographical_region')
+    statuses = backend.distinct_values('client_residence_status')
+    low, high = backend.date_bounds()
+
+    pool = [backends.make_filters()]
+    while len(pool) < size:
+        chosen_regions = sorted(rng.choice(regions, rng.integers(1, len(regions) + 1), replace=False))
+        chosen_statuses = sorted(rng.choice(statuses, rng.integers(1, len(statuses) + 1), replace=False))
+        # Date trims stay inside the first and last month so every page keeps its baseline months
+        trimmed = rng.random() < 0.3
+        pool.append(backends.make_filters(
+            start_date=low + pd.Timedelta(days=int(rng.integers(1, 15))) if trimmed else None,
+            end_date=high - pd.Timedelta(days=int(rng.integers(1, 15))) if trimmed else None,
+            regions=chosen_regions if len(chosen_regions) < len(regions) else None,
+            statuses=chosen_statuses if len(chosen_statuses) < len(statuses) else None,
+        ))
+    return pool
+
+
+def _rss_mb():
+    # Current resident set size; peak RSS where /proc is unavailable
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Session:
+    # One simulated analyst: a current page, filter selection and slider positions,
+    # changed by weighted random actions that each trigger the rerun the app would do
+    def __init__(self, backend, pool, cache, snapshot_store, mix, seed, client_ids=None):
+        self.backend = backend
+        self.pool = pool
+        self.cache = cache
+        self.snapshot_store = snapshot_store
+        self.rng = np.random.default_rng(seed)
+        self.kinds = list(mix)
+        self.weights = np.array(list(mix.values()), dtype='float64') / sum(mix.values())
+        self.page = 'campaign'
+        self.filters = pool[0]
+        self.client_ids = client_ids
+
+    def _render(self):
+        PAGES[self.page](self.backend, self.filters, self.snapshot_store, self.cache)
+
+    def page_switch(self):
+        self.page = list(PAGES)[self.rng.integers(len(PAGES))]
+        self._render()
+
+    def filter_change(self):
+        self.filters = self.pool[self.rng.integers(len(self.pool))]
+        self._render()
+
+    def slider_move(self):
+        # A slider rerun recomputes the scenario nodes; the projection is memoized
+        inputs = graph.filter_inputs(self.backend, self.filters)
+        inputs.update(
+            pessimistic_growth=int(self.rng.integers(-10, 1)) * 5 / 100,
+            optimistic_growth=int(self.rng.integers(0, 11)) * 5 / 100,
+        )
+        resources = {'backend': self.backend, 'snapshot_store': self.snapshot_store}
+        memoize = self.backend.data_version is not None
+        what_if_analysis.GRAPH.evaluate('scenarios', inputs, resources, memoize)
+        what_if_analysis.GRAPH.evaluate('roi_scenarios', inputs, resources, memoize)
+
+    def lookup(self):
+        client_id = int(self.client_ids[self.rng.integers(len(self.client_ids))])
+        self.backend.client_attributes(client_id)
+        self.backend.client_history(client_id)
+
+    def step(self):
+        kind = self.kinds[self.rng.choice(len(self.kinds), p=self.weights)]
+        {'page': self.page_switch, 'filter': self.filter_change,
+         'slider': self.slider_move, 'lookup': self.lookup}[kind]()
+        return kind
+
+
+def reset_caches(cache=None):
+    for compute_graph in GRAPHS:
+        compute_graph.clear()
+    if cache is not None:
+        cache.clear()
+
+
+def run_level(backend, sessions, duration=10.0, pool=None, mix=None, cache=None, snapshot_store=None,
+              think_time=0.0, seed=0):
+    # Drive `sessions` concurrent sessions for `duration` seconds; -> latencies per action kind
+    pool = pool or filter_pool(backend, seed=seed)
+    mix = mix or DEFAULT_MIX
+    latencies = defaultdict(list)
+    errors = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    client_ids = backend.client_metrics(pool[0]).index.to_numpy() if mix.get('lookup') else None
+
+    def worker(index):
+        session = Session(backend, pool, cache, snapshot_store, mix, seed * 10_007 + index, client_ids)
+        local = defaultdict(list)
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                kind = session.step()
+            except Exception as e:
+                errors.append(e)
+                continue
+            local[kind].append(time.perf_counter() - start)
+            if think_time:
+                stop.wait(session.rng.exponential(think_time))
+        with lock:
+            for kind, values in local.items():
+                latencies[kind].extend(values)
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f"session-{i}") for i in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started, errors
+
+
+def summarize(latencies, elapsed):
+    rows = {}
+    for kind, values in sorted(latencies.items()) + [('all', sum(latencies.values(), []))]:
+        values = np.asarray(values) * 1000
+        if not len(values):
+            continue
+        rows[kind] = {
+            'actions': len(values),
+            'throughput_per_s': len(values) / elapsed,
+            'p50_ms': np.percentile(values, 50),
+            'p95_ms': np.percentile(values, 95),
+            'p99_ms': np.percentile(values, 99),
+        }
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def run(backend, session_counts, duration=10.0, mix=None, pool_size=20, cache_mb=64, snapshot_store=None,
+        think_time=0.0, seed=0, cold=True):
+    # One level per session count, by default each from cold graph and figure caches; -> one row per level
+    pool = filter_pool(backend, pool_size, seed)
+    cache = figure_cache.FigureCache(int(cache_mb * 2 ** 20)) if cache_mb else None
+    baseline_mb = _rss_mb()
+    rows = []
+    for sessions in session_counts:
+        if cold:
+            reset_caches(cache)
+        latencies, elapsed, errors = run_level(
+            backend, sessions, duration, pool, mix, cache, snapshot_store, think_time, seed
+        )
+        summary = summarize(latencies, elapsed)
+        rss_mb = _rss_mb()
+        row = {'sessions': sessions, 'errors': len(errors), 'rss_mb': rss_mb,
+               'rss_mb_per_session': (rss_mb - baseline_mb) / sessions}
+        if 'all' in summary.index:
+            row.update(summary.loc['all'].to_dict())
+        for kind in summary.index.drop('all', errors='ignore'):
+            row[f"{kind}_p95_ms"] = summary.loc[kind, 'p95_ms']
+        rows.append(row)
+        if errors:
+            logging.getLogger(__name__).warning("%d session errors at %d sessions, first: %r",
+                                                len(errors), sessions, errors[0])
+    return pd.DataFrame(rows).set_index('sessions')
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action '{kind}', expected one of {', '.join(DEFAULT_MIX)}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the dashboard compute path with concurrent sessions")
+    parser.add_argument('--sessions', default='1,4,16,32', help="Comma-separated session counts")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per session count")
+    parser.add_argument('--clients', type=int, default=50_000)
+    parser.add_argument('--deposits', type=int, default=1_000_000)
+    parser.add_argument('--backend', choices=['pandas', 'duckdb'], default='pandas')
+    parser.add_argument('--mix', type=_parse_mix, default=DEFAULT_MIX,
+                        help="Action weights, e.g. page=0.4,filter=0.35,slider=0.2,lookup=0.05")
+    parser.add_argument('--filters', type=int, default=20, help="Distinct filter selections sessions switch between")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Mean pause between actions, in seconds")
+    parser.add_argument('--figure-cache-mb', type=float, default=64)
+    parser.add_argument('--warm', action='store_true', help="Keep memoized results between session counts")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results table to this CSV")
+    args = parser.parse_args()
+
+    # Pages run in Streamlit's bare mode; its missing-context warnings would flood the output
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+
+    start = time.perf_counter()
+    backend = synthetic_backend(args.backend, args.clients, args.deposits, args.seed)
+    print(f"Built {args.backend} backend with {args.deposits:,} deposits for {args.clients:,} clients "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    results = run(
+        backend, [int(count) for count in args.sessions.split(',')], args.duration, args.mix,
+        args.filters, args.figure_cache_mb, think_time=args.think_time, seed=args.seed, cold=not args.warm
+    )
+    print(results.round(2).to_string())
+    if args.output:
+        results.to_csv(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# Lifetime value is the expected deposit total over this many months from acquisition
+HORIZON_MONTHS = 12
+DAYS_PER_MONTH = 30.4375
+
+# Expected gap between deposits for clients with a single deposit so far
+DEFAULT_GAP_DAYS = 30
+
+SEGMENT_ATTRIBUTES = ['client_geographical_region', 'client_residence_status']
+
+
+def client_ltv(client_metrics, as_of=None, horizon=HORIZON_MONTHS, segment=None):
+    # One vectorized pass over the per-client table from QueryBackend.client_metrics:
+    #   rate      deposits per month since acquisition
+    #   survival  probability the client is still active, from how overdue their next
+    #             deposit is relative to their own average gap
+    #   ltv       realized deposits plus surviving deposits up to `horizon` months, with
+    #             a monthly churn hazard pooled per segment (or overall)
+    first = client_metrics['first_date'].to_numpy('datetime64[ns]')
+    last = client_metrics['last_date'].to_numpy('datetime64[ns]')
+    count = client_metrics['deposit_count'].to_numpy('float64')
+    total = client_metrics['deposit_sum'].to_numpy('float64')
+    as_of = np.datetime64(as_of if as_of is not None else last.max(), 'ns')
+
+    day = np.timedelta64(1, 'D')
+    tenure_days = (last - first) / day + 1
+    age_days = (as_of - first) / day + 1
+    gap_days = (as_of - last) / day
+
+    expected_gap = np.where(count > 1, (tenure_days - 1) / np.maximum(count - 1, 1), DEFAULT_GAP_DAYS)
+    expected_gap = np.maximum(expected_gap, 1)
+    survival = np.exp(-np.maximum(gap_days - expected_gap, 0) / expected_gap)
+
+    age_months = np.maximum(age_days / DAYS_PER_MONTH, 1)
+    rate = total / age_months
+
+    result = client_metrics.copy()
+    result['tenure_days'] = tenure_days
+    result['rate'] = rate
+    result['survival'] = survival
+
+    # Expected churn events per exposure month, pooled within each segment
+    churn = pd.DataFrame({'churned': 1 - survival, 'exposure': age_months}, index=client_metrics.index)
+    keys = result[segment] if segment is not None else np.zeros(len(result), dtype='int8')
+    pooled = churn.groupby(keys, sort=False).transform('sum')
+    hazard = np.clip(pooled['churned'].to_numpy() / pooled['exposure'].to_numpy(), 0, 1)
+
+    # Surviving months left in the horizon, as a geometric sum of monthly retention
+    retention = 1 - hazard
+    remaining = np.maximum(horizon - age_months, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        future_months = np.where(
+            retention < 1,
+            retention * (1 - retention ** remaining) / (1 - retention),
+            remaining
+        )
+    result['monthly_hazard'] = hazard
+    result['ltv'] = total + survival * rate * future_months
+    return result
+
+
+def ltv_by_cohort(client_ltv, segment, campaign_month, campaign_cost):
+    # LTV per acquisition month and segment; campaign cost is charged to the clients
+    # acquired in the campaign month, spread evenly so CAC is per acquired client
+    cohorts = client_ltv.groupby(['acquisition_month', segment], observed=True).agg(
+        clients=('ltv', 'size'),
+        avg_ltv=('ltv', 'mean'),
+        total_ltv=('ltv', 'sum'),
+        avg_rate=('rate', 'mean'),
+        avg_survival=('survival', 'mean'),
+    )
+    months = cohorts.index.get_level_values('acquisition_month')
+    campaign_clients = cohorts.loc[months == campaign_month, 'clients'].sum()
+    cac = campaign_cost / campaign_clients if campaign_clients else np.inf
+    cohorts['cac'] = np.where(months == campaign_month, cac, np.nan)
+    cohorts['ltv_cac'] = cohorts['avg_ltv'] / cohorts['cac']
+    return cohorts
@@ -0,0 +1,274 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis import backends, ingest
+
+# Deposits are sampled independently within each of these cells
+STRATA = ['month_name', 'client_geographical_region', 'client_residence_status', 'deposit_type']
+
+DEFAULT_FRACTION = 0.05
+
+# Small strata keep at least this many rows (or all of them) so their estimates stay usable
+MIN_STRATUM_ROWS = 200
+
+# Two-sided 95% normal interval, used for the error bars
+Z_95 = 1.96
+
+
+def stratified_sample(data, fraction=DEFAULT_FRACTION, min_rows=MIN_STRATUM_ROWS, seed=0):
+    # Simple random sample without replacement inside every stratum; each kept row
+    # carries its stratum code and the design weight N_h / n_h
+    strata = [column for column in STRATA if column in data.columns]
+    codes = data.groupby(strata, observed=True, sort=False).ngroup().to_numpy()
+    population = np.bincount(codes)
+    target = np.minimum(population, np.maximum(np.ceil(population * fraction), min_rows)).astype('int64')
+
+    # Rank rows within their stratum in random order and keep the first n_h
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(codes)), codes))
+    starts = np.concatenate([[0], np.cumsum(population)[:-1]])
+    rank = np.empty(len(codes), dtype='int64')
+    rank[order] = np.arange(len(codes)) - starts[codes[order]]
+    keep = rank < target[codes]
+
+    sample = data[keep].reset_index(drop=True)
+    sample['stratum'] = codes[keep]
+    sample['weight'] = population[codes[keep]] / target[codes[keep]]
+    design = pd.DataFrame({'population': population, 'sampled': target})
+    return sample, design
+
+
+def client_hash_sample(client_ids, fraction, seed=0):
+    # Keeps every row of the clients whose mixed 64-bit hash falls below the fraction, so a
+    # client is either wholly in or out whatever the filters
+    with np.errstate(over='ignore'):
+        mixed = (client_ids.to_numpy().astype('uint64') + np.uint64(seed)) * np.uint64(0x9E3779B97F4A7C15)
+        mixed ^= mixed >> np.uint64(31)
+        mixed *= np.uint64(0xBF58476D1CE4E5B9)
+        mixed ^= mixed >> np.uint64(29)
+    return mixed < np.uint64(fraction * 2.0 ** 64)
+
+
+class SampledBackend(backends.QueryBackend):
+    # Estimates the deposit aggregates from a stratified sample of the exact backend's rows.
+    # Totals and counts are weighted (Horvitz-Thompson) sums, means are ratio estimates and
+    # distinct clients come from a separate hash sample of whole clients; segment_errors gives
+    # the matching standard errors. Per-client queries go to the exact backend.
+    approximate = True
+
+    def __init__(self, exact, fraction=DEFAULT_FRACTION, min_rows=MIN_STRATUM_ROWS, seed=0):
+        self.exact = exact
+        self.fraction = fraction
+        self.data_version = f"{exact.data_version}-sample{fraction:g}" if exact.data_version is not None else None
+        data = exact.scan(backends.make_filters())
+        self.sample, self.design = stratified_sample(data, fraction, min_rows, seed)
+        self.client_sample = data[client_hash_sample(data['client_id'], fraction, seed)].reset_index(drop=True)
+
+        # The exact backend's sketches are already compact; distributions stay exact
+        self.sketches = exact.sketches
+        self.registry = exact.registry
+        self.derived_dimensions = exact.derived_dimensions
+
+        # Per-stratum variance factor N_h^2 (1 - n_h / N_h) / n_h of a domain total
+        population = self.design['population'].to_numpy('float64')
+        sampled = self.design['sampled'].to_numpy('float64')
+        self._variance_factor = population ** 2 * (1 - sampled / population) / sampled
+        self._stratum_rows = sampled
+
+    def cache_version(self, filters):
+        version = self.exact.cache_version(filters)
+        return f"{version}-sample{self.fraction:g}" if version is not None else None
+
+    @property
+    def sample_size(self):
+        return len(self.sample)
+
+    @property
+    def population_size(self):
+        return int(self.design['population'].sum())
+
+    def _mask(self, filters, data=None):
+        data = self.sample if data is None else data
+        mask = np.ones(len(data), dtype=bool)
+        if filters.start_date is not None:
+            mask &= (data['deposit_date'] >= filters.start_date).to_numpy()
+        if filters.end_date is not None:
+            mask &= (data['deposit_date'] <= filters.end_date).to_numpy()
+        if filters.regions is not None:
+            mask &= data['client_geographical_region'].isin(filters.regions).to_numpy()
+        if filters.statuses is not None:
+            mask &= data['client_residence_status'].isin(filters.statuses).to_numpy()
+        return mask
+
+    def scan(self, filters, columns=None):
+        # Sample rows, with their stratum and weight columns
+        data = self.sample[self._mask(filters)]
+        return data[list(columns) + ['stratum', 'weight']] if columns is not None else data
+
+    def _keys(self, data, dims, month):
+        if month is not None:
+            return data[data['month_name'] == month], list(dims) or ['month_name']
+        return data, ['month_name'] + list(dims)
+
+    def _domain_variance(self, frame, keys, value):
+        # Variance of the estimated domain total of `value`, summed over strata:
+        # N_h^2 (1 - f_h) / n_h * s_h^2, with out-of-domain sample rows counted as zero
+        cells = frame.groupby(keys + ['stratum'], observed=True).agg(
+            total=(value, 'sum'), squares=(value + '_squared', 'sum')
+        )
+        stratum = cells.index.get_level_values('stratum').to_numpy()
+        n = self._stratum_rows[stratum]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            s2 = np.where(n > 1, (cells['squares'] - cells['total'] ** 2 / n) / (n - 1), 0.0)
+        contribution = pd.Series(self._variance_factor[stratum] * np.maximum(s2, 0), index=cells.index)
+        return contribution.groupby(level=keys, observed=True).sum()
+
+    def _estimate(self, data, keys, filters, month=None):
+        amount = data['deposit_amount'].to_numpy('float64')
+        weight = data['weight'].to_numpy('float64')
+        frame = data[keys + ['client_id', 'stratum']].copy()
+        frame['amount'] = amount
+        frame['amount_squared'] = amount ** 2
+        frame['one'] = 1.0
+        frame['one_squared'] = 1.0
+        frame['weighted'] = weight * amount
+        frame['weighted_squared'] = weight * amount ** 2
+        frame['weight'] = weight
+
+        grouped = frame.groupby(keys, observed=True)
+        result = grouped.agg(
+            deposit_sum=('weighted', 'sum'),
+            deposit_count=('weight', 'sum'),
+            weighted_squares=('weighted_squared', 'sum'),
+            sample_rows=('one', 'sum'),
+        )
+        result['deposit_mean'] = result['deposit_sum'] / result['deposit_count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (result['weighted_squares'] - result['deposit_count'] * result['deposit_mean'] ** 2) / (
+                result['deposit_count'] - 1
+            )
+        result['deposit_std'] = np.sqrt(np.maximum(variance, 0)).where(result['sample_rows'] > 1)
+        clients = self._distinct_clients(keys, filters, month)
+        result['unique_clients'] = clients.reindex(result.index).fillna(0)
+
+        # Standard errors; the mean's comes from linearizing the ratio sum / count
+        sum_variance = self._domain_variance(frame, keys, 'amount')
+        count_variance = self._domain_variance(frame, keys, 'one')
+        mean = result['deposit_mean'].reindex(frame.set_index(keys).index).to_numpy()
+        frame['residual'] = amount - mean
+        frame['residual_squared'] = frame['residual'] ** 2
+        mean_variance = self._domain_variance(frame, keys, 'residual') / result['deposit_count'] ** 2
+        errors = pd.DataFrame({
+            'deposit_sum': np.sqrt(sum_variance),
+            'deposit_count': np.sqrt(count_variance),
+            'deposit_mean': np.sqrt(mean_variance),
+            'unique_clients': np.sqrt(result['unique_clients'] * (1 - self.fraction) / self.fraction),
+        }).reindex(result.index)
+        return result, errors
+
+    def _distinct_clients(self, keys, filters, month=None):
+        # Distinct clients are counted among the hash-sampled clients, whose deposits are
+        # all kept, and scaled up by the client sampling fraction
+        data = self.client_sample[self._mask(filters, self.client_sample)]
+        if month is not None:
+            data = data[data['month_name'] == month]
+        if 'deposit_date' in keys:
+            data = data.assign(deposit_date=data['deposit_date'].dt.normalize())
+        return data.groupby(keys, observed=True)['client_id'].nunique() / self.fraction
+
+    def segment_metrics(self, filters, dims=(), month=None):
+        data, keys = self._keys(self.scan(filters), dims, month)
+        result, _ = self._estimate(data, keys, filters, month)
+        result['deposit_sum'] = result['deposit_sum'].round()
+        result['deposit_count'] = result['deposit_count'].round()
+        result['unique_clients'] = result['unique_clients'].round()
+        return backends.finalize_segments(result, keys)
+
+    def segment_errors(self, filters, dims=(), month=None):
+        # Standard errors of deposit_sum, deposit_count and deposit_mean (money in cents), indexed
+        # like segment_metrics
+        data, keys = self._keys(self.scan(filters), dims, month)
+        _, errors = self._estimate(data, keys, filters, month)
+        errors = errors.reset_index()
+        for key in keys:
+            errors[key] = errors[key].astype(object)
+        return errors.set_index(keys)
+
+    def daily_metrics(self, filters, dims=()):
+        data = self.scan(filters)
+        data = data.assign(deposit_date=data['deposit_date'].dt.normalize())
+        result, _ = self._estimate(data, list(dims) + ['deposit_date'], filters)
+        result['deposit_sum'] = result['deposit_sum'].round()
+        result['deposit_count'] = result['deposit_count'].round()
+        result['unique_clients'] = result['unique_clients'].round()
+        return backends.finalize_daily(result, dims)
+
+    def client_metrics(self, filters, attributes=()):
+        return self.exact.client_metrics(filters, attributes)
+
+    def cohort_table(self, filters):
+        return self.exact.cohort_table(filters)
+
+    def distinct_values(self, column):
+        return self.exact.distinct_values(column)
+
+    def date_bounds(self):
+        return self.exact.date_bounds()
+
+    def client_history(self, client_id):
+        return self.exact.client_history(client_id)
+
+    def client_attributes(self, client_id):
+        return self.exact.client_attributes(client_id)
+
+
+def error_bars(backend, filters, dims=(), month=None):
+    # 95% half-widths of the deposit totals in dollars, or None for exact backends
+    if not getattr(backend, 'approximate', False):
+        return None
+    return ingest.to_dollars(backend.segment_errors(filters, dims, month)['deposit_sum'] * Z_95)
+
+
+def approximation_note(backend, filters):
+    # One-line description of the sample and the overall precision of the filtered total
+    if not getattr(backend, 'approximate', False):
+        return None
+    total = backend.monthly_metrics(filters)['deposit_sum'].sum()
+    margin = np.sqrt((backend.segment_errors(filters)['deposit_sum'] ** 2).sum()) * Z_95
+    return (
+        f"≈ Approximate values from a {backend.fraction:.0%} stratified sample "
+        f"({backend.sample_size:,} of {backend.population_size:,} deposits); "
+        f"total deposits ±{margin / total:.1%} at 95%, error bars show 95% intervals."
+    )
+
+
+class BackgroundJobs:
+    # Exact recomputations requested from approximate mode, one at a time off the UI
+    # thread; results land in the page graphs and snapshot store, the futures only track state
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='exact')
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._futures[key] = self._executor.submit(func, *args, **kwargs)
+            return future
+
+    def status(self, key):
+        # None, 'running', 'done' or 'failed'
+        future = self._futures.get(key)
+        if future is None:
+            return None
+        if not future.done():
+            return 'running'
+        return 'failed' if future.exception() is not None else 'done'
+
+    def error(self, key):
+        future = self._futures.get(key)
+        return future.exception() if future is not None and future.done() else None
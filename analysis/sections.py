@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+# Shared by every session; pandas and NumPy kernels release the GIL, so sections overlap
+MAX_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+THREAD_PREFIX = 'section'
+
+# Work scheduled from inside a section (e.g. the backend queries of a page's tables node)
+# goes to a second pool, so it still overlaps without a section waiting on its own pool
+NESTED_THREAD_PREFIX = 'query'
+
+_executors = {}
+_executor_lock = threading.Lock()
+
+
+def _pool(prefix):
+    with _executor_lock:
+        if prefix not in _executors:
+            _executors[prefix] = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix=prefix)
+    return _executors[prefix]
+
+
+def executor():
+    return _pool(THREAD_PREFIX)
+
+
+def nested_executor():
+    return _pool(NESTED_THREAD_PREFIX)
+
+
+def _current_pool():
+    # The pool for work scheduled from this thread: sections from the script thread, nested
+    # work from a section, and None (run inline) below that, so no pool ever waits on itself
+    name = threading.current_thread().name
+    if name.startswith(NESTED_THREAD_PREFIX + '_'):
+        return None
+    if name.startswith(THREAD_PREFIX + '_'):
+        return nested_executor()
+    return executor()
+
+
+class SectionScheduler:
+    # Independent page sections computed concurrently; the view takes results in page
+    # order, so Streamlit calls stay on the script thread
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self._futures = {}
+
+    def _timed(self, name, func, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.timings[name] = (start - self.started, time.perf_counter() - start)
+
+    def submit(self, name, func, *args, **kwargs):
+        pool = _current_pool()
+        if pool is None:
+            future = Future()
+            try:
+                future.set_result(self._timed(name, func, args, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = pool.submit(self._timed, name, func, args, kwargs)
+        self._futures[name] = future
+        return future
+
+    def result(self, name):
+        return self._futures[name].result()
+
+    def timing_table(self):
+        # Offset from page start and duration per section, plus the page's wall clock so far
+        rows = [
+            {'Section': name, 'Started (s)': offset, 'Duration (s)': duration}
+            for name, (offset, duration) in self.timings.items()
+        ]
+        rows.append({'Section': 'Page total', 'Started (s)': 0.0,
+                     'Duration (s)': time.perf_counter() - self.started})
+        return pd.DataFrame(rows).round(3)
+
+
+def run_concurrently(tasks):
+    # {name: callable} -> {name: result}, with the callables run side by side
+    scheduler = SectionScheduler()
+    for name, task in tasks.items():
+        scheduler.submit(name, task)
+    return {name: scheduler.result(name) for name in tasks}
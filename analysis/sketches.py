@@ -0,0 +1,221 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from analysis import ingest
+
+# Log-bucketed (DDSketch-style) histograms: every quantile read from them is within this
+# relative error of an exact one, and sketches merge by adding bucket counts
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = np.log(GAMMA)
+
+# Amounts below this (zero, refunds) share one bucket that reads back as 0
+MIN_AMOUNT = 0.01
+ZERO_BUCKET = int(np.floor(np.log(MIN_AMOUNT) / LOG_GAMMA)) - 1
+
+# A sketch is kept per day and combination of these segments, plus the backend's derived
+# dimensions (QueryBackend.sketch_dims); filters and breakdowns on any of them are answered
+# by merging sketches
+SKETCH_DIMS = ['client_geographical_region', 'client_residence_status', 'deposit_type']
+CELL_KEYS = ['deposit_date', 'month_name']
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bucket_index(amounts):
+    amounts = np.asarray(amounts, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = np.ceil(np.log(np.maximum(amounts, MIN_AMOUNT)) / LOG_GAMMA)
+    return np.where(amounts >= MIN_AMOUNT, index, ZERO_BUCKET).astype('int32')
+
+
+def bucket_value(index):
+    # Midpoint (in relative terms) of the bucket (gamma^(i-1), gamma^i]
+    index = np.asarray(index)
+    return np.where(index == ZERO_BUCKET, 0.0, 2 * GAMMA ** index.astype('float64') / (GAMMA + 1))
+
+
+def bucket_sql(column):
+    # bucket_index() for SQL engines with LN and CEIL
+    return (f"CASE WHEN {column} >= {MIN_AMOUNT} THEN CAST(CEIL(LN({column}) / {LOG_GAMMA!r}) AS INTEGER) "
+            f"ELSE {ZERO_BUCKET} END")
+
+
+def bucket_counts(data, dims=SKETCH_DIMS):
+    # Per (day, month, segment..., bucket) deposit counts plus dollar amount moments; the keys
+    # are factorized into one mixed-radix integer so grouping is a single np.unique
+    dims = [dim for dim in dims if dim in data.columns]
+    amount = ingest.to_dollars(data['deposit_amount'].to_numpy('int64'))
+    columns = {'deposit_date': data['deposit_date'].dt.normalize(), 'month_name': data['month_name']}
+    columns.update((dim, data[dim]) for dim in dims)
+    columns['bucket'] = pd.Series(bucket_index(amount))
+
+    key = np.zeros(len(data), dtype='int64')
+    uniques = {}
+    for name, values in columns.items():
+        codes, uniques[name] = pd.factorize(values, sort=True)
+        key = key * (len(uniques[name]) + 1) + (codes + 1)
+    combined, inverse = np.unique(key, return_inverse=True)
+
+    counts = pd.DataFrame({
+        'count': np.bincount(inverse),
+        'amount': np.bincount(inverse, weights=amount),
+        'squares': np.bincount(inverse, weights=amount ** 2),
+    })
+    # Decode the combined key back into its columns, last factor first
+    decoded = {}
+    for name in reversed(list(columns)):
+        combined, codes = np.divmod(combined, len(uniques[name]) + 1)
+        # Code 0 is a missing key (e.g. an age outside the bands)
+        missing = bool((codes == 0).any())
+        decoded[name] = pd.Index(uniques[name]).take(codes - 1, allow_fill=missing,
+                                                     fill_value=np.nan if missing else None)
+    frame = pd.DataFrame({name: decoded[name] for name in columns})
+    frame['bucket'] = frame['bucket'].astype('int32')
+    return pd.concat([frame, counts], axis=1)
+
+
+class DepositSketches:
+    # One mergeable deposit-amount sketch per (day, segment) cell, stored sparsely as
+    # (cell, bucket, count) entries; queries mask cells by the filters and add up buckets
+    def __init__(self, counts, dims=SKETCH_DIMS):
+        self.dims = [dim for dim in dims if dim in counts.columns]
+        keys = CELL_KEYS + self.dims
+        counts = counts.copy()
+        counts['deposit_date'] = pd.to_datetime(counts['deposit_date']).astype('datetime64[ns]')
+        for key in keys[1:]:
+            counts[key] = counts[key].astype(object)
+
+        cell = counts.groupby(keys, observed=True, sort=True, dropna=False).ngroup().to_numpy()
+        first = np.unique(cell, return_index=True)[1]
+        self.cells = counts.iloc[first][keys].reset_index(drop=True)
+
+        self.min_bucket = int(counts['bucket'].min()) if len(counts) else 0
+        self.n_buckets = int(counts['bucket'].max()) - self.min_bucket + 1 if len(counts) else 1
+        self.cell = cell.astype('int32')
+        self.bucket = (counts['bucket'].to_numpy() - self.min_bucket).astype('int32')
+        self.count = counts['count'].to_numpy('int64')
+
+        # Exact per-cell moments, so mean and std merge without touching raw rows
+        moments = counts.groupby(cell)[['count', 'amount', 'squares']].sum()
+        self.moments = moments.reindex(range(len(self.cells)), fill_value=0).to_numpy('float64')
+
+    def merged(self, counts):
+        # A copy with another batch's bucket_counts added. The batch keeps cells of its own even
+        # where their keys repeat existing ones; queries group cells by their keys, so repeated
+        # cells add up like one, and the cost is that of the batch rather than of every cell
+        other = DepositSketches(counts, self.dims)
+        low = min(self.min_bucket, other.min_bucket)
+        high = max(self.min_bucket + self.n_buckets, other.min_bucket + other.n_buckets)
+        combined = copy.copy(self)
+        combined.cells = pd.concat([self.cells, other.cells], ignore_index=True)
+        combined.cell = np.concatenate([self.cell, other.cell + len(self.cells)]).astype('int32')
+        combined.bucket = np.concatenate([self.bucket + (self.min_bucket - low),
+                                          other.bucket + (other.min_bucket - low)]).astype('int32')
+        combined.count = np.concatenate([self.count, other.count])
+        combined.moments = np.concatenate([self.moments, other.moments])
+        combined.min_bucket, combined.n_buckets = low, high - low
+        return combined
+
+    def __len__(self):
+        return len(self.count)
+
+    @property
+    def nbytes(self):
+        return self.cell.nbytes + self.bucket.nbytes + self.count.nbytes + self.moments.nbytes
+
+    def _cell_mask(self, filters, month=None):
+        cells = self.cells
+        mask = np.ones(len(cells), dtype=bool)
+        if filters.start_date is not None:
+            mask &= (cells['deposit_date'] >= filters.start_date.normalize()).to_numpy()
+        if filters.end_date is not None:
+            mask &= (cells['deposit_date'] <= filters.end_date).to_numpy()
+        if filters.regions is not None:
+            mask &= cells['client_geographical_region'].isin(filters.regions).to_numpy()
+        if filters.statuses is not None:
+            mask &= cells['client_residence_status'].isin(filters.statuses).to_numpy()
+        if month is not None:
+            mask &= (cells['month_name'] == month).to_numpy()
+        return mask
+
+    def histograms(self, filters, by=(), month=None):
+        # Merged bucket counts per group: (group keys frame, groups x buckets count matrix)
+        by = list(by)
+        mask = self._cell_mask(filters, month)
+        if by:
+            # Cells with a missing key are left out of breakdowns by that key, like a groupby
+            grouped = self.cells.groupby(by, observed=True, sort=True)
+            group_of_cell = grouped.ngroup().fillna(-1).to_numpy('int64')
+            groups = grouped.size().index.to_frame(index=False)
+        else:
+            group_of_cell = np.zeros(len(self.cells), dtype='int64')
+            groups = pd.DataFrame(index=[0])
+        group_of_cell = np.where(mask, group_of_cell, -1)
+        mask = group_of_cell >= 0
+
+        entry_group = group_of_cell[self.cell]
+        keep = entry_group >= 0
+        flat = entry_group[keep].astype('int64') * self.n_buckets + self.bucket[keep]
+        matrix = np.bincount(flat, weights=self.count[keep], minlength=len(groups) * self.n_buckets)
+        matrix = matrix.reshape(len(groups), self.n_buckets)
+
+        moments = np.zeros((len(groups), 3))
+        np.add.at(moments, group_of_cell[mask], self.moments[mask])
+        present = matrix.sum(axis=1) > 0
+        return groups[present].reset_index(drop=True), matrix[present], moments[present]
+
+    def quantiles(self, filters, by=(), q=DEFAULT_QUANTILES, month=None):
+        # Count, exact mean and std, and approximate quantiles of deposit_amount per group
+        groups, matrix, moments = self.histograms(filters, by, month)
+        count, total, squares = moments.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            std = np.sqrt(np.maximum(squares - count * mean ** 2, 0) / (count - 1))
+
+        result = groups if by else pd.DataFrame(index=range(len(matrix)))
+        result = result.assign(deposit_count=count.astype('int64'), deposit_mean=mean, deposit_std=std)
+        cumulative = np.cumsum(matrix, axis=1)
+        for quantile in q:
+            # First bucket whose cumulative count passes the (0-based) rank q * (n - 1)
+            rank = quantile * (cumulative[:, -1] - 1)
+            index = (cumulative <= rank[:, None]).sum(axis=1)
+            result[f"p{quantile * 100:g}"] = bucket_value(index + self.min_bucket)
+        return result.set_index(by) if by else result
+
+    def distribution(self, filters, by=(), bins_per_decade=20, month=None):
+        # Share of deposits per log-spaced amount bin, long format for plotting
+        groups, matrix, _ = self.histograms(filters, by, month)
+        buckets = np.arange(self.n_buckets) + self.min_bucket
+        values = bucket_value(buckets)
+        bins = np.floor(np.log10(np.maximum(values, MIN_AMOUNT)) * bins_per_decade).astype('int64')
+        bins = np.where(buckets == ZERO_BUCKET, bins.min() - 1, bins)
+        unique_bins, bin_of_bucket = np.unique(bins, return_inverse=True)
+
+        binned = np.zeros((len(matrix), len(unique_bins)))
+        np.add.at(binned.T, bin_of_bucket, matrix.T)
+        share = binned / np.maximum(binned.sum(axis=1, keepdims=True), 1)
+
+        frame = pd.DataFrame(share, columns=10 ** ((unique_bins + 0.5) / bins_per_decade))
+        frame = pd.concat([groups, frame], axis=1) if by else frame
+        long = frame.melt(id_vars=list(by), var_name='deposit_amount', value_name='share')
+        return long[long['share'] > 0].sort_values(list(by) + ['deposit_amount']).reset_index(drop=True)
+
+
+def distribution_figure(distribution, by, title):
+    # One line per group over log-spaced amount bins, from DepositSketches.distribution
+    fig = px.line(
+        distribution,
+        x='deposit_amount',
+        y='share',
+        color=by,
+        title=title,
+        labels={'deposit_amount': 'Deposit Amount ($)', 'share': 'Share of Deposits'},
+        log_x=True,
+        line_shape='hvh'
+    )
+    fig.update_layout(yaxis_tickformat='.1%')
+    return fig
@@ -0,0 +1,122 @@
+import argparse
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+
+import pandas as pd
+
+from analysis import backends
+
+# Data versions kept on disk (exact and approximate-mode versions alike); the oldest are
+# removed whenever a new version is first written
+DEFAULT_MAX_VERSIONS = 8
+
+
+def filter_key(filters):
+    # Stable, filesystem-safe key for a QueryFilters selection
+    return hashlib.sha1(repr(tuple(filters)).encode()).hexdigest()[:16]
+
+
+class SnapshotStore:
+    # KPI tables persisted as <root>/<data version>/<view>/<filter key>.pkl
+    def __init__(self, root, max_versions=DEFAULT_MAX_VERSIONS):
+        self.root = root
+        self.max_versions = max_versions
+
+    def _path(self, data_version, filters, view):
+        return os.path.join(self.root, str(data_version), view, f"{filter_key(filters)}.pkl")
+
+    def get(self, data_version, filters, view):
+        path = self._path(data_version, filters, view)
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, data_version, filters, view, tables):
+        path = self._path(data_version, filters, view)
+        new_version = not os.path.isdir(os.path.join(self.root, str(data_version)))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Concurrent sessions may race on the same key; the rename keeps readers safe
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if new_version:
+            self.prune()
+
+    def load_or_compute(self, data_version, filters, view, compute, required=()):
+        # Snapshots written before a table was added to the view are recomputed
+        tables = self.get(data_version, filters, view)
+        if tables is None or not set(required) <= tables.keys():
+            tables = compute()
+            self.put(data_version, filters, view, tables)
+        return tables
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            (name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name))),
+            key=lambda name: os.path.getmtime(os.path.join(self.root, name))
+        )
+
+    def prune(self, keep=None):
+        # Removes all but the `keep` most recently written versions (0 or None keeps all)
+        keep = self.max_versions if keep is None else keep
+        if not keep:
+            return []
+        stale = self.versions()[:-keep]
+        for version in stale:
+            shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
+        return stale
+
+    def compare(self, view, version_a, version_b, filters=None):
+        # Per-table numeric deltas between two data versions, read straight from disk
+        filters = filters if filters is not None else backends.QueryFilters()
+        tables_a = self.get(version_a, filters, view)
+        tables_b = self.get(version_b, filters, view)
+        if tables_a is None or tables_b is None:
+            missing = version_a if tables_a is None else version_b
+            raise KeyError(f"No '{view}' snapshot for data version {missing} and these filters")
+
+        comparison = {}
+        for name in tables_a.keys() & tables_b.keys():
+            before = tables_a[name].select_dtypes('number')
+            after = tables_b[name].select_dtypes('number')
+            comparison[name] = pd.concat(
+                {version_a: before, version_b: after, 'delta': after.sub(before, fill_value=0)},
+                axis=1
+            )
+        return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect stored KPI snapshots")
+    parser.add_argument('root', help="Snapshot directory")
+    parser.add_argument('--view', default='campaign')
+    parser.add_argument('--compare', nargs=2, metavar=('VERSION_A', 'VERSION_B'))
+    parser.add_argument('--prune', type=int, metavar='KEEP', help="Remove all but the KEEP newest data versions")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.root)
+    if args.prune is not None:
+        for version in store.prune(args.prune):
+            print(f"removed {version}")
+        return
+    if not args.compare:
+        for version in store.versions():
+            print(version)
+        return
+
+    with pd.option_context('display.width', 200, 'display.max_columns', 30):
+        for name, table in sorted(store.compare(args.view, *args.compare).items()):
+            print(f"\n== {name} ==")
+            print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+import argparse
+import math
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from analysis import backends, ingest, sketches, validation
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    client_id INTEGER PRIMARY KEY,
+    client_geographical_region TEXT,
+    client_residence_status TEXT,
+    client_age INTEGER
+);
+CREATE TABLE IF NOT EXISTS deposits (
+    client_id INTEGER NOT NULL,
+    deposit_type TEXT,
+    deposit_amount_cents INTEGER,
+    deposit_cadence TEXT,
+    deposit_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS calendar (
+    gregorian_date TEXT PRIMARY KEY,
+    month_name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_deposits_date ON deposits (deposit_date);
+CREATE INDEX IF NOT EXISTS idx_deposits_client ON deposits (client_id, deposit_date);
+CREATE INDEX IF NOT EXISTS idx_clients_segment ON clients (client_geographical_region, client_residence_status);
+"""
+
+
+def sql_cents(amount):
+    # ingest.to_cents for one value, registered as to_cents(); SQLite's ROUND rounds half
+    # away from zero, which would break the bit-identical totals across engines
+    if amount is None or not math.isfinite(amount):
+        return None
+    return round(amount * ingest.CENTS)
+
+
+class ConnectionPool:
+    # Read-only connections shared by every Streamlit session in the process
+    def __init__(self, database, size=4):
+        self.database = database
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            f"file:{self.database}?mode=ro", uri=True, check_same_thread=False
+        )
+        connection.execute("PRAGMA cache_size = -65536")
+        connection.execute("PRAGMA mmap_size = 268435456")
+        connection.create_function('to_cents', 1, sql_cents, deterministic=True)
+        # LN and CEIL for sketches.bucket_sql; SQLite builds without the math functions lack them
+        connection.create_function('ln', 1, math.log, deterministic=True)
+        connection.create_function('ceil', 1, math.ceil, deterministic=True)
+        return connection
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+
+        # Pool exhausted: wait for another session to hand one back
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+
+def build_database(database, client_data, deposit_data, calendar_data):
+    # Load the CSV-shaped frames into an indexed SQLite file
+    with sqlite3.connect(database) as connection:
+        connection.executescript(SCHEMA)
+        client_data[['client_id'] + backends.CLIENT_COLUMNS].to_sql(
+            'clients', connection, if_exists='append', index=False
+        )
+
+        deposits = ingest.store_columns(deposit_data[ingest.DEPOSIT_COLUMNS])
+        deposits['deposit_date'] = deposits['deposit_date'].dt.strftime('%Y-%m-%d')
+        for column in ['deposit_type', 'deposit_cadence']:
+            deposits[column] = deposits[column].astype(object)
+        deposits.to_sql('deposits', connection, if_exists='append', index=False, chunksize=100_000)
+
+        calendar = calendar_data[['gregorian_date', 'month_name']].copy()
+        calendar['gregorian_date'] = pd.to_datetime(calendar['gregorian_date']).dt.strftime('%Y-%m-%d')
+        calendar.to_sql('calendar', connection, if_exists='append', index=False)
+        connection.execute("ANALYZE")
+
+
+class SQLiteSource:
+    def __init__(self, database, pool_size=4):
+        self.database = database
+        self.pool = ConnectionPool(database, size=pool_size)
+
+    def query(self, sql, params=()):
+        with self.pool.connection() as connection:
+            return pd.read_sql_query(sql, connection, params=params)
+
+    def query_chunks(self, sql, params=(), chunk_rows=backends.SCAN_CHUNK_ROWS):
+        # Holds one pooled connection until the result set is exhausted
+        with self.pool.connection() as connection:
+            yield from pd.read_sql_query(sql, connection, params=params, chunksize=chunk_rows)
+
+    def load_data(self, start_date=None, end_date=None):
+        # Same frames as app.load_data, with the date range applied in SQL
+        client_data = self.query("SELECT * FROM clients")
+
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append("deposit_date >= ?")
+            params.append(pd.Timestamp(start_date).strftime('%Y-%m-%d'))
+        if end_date is not None:
+            conditions.append("deposit_date <= ?")
+            params.append(pd.Timestamp(end_date).strftime('%Y-%m-%d'))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        deposit_data = ingest.normalize_partition(self.query(f"SELECT * FROM deposits {where}", params))
+
+        calendar_data = self.query("SELECT * FROM calendar ORDER BY gregorian_date")
+        calendar_data['gregorian_date'] = pd.to_datetime(calendar_data['gregorian_date'])
+
+        return client_data, deposit_data, calendar_data
+
+
+class SQLiteBackend(backends.QueryBackend):
+    # Filters and month-level aggregates run inside SQLite; only result sets cross the wire
+    def __init__(self, source, data_version=None, registry=None):
+        self.source = source
+        self.data_version = data_version or ingest.file_signature([source.database])
+        self.client_columns = list(source.query("SELECT * FROM clients LIMIT 0").columns)
+        # The database is opened read-only, so derived dimensions are banded in the query
+        # from their source column rather than stored as per-client codes
+        self.registry = registry or self.registry
+        self.derived_dimensions = self.registry.available(self.client_columns)
+        low, high = source.query("SELECT MIN(gregorian_date), MAX(gregorian_date) FROM calendar").iloc[0]
+        self.calendar_bounds = (low, high)
+        # Amounts are stored in cents; databases built earlier with a dollar deposit_amount
+        # column are converted on read
+        deposit_columns = source.query("SELECT name FROM pragma_table_info('deposits')")['name'].tolist()
+        self.amount_sql = (
+            f"d.{ingest.CENTS_COLUMN}" if ingest.CENTS_COLUMN in deposit_columns
+            else "to_cents(d.deposit_amount)"
+        )
+        self.sketches = sketches.DepositSketches(self.sketch_counts(), self.sketch_dims)
+
+    def _filtered_sql(self, filters):
+        conditions, params = [], []
+        if filters.start_date is not None:
+            conditions.append("d.deposit_date >= ?")
+            params.append(filters.start_date.strftime('%Y-%m-%d'))
+        if filters.end_date is not None:
+            conditions.append("d.deposit_date <= ?")
+            params.append(filters.end_date.strftime('%Y-%m-%d'))
+        if filters.regions is not None:
+            conditions.append(f"c.client_geographical_region IN ({', '.join('?' * len(filters.regions)) or 'NULL'})")
+            params.extend(filters.regions)
+        if filters.statuses is not None:
+            conditions.append(f"c.client_residence_status IN ({', '.join('?' * len(filters.statuses)) or 'NULL'})")
+            params.extend(filters.statuses)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        # Dates outside the calendar snap to its nearest end, like merge_asof(direction='nearest')
+        low, high = self.calendar_bounds
+        derived_select = ''.join(
+            f", {self.registry.band_sql(bucketing.name, f'c.{bucketing.column}')} AS {bucketing.name}"
+            for bucketing in self.derived_dimensions
+        )
+        sql = f"""
+            SELECT d.client_id, d.deposit_type, {self.amount_sql} AS deposit_amount, d.deposit_cadence,
+                   d.deposit_date, cal.month_name, c.client_geographical_region, c.client_residence_status,
+                   c.client_age{derived_select}
+            FROM deposits d
+            JOIN clients c ON c.client_id = d.client_id
+            JOIN calendar cal ON cal.gregorian_date = MIN(MAX(d.deposit_date, '{low}'), '{high}')
+            {where}
+        """
+        return sql, params
+
+    def scan(self, filters, columns=None):
+        sql, params = self._filtered_sql(filters)
+        select = ', '.join(columns) if columns is not None else '*'
+        result = self.source.query(f"SELECT {select} FROM ({sql})", params)
+        if 'deposit_date' in result.columns:
+            result['deposit_date'] = pd.to_datetime(result['deposit_date'])
+        return result
+
+    def scan_chunks(self, filters, columns=None, chunk_rows=backends.SCAN_CHUNK_ROWS):
+        sql, params = self._filtered_sql(filters)
+        select = ', '.join(columns) if columns is not None else '*'
+        for chunk in self.source.query_chunks(f"SELECT {select} FROM ({sql})", params, chunk_rows):
+            if 'deposit_date' in chunk.columns:
+                chunk['deposit_date'] = pd.to_datetime(chunk['deposit_date'])
+            yield chunk
+
+    def sketch_counts(self):
+        # Bucketed in SQL, like the DuckDB path; only the grouped counts leave the database
+        sql, params = self._filtered_sql(backends.make_filters())
+        keys = ', '.join(['deposit_date', 'month_name'] + self.sketch_dims)
+        cents = float(ingest.CENTS)
+        return self.source.query(f"""
+            SELECT {keys}, {sketches.bucket_sql(f'(deposit_amount / {cents})')} AS bucket,
+                   COUNT(*) AS count, SUM(deposit_amount) / {cents} AS amount,
+                   SUM(CAST(deposit_amount AS REAL) * deposit_amount) / {cents ** 2} AS squares
+            FROM ({sql})
+            GROUP BY {keys}, bucket
+        """, params)
+
+    def segment_metrics(self, filters, dims=(), month=None):
+        sql, params = self._filtered_sql(filters)
+        if month is not None:
+            keys = list(dims) or ['month_name']
+            sql = f"SELECT * FROM ({sql}) WHERE month_name = ?"
+            params = params + [month]
+        else:
+            keys = ['month_name'] + list(dims)
+
+        key_list = ', '.join(keys)
+        result = self.source.query(f"""
+            SELECT {key_list},
+                   SUM(deposit_amount) AS deposit_sum,
+                   SUM(CAST(deposit_amount AS REAL) * deposit_amount) AS deposit_sq_sum,
+                   COUNT(deposit_amount) AS deposit_count,
+                   COUNT(DISTINCT client_id) AS unique_clients
+            FROM ({sql})
+            WHERE {' AND '.join(f'{key} IS NOT NULL' for key in keys)}
+            GROUP BY {key_list}
+            ORDER BY {key_list}
+        """, params)
+
+        # SQLite has no STDDEV; derive the sample std from the pushed-down sums
+        count = result['deposit_count']
+        total = result['deposit_sum'].astype('float64')
+        variance = (result['deposit_sq_sum'] - total ** 2 / count) / (count - 1)
+        result['deposit_std'] = np.sqrt(variance.clip(lower=0)).where(count > 1)
+        return backends.finalize_segments(result, keys)
+
+    def daily_metrics(self, filters, dims=()):
+        sql, params = self._filtered_sql(filters)
+        key_list = ', '.join(list(dims) + ['deposit_date'])
+        result = self.source.query(f"""
+            SELECT {key_list},
+                   SUM(deposit_amount) AS deposit_sum,
+                   COUNT(deposit_amount) AS deposit_count,
+                   COUNT(DISTINCT client_id) AS unique_clients
+            FROM ({sql})
+            {'WHERE ' + ' AND '.join(f'{dim} IS NOT NULL' for dim in dims) if dims else ''}
+            GROUP BY {key_list}
+            ORDER BY {key_list}
+        """, params)
+        return backends.finalize_daily(result, dims)
+
+    def client_metrics(self, filters, attributes=()):
+        sql, params = self._filtered_sql(filters)
+        attribute_select = ''.join(f", MIN({attribute}) AS {attribute}" for attribute in attributes)
+        low, high = self.calendar_bounds
+        # Acquisition month is the calendar month of the first deposit, clamped like the row-level join
+        result = self.source.query(f"""
+            SELECT a.*, cal.month_name AS acquisition_month
+            FROM (
+                SELECT client_id,
+                       MIN(deposit_date) AS first_date,
+                       MAX(deposit_date) AS last_date,
+                       SUM(deposit_amount) AS deposit_sum,
+                       COUNT(deposit_amount) AS deposit_count{attribute_select}
+                FROM ({sql})
+                GROUP BY client_id
+            ) a
+            JOIN calendar cal ON cal.gregorian_date = MIN(MAX(a.first_date, '{low}'), '{high}')
+        """, params)
+        return backends.finalize_clients(result, attributes)
+
+    def cohort_table(self, filters):
+        sql, params = self._filtered_sql(filters)
+        return backends.finalize_cohorts(self.source.query(backends.COHORT_SQL.format(sql=sql), params))
+
+    def distinct_values(self, column):
+        if column not in self.client_columns:
+            return None
+        result = self.source.query(
+            f"SELECT DISTINCT {column} FROM clients WHERE {column} IS NOT NULL ORDER BY 1"
+        )
+        return result[column].tolist()
+
+    def client_history(self, client_id):
+        # Served by idx_deposits_client (client_id, deposit_date): a B-tree seek, no scan
+        low, high = self.calendar_bounds
+        result = self.source.query(f"""
+            SELECT d.client_id, d.deposit_type, {self.amount_sql} AS deposit_amount, d.deposit_cadence,
+                   d.deposit_date, cal.month_name
+            FROM deposits d
+            JOIN calendar cal ON cal.gregorian_date = MIN(MAX(d.deposit_date, '{low}'), '{high}')
+            WHERE d.client_id = ?
+            ORDER BY d.deposit_date
+        """, [int(client_id)])
+        return backends.finalize_history(result)
+
+    def client_attributes(self, client_id):
+        result = self.source.query("SELECT * FROM clients WHERE client_id = ?", [int(client_id)])
+        return result.iloc[0] if len(result) else None
+
+    def date_bounds(self):
+        low, high = self.source.query("SELECT MIN(deposit_date), MAX(deposit_date) FROM deposits").iloc[0]
+        return pd.Timestamp(low), pd.Timestamp(high)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an indexed SQLite database from the CSV inputs")
+    parser.add_argument('database')
+    parser.add_argument('--deposits', default='deposit_data1.csv', help="Deposit file, partition directory or glob")
+    parser.add_argument('--clients', default='client_data.csv')
+    parser.add_argument('--calendar', default='calendar_data.csv')
+    parser.add_argument('--quarantine-dir', default='.quarantine', help="Rejected deposit rows ('' keeps none)")
+    args = parser.parse_args()
+
+    client_data = pd.read_csv(args.clients)
+    calendar_data = pd.read_csv(args.calendar)
+    calendar_data['gregorian_date'] = pd.to_datetime(calendar_data['gregorian_date'])
+    # Bad deposit rows are quarantined here, so the database only ever holds clean ones
+    deposit_data, counts = validation.validate_inputs(
+        client_data, ingest.load_deposits(args.deposits, *ingest.calendar_span(calendar_data)), calendar_data,
+        args.quarantine_dir, ingest.file_signature(ingest.resolve_partitions(args.deposits))
+    )
+    build_database(args.database, client_data, deposit_data, calendar_data)
+    print(f"Wrote {args.database} ({counts['quarantined']:,} of {counts['rows']:,} deposit rows quarantined)")
+
+
+if __name__ == '__main__':
+    main()
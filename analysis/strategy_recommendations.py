@@ -1,89 +1,97 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+from analysis import kpis, dimensions, figure_cache, graph, sections, sampling, sketches
 
-def show_analysis(client_data, deposit_data, calendar_data):
-    st.header("Strategy Recommendations")
-    
-    # Merge data
-    deposit_data['deposit_date'] = pd.to_datetime(deposit_data['deposit_date'])
-    merged_data = pd.merge_asof(
-        deposit_data.sort_values('deposit_date'),
-        calendar_data.sort_values('gregorian_date'),
-        left_on='deposit_date',
-        right_on='gregorian_date',
-        direction='nearest'
+GRAPH = graph.ComputeGraph()
+
+# Breakdowns offered by the deposit size panel, besides the backend's derived dimensions
+SIZE_SEGMENTS = {
+    'Region': 'client_geographical_region',
+    'Residence Status': 'client_residence_status',
+    'Deposit Type': 'deposit_type',
+}
+
+@GRAPH.node('tables', inputs=graph.FILTER_INPUTS, resources=('backend', 'snapshot_store'))
+def tables_node(data_version, date_range, regions, statuses, backend, snapshot_store):
+    # Segment tables come from the snapshot store when available
+    filters = graph.filters_from(date_range, regions, statuses)
+    return kpis.load_tables('strategy', backend, filters, snapshot_store)
+
+def segment_figure(metrics, segment, title, errors=None):
+    if errors is not None:
+        keys = pd.MultiIndex.from_frame(metrics[['month_name', segment]])
+        metrics = metrics.assign(margin=errors.reindex(keys).to_numpy())
+    return px.bar(
+        metrics,
+        x='month_name',
+        y='Total Deposits',
+        error_y='margin' if errors is not None else None,
+        color=segment,
+        title=title,
+        barmode='group'
     )
-    
-    merged_data = pd.merge(
-        merged_data,
-        client_data,
-        on='client_id',
-        how='left'
+
+def show_analysis(backend, filters, snapshot_store=None, cache=None):
+    st.header("Strategy Recommendations")
+    note = sampling.approximation_note(backend, filters)
+    if note:
+        st.caption(note)
+    
+    scheduler = sections.SectionScheduler()
+    scheduler.submit(
+        "Segment tables", GRAPH.evaluate, 'tables', graph.filter_inputs(backend, filters),
+        {'backend': backend, 'snapshot_store': snapshot_store}, backend.data_version is not None
     )
+    tables = scheduler.result("Segment tables")
+    region_metrics = tables['region_metrics']
+    residence_metrics = tables['residence_metrics']
+    # One table per derived client dimension (age groups unless configured otherwise)
+    derived = [(bucketing, tables[kpis.dimension_table(bucketing.name)]) for bucketing in backend.derived_dimensions]
+    
+    # The breakdown figures are independent and built concurrently
+    for name, metrics, segment, title in [
+        ('region', region_metrics, 'client_geographical_region', 'Regional Deposit Performance'),
+        ('residence', residence_metrics, 'client_residence_status', 'Deposit Performance by Residence Status'),
+    ] + [
+        (bucketing.name, metrics, bucketing.name, f"Deposit Performance by {bucketing.title}")
+        for bucketing, metrics in derived
+    ]:
+        errors = sampling.error_bars(backend, filters, [segment])
+        scheduler.submit(f"{name.title()} figure", figure_cache.cached_figure, cache, backend, filters,
+                         'strategy', name, lambda m=metrics, c=segment, t=title, e=errors: segment_figure(m, c, t, e))
     
     # Regional Analysis
     st.subheader("Regional Performance")
-    region_metrics = merged_data.groupby(['month_name', 'client_geographical_region']).agg({
-        'deposit_amount': ['sum', 'mean'],
-        'client_id': 'nunique'
-    }).round(2)
-    region_metrics.columns = ['Total Deposits', 'Average Deposit', 'Unique Clients']
-    region_metrics = region_metrics.reset_index()
-    
-    fig_region = px.bar(
-        region_metrics,
-        x='month_name',
-        y='Total Deposits',
-        color='client_geographical_region',
-        title='Regional Deposit Performance',
-        barmode='group'
-    )
-    st.plotly_chart(fig_region)
+    st.plotly_chart(scheduler.result("Region figure"))
     
     # Residence Status Analysis
     st.subheader("Residence Status Analysis")
-    residence_metrics = merged_data.groupby(['month_name', 'client_residence_status']).agg({
-        'deposit_amount': ['sum', 'mean'],
-        'client_id': 'nunique'
-    }).round(2)
-    residence_metrics.columns = ['Total Deposits', 'Average Deposit', 'Unique Clients']
-    residence_metrics = residence_metrics.reset_index()
-    
-    fig_residence = px.bar(
-        residence_metrics,
-        x='month_name',
-        y='Total Deposits',
-        color='client_residence_status',
-        title='Deposit Performance by Residence Status',
-        barmode='group'
-    )
-    st.plotly_chart(fig_residence)
-    
-    # Age Group Analysis
-    st.subheader("Age Group Analysis")
-    merged_data['age_group'] = pd.cut(
-        merged_data['client_age'],
-        bins=[0, 25, 35, 45, 55, 100],
-        labels=['18-25', '26-35', '36-45', '46-55', '55+']
-    )
-    
-    age_metrics = merged_data.groupby(['month_name', 'age_group']).agg({
-        'deposit_amount': ['sum', 'mean'],
-        'client_id': 'nunique'
-    }).round(2)
-    age_metrics.columns = ['Total Deposits', 'Average Deposit', 'Unique Clients']
-    age_metrics = age_metrics.reset_index()
-    
-    fig_age = px.bar(
-        age_metrics,
-        x='month_name',
-        y='Total Deposits',
-        color='age_group',
-        title='Deposit Performance by Age Group',
-        barmode='group'
-    )
-    st.plotly_chart(fig_age)
+    st.plotly_chart(scheduler.result("Residence figure"))
+    
+    # Derived dimension analysis, e.g. age groups
+    for bucketing, _ in derived:
+        st.subheader(f"{bucketing.title} Analysis")
+        st.plotly_chart(scheduler.result(f"{bucketing.name.title()} figure"))
+    
+    # Deposit size by segment, merged from the per-day, per-segment sketches
+    st.subheader("Deposit Size by Segment")
+    size_segments = {**SIZE_SEGMENTS, **dimensions.titles(backend.derived_dimensions)}
+    size_label = st.selectbox("Break down by", list(size_segments), key="distribution_segment")
+    size_segment = size_segments[size_label]
+    scheduler.submit("Deposit size figure", figure_cache.cached_figure, cache, backend, filters, 'strategy',
+                     'deposit_size', lambda: sketches.distribution_figure(
+                         backend.sketches.distribution(filters, [size_segment]), size_segment,
+                         f"Deposit Size Distribution by {size_label}"), segment=size_segment)
+    deposit_sizes = backend.sketches.quantiles(filters, [size_segment]).rename(columns={
+        'deposit_count': 'Deposits', 'deposit_mean': 'Mean ($)', 'deposit_std': 'Std ($)',
+        'p50': 'Median ($)', 'p90': 'P90 ($)', 'p99': 'P99 ($)'
+    })
+    st.dataframe(deposit_sizes.style.format({
+        'Deposits': '{:,}', 'Mean ($)': '${:,.2f}', 'Std ($)': '${:,.2f}',
+        'Median ($)': '${:,.2f}', 'P90 ($)': '${:,.2f}', 'P99 ($)': '${:,.2f}'
+    }, na_rep='-'))
+    st.plotly_chart(scheduler.result("Deposit size figure"), use_container_width=True)
     
     # Key Findings
     st.subheader("Key Findings & Recommendations")
@@ -101,10 +109,15 @@ def show_analysis(client_data, deposit_data, calendar_data):
     st.write("#### Residence Status Insights")
     st.write(f"- Highest average deposits from: {best_residence.iloc[0]['client_residence_status']} (${best_residence.iloc[0]['Average Deposit']:,.2f})")
     
-    # Age Groups
-    best_age = age_metrics[age_metrics['month_name'] == 'Month 3'].nlargest(1, 'Total Deposits')
-    st.write("#### Age Group Insights")
-    st.write(f"- Most responsive age group: {best_age.iloc[0]['age_group']} (${best_age.iloc[0]['Total Deposits']:,.2f})")
+    # Derived dimensions
+    best_bands = []
+    for bucketing, metrics in derived:
+        best = metrics[metrics['month_name'] == 'Month 3'].nlargest(1, 'Total Deposits')
+        if best.empty:
+            continue
+        best_bands.append((bucketing, best.iloc[0][bucketing.name]))
+        st.write(f"#### {bucketing.title} Insights")
+        st.write(f"- Most responsive {bucketing.title.lower()}: {best.iloc[0][bucketing.name]} (${best.iloc[0]['Total Deposits']:,.2f})")
     
     # Strategic Recommendations
     st.write("#### Strategic Recommendations")
@@ -113,10 +126,14 @@ def show_analysis(client_data, deposit_data, calendar_data):
     st.write(f"   - Replicate successful strategies from {best_region.iloc[0]['client_geographical_region']}")
     
     st.write("2. Demographic Targeting:")
-    st.write(f"   - Primary focus on {best_age.iloc[0]['age_group']} age group")
+    for bucketing, band in best_bands[:1]:
+        st.write(f"   - Primary focus on {band} {bucketing.title.lower()}")
     st.write(f"   - Tailor messaging for {best_residence.iloc[0]['client_residence_status']} status clients")
     
     st.write("3. Campaign Optimization:")
     st.write("   - Analyze successful regions for best practices")
     st.write("   - Develop region-specific marketing strategies")
     st.write("   - Consider demographic-specific messaging")
+    
+    with st.expander("⏱️ Section Timings"):
+        st.dataframe(scheduler.timing_table(), hide_index=True)
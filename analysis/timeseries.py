@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# Above this many points traces are drawn with WebGL instead of SVG
+WEBGL_THRESHOLD = 1000
+
+# Target chart width in pixels; longer series are min/max-bucketed to two points per pixel
+DEFAULT_PIXEL_WIDTH = 1200
+
+ROLLING_WINDOWS = [7, 28]
+
+
+class DailySeries:
+    # Gap-free daily series backed by prefix sums, so any window total is an O(1) lookup
+    def __init__(self, daily_metrics, column='deposit_sum'):
+        values = daily_metrics[column]
+        if len(values):
+            index = pd.date_range(values.index.min(), values.index.max(), freq='D')
+            values = values.reindex(index, fill_value=0)
+        self.index = pd.DatetimeIndex(values.index)
+        self.values = values.to_numpy(dtype='float64')
+        self.cumsum = np.concatenate([[0.0], np.cumsum(self.values)])
+
+    def __len__(self):
+        return len(self.values)
+
+    def _position(self, date):
+        return int(self.index.searchsorted(pd.Timestamp(date)))
+
+    def range_sum(self, start_date, end_date):
+        # Total over [start_date, end_date] from two prefix-sum lookups
+        start = self._position(start_date)
+        end = int(self.index.searchsorted(pd.Timestamp(end_date), side='right'))
+        return self.cumsum[end] - self.cumsum[start]
+
+    def window_sum(self, date, days):
+        # Trailing total of the `days` days ending on `date`
+        end = int(self.index.searchsorted(pd.Timestamp(date), side='right'))
+        return self.cumsum[end] - self.cumsum[max(end - days, 0)]
+
+    def rolling_sum(self, days):
+        # Every trailing window at once; the first days-1 entries cover partial windows
+        ends = np.arange(1, len(self.values) + 1)
+        starts = np.maximum(ends - days, 0)
+        return pd.Series(self.cumsum[ends] - self.cumsum[starts], index=self.index)
+
+    def rolling_mean(self, days):
+        ends = np.arange(1, len(self.values) + 1)
+        sizes = np.minimum(ends, days)
+        return self.rolling_sum(days) / sizes
+
+    def moving_baseline(self, days=28):
+        # Mean of the preceding `days` days, excluding the current one
+        ends = np.arange(len(self.values))
+        starts = np.maximum(ends - days, 0)
+        sizes = ends - starts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            baseline = (self.cumsum[ends] - self.cumsum[starts]) / sizes
+        return pd.Series(baseline, index=self.index)
+
+    def weekly(self):
+        # Week totals straight from the prefix sums at week boundaries
+        if not len(self.values):
+            return pd.Series(dtype='float64')
+        week_starts = pd.date_range(self.index[0] - pd.Timedelta(days=self.index[0].weekday()),
+                                    self.index[-1], freq='W-MON')
+        positions = self.index.searchsorted(week_starts)
+        bounds = np.append(positions, len(self.values))
+        return pd.Series(self.cumsum[bounds[1:]] - self.cumsum[bounds[:-1]], index=week_starts)
+
+
+def minmax_downsample(x, y, n_buckets):
+    # Keep the min and max of each bucket in time order so peaks survive downsampling
+    y = np.asarray(y, dtype='float64')
+    if len(y) <= 2 * n_buckets:
+        return np.asarray(x), y
+
+    edges = np.linspace(0, len(y), n_buckets + 1).astype(int)
+    starts = edges[:-1]
+    filled = np.where(np.isnan(y), -np.inf, y)
+    arg_max = _bucket_arg(filled, starts, np.maximum)
+    filled = np.where(np.isnan(y), np.inf, y)
+    arg_min = _bucket_arg(filled, starts, np.minimum)
+
+    keep = np.unique(np.concatenate([arg_min, arg_max]))
+    return np.asarray(x)[keep], y[keep]
+
+
+def _bucket_arg(values, starts, ufunc):
+    # Position of each bucket's extreme via reduceat, resolved without a Python loop
+    extreme = ufunc.reduceat(values, starts)
+    bucket = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(values))))
+    hits = np.flatnonzero(values == extreme[bucket])
+    first = np.unique(bucket[hits], return_index=True)[1]
+    return hits[first]
+
+
+def line_trace(x, y, name, pixel_width=DEFAULT_PIXEL_WIDTH, **kwargs):
+    # SVG for short series; WebGL plus min/max bucketing for long ones
+    if len(y) > WEBGL_THRESHOLD:
+        x, y = minmax_downsample(x, y, pixel_width)
+        return go.Scattergl(x=x, y=y, name=name, mode='lines', **kwargs)
+    return go.Scatter(x=x, y=y, name=name, mode='lines', **kwargs)
+
+
+def trend_figure(series, resolution='Daily', pixel_width=DEFAULT_PIXEL_WIDTH):
+    fig = go.Figure()
+    if resolution == 'Weekly':
+        weekly = series.weekly()
+        fig.add_trace(line_trace(weekly.index, weekly.values, "Weekly Deposits", pixel_width,
+                                 line=dict(color='#1f77b4', width=2)))
+    else:
+        fig.add_trace(line_trace(series.index, series.values, "Daily Deposits", pixel_width,
+                                 line=dict(color='#1f77b4', width=1), opacity=0.5))
+        colors = {7: '#ff7f0e', 28: '#2ca02c'}
+        for days in ROLLING_WINDOWS:
+            rolling = series.rolling_mean(days)
+            fig.add_trace(line_trace(rolling.index, rolling.values, f"{days}-Day Average", pixel_width,
+                                     line=dict(color=colors.get(days), width=2)))
+        baseline = series.moving_baseline(28)
+        fig.add_trace(line_trace(baseline.index, baseline.values, "Moving Baseline (prior 28 days)", pixel_width,
+                                 line=dict(color='#9467bd', width=2, dash='dot')))
+
+    fig.update_layout(
+        height=450,
+        title_text=f"{resolution} Deposit Trends",
+        xaxis_title="Date",
+        yaxis_title="Total Deposits ($)",
+        hovermode='x unified'
+    )
+    return fig
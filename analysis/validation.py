@@ -0,0 +1,183 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from analysis import ingest
+
+# Rows failing any of these checks are moved out of the deposits into the quarantine file;
+# each is one bit of the per-row reason mask
+REASONS = ['missing_value', 'negative_amount', 'outside_calendar', 'orphan_client', 'duplicate']
+
+# Two deposits with the same composite key are the same deposit recorded twice
+KEY_COLUMNS = ['client_id', 'deposit_date', 'deposit_type', 'deposit_amount']
+
+# Width of the bitmap that pre-selects rows sharing a repeated key hash
+FILTER_BITS = 22
+FILTER_MASK = (1 << FILTER_BITS) - 1
+
+ValidationResult = namedtuple('ValidationResult', ['clean', 'quarantine', 'counts'])
+
+
+def _mix(values):
+    # splitmix64 finalizer over uint64 lanes
+    with np.errstate(over='ignore'):
+        values = values ^ (values >> np.uint64(30))
+        values = values * np.uint64(0xBF58476D1CE4E5B9)
+        values = values ^ (values >> np.uint64(27))
+        values = values * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def _column_lanes(column):
+    # A stable uint64 per value: categories hash their labels, so codes from different
+    # category sets still agree; numbers and dates hash their 64-bit patterns
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        labels = pd.util.hash_pandas_object(column.cat.categories.to_series(), index=False).to_numpy()
+        codes = column.cat.codes.to_numpy()
+        return np.where(codes >= 0, labels[np.maximum(codes, 0)], np.uint64(0))
+    if pd.api.types.is_float_dtype(column.dtype):
+        return column.to_numpy('float64').view('uint64')
+    if pd.api.types.is_datetime64_dtype(column.dtype):
+        return column.to_numpy('datetime64[ns]').view('int64').view('uint64')
+    if pd.api.types.is_integer_dtype(column.dtype):
+        return column.to_numpy('int64').view('uint64')
+    return pd.util.hash_pandas_object(column, index=False).to_numpy()
+
+
+def composite_key_hash(deposit_data, columns=KEY_COLUMNS):
+    # One 64-bit hash per row of the composite key: columns are folded in polynomially and
+    # the result mixed once, without materializing the key tuples
+    hashed = np.zeros(len(deposit_data), dtype='uint64')
+    with np.errstate(over='ignore'):
+        for column in columns:
+            hashed *= np.uint64(0x9E3779B97F4A7C15)
+            hashed += _column_lanes(deposit_data[column])
+    return _mix(hashed)
+
+
+def _duplicates(deposit_data, hashed):
+    # Repeats of an earlier row's key hash. Repeated hash values are found with one sort
+    # rather than a hash table, and rows that may carry one with a lookup of their low bits;
+    # those few candidates are then confirmed on the key columns themselves
+    ordered = np.sort(hashed)
+    repeated = ordered[1:][ordered[1:] == ordered[:-1]]
+    duplicate = np.zeros(len(deposit_data), dtype=bool)
+    if not len(repeated):
+        return duplicate
+    low_bits = np.zeros(1 << FILTER_BITS, dtype=bool)
+    low_bits[repeated & np.uint64(FILTER_MASK)] = True
+    candidates = low_bits[hashed & np.uint64(FILTER_MASK)]
+    keys = deposit_data.loc[candidates, KEY_COLUMNS].assign(_hash=hashed[candidates])
+    duplicate[np.flatnonzero(candidates)] = keys.duplicated(keep='first').to_numpy()
+    return duplicate
+
+
+class KeyHistory:
+    # Composite-key hashes of every row validated so far, sorted, with the rows' positions, so
+    # a batch appended later is checked for repeats of earlier deposits without rehashing them.
+    # take(positions) returns those earlier rows, to confirm hash matches on the key columns
+    def __init__(self, take):
+        self.take = take
+        self.hashes = np.empty(0, dtype='uint64')
+        self.rows = np.empty(0, dtype='int64')
+        self.size = 0
+
+    def repeats(self, deposit_data, hashed):
+        low = np.searchsorted(self.hashes, hashed, side='left')
+        high = np.searchsorted(self.hashes, hashed, side='right')
+        candidates = np.flatnonzero(high > low)
+        repeat = np.zeros(len(deposit_data), dtype=bool)
+        if not len(candidates):
+            return repeat
+        positions = np.unique(np.concatenate([self.rows[low[i]:high[i]] for i in candidates]))
+        earlier = pd.MultiIndex.from_frame(self.take(positions)[KEY_COLUMNS].astype(object))
+        keys = pd.MultiIndex.from_frame(deposit_data.iloc[candidates][KEY_COLUMNS].astype(object))
+        repeat[candidates] = keys.isin(earlier)
+        return repeat
+
+    def add(self, hashed):
+        # Merged into the sorted arrays in one pass; only the new hashes are sorted
+        order = np.argsort(hashed, kind='stable')
+        at = np.searchsorted(self.hashes, hashed[order], side='right')
+        self.hashes = np.insert(self.hashes, at, hashed[order])
+        self.rows = np.insert(self.rows, at, self.size + order)
+        self.size += len(hashed)
+
+
+def validate_deposits(deposit_data, client_ids, calendar_bounds, history=None):
+    # -> ValidationResult(clean deposits, quarantined rows with a 'reasons' column, counts).
+    # With a KeyHistory, repeats of rows validated in earlier batches are duplicates too, and
+    # this batch's keys are added to it
+    amount = deposit_data['deposit_amount'].to_numpy('int64')
+    missing_amount = amount == ingest.MISSING_CENTS
+    missing_client = deposit_data['client_id'].to_numpy('int64') == ingest.MISSING_CLIENT_ID
+    dates = deposit_data['deposit_date'].to_numpy('datetime64[ns]')
+    low, high = (np.datetime64(pd.Timestamp(bound).normalize(), 'ns') for bound in calendar_bounds)
+
+    hashed = composite_key_hash(deposit_data)
+    duplicate = _duplicates(deposit_data, hashed)
+    if history is not None:
+        duplicate |= history.repeats(deposit_data, hashed)
+        history.add(hashed)
+
+    checks = {
+        'missing_value': missing_amount | missing_client | np.isnat(dates)
+        | deposit_data['deposit_type'].isna().to_numpy() | deposit_data['deposit_cadence'].isna().to_numpy(),
+        'negative_amount': (amount < 0) & ~missing_amount,
+        'outside_calendar': (dates < low) | (dates >= high + np.timedelta64(1, 'D')),
+        'orphan_client': ~deposit_data['client_id'].isin(client_ids).to_numpy() & ~missing_client,
+        'duplicate': duplicate,
+    }
+    mask = np.zeros(len(deposit_data), dtype='uint8')
+    for bit, reason in enumerate(REASONS):
+        mask |= checks[reason].astype('uint8') << bit
+
+    bad = mask > 0
+    if not bad.any():
+        counts = {'rows': len(deposit_data), 'quarantined': 0, **{reason: 0 for reason in REASONS}}
+        return ValidationResult(deposit_data, deposit_data.iloc[0:0].assign(reasons=''), counts)
+    quarantine = deposit_data[bad].copy()
+    labels = {code: ';'.join(r for bit, r in enumerate(REASONS) if code >> bit & 1) for code in np.unique(mask[bad])}
+    quarantine['reasons'] = pd.Series(mask[bad], index=quarantine.index).map(labels)
+
+    counts = {'rows': len(deposit_data), 'quarantined': int(bad.sum())}
+    counts.update((reason, int(checks[reason].sum())) for reason in REASONS)
+    return ValidationResult(deposit_data[~bad].reset_index(drop=True), quarantine, counts)
+
+
+def write_quarantine(quarantine, directory, data_version=None):
+    # Side file of the rejected rows for inspection; returns its path (None when empty)
+    if quarantine.empty:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"quarantine_{data_version or 'latest'}.csv")
+    # Amounts are written back in dollars like the source files, missing values left empty
+    amount = quarantine['deposit_amount']
+    client_id = quarantine['client_id'].astype('Int64')
+    quarantine = quarantine.assign(
+        client_id=client_id.where(client_id != ingest.MISSING_CLIENT_ID),
+        deposit_amount=ingest.to_dollars(amount.where(amount != ingest.MISSING_CENTS)),
+    )
+    quarantine.to_csv(path, index=False, date_format='%Y-%m-%d')
+    return path
+
+
+def validate_inputs(client_data, deposit_data, calendar_data, quarantine_dir=None, data_version=None,
+                    history=None):
+    # The ingest-time validation stage: checks deposits against the clients and the calendar,
+    # writes the quarantine side file and returns (clean deposits, counts)
+    result = validate_deposits(deposit_data, client_data['client_id'], ingest.calendar_span(calendar_data), history)
+    counts = dict(result.counts)
+    if quarantine_dir:
+        counts['quarantine_path'] = write_quarantine(result.quarantine, quarantine_dir, data_version)
+    return result.clean, counts
+
+
+def counts_table(counts):
+    # Reason / rows table for display
+    return pd.DataFrame({
+        'Check': [reason.replace('_', ' ').capitalize() for reason in REASONS],
+        'Rows': [counts[reason] for reason in REASONS],
+    })
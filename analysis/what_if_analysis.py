@@ -1,54 +1,169 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import numpy as np
-from scipy import stats
+import plotly.graph_objects as go
+from analysis import kpis, dimensions, figure_cache, graph, sections, forecast, sampling
 
-def show_analysis(client_data, deposit_data, calendar_data):
-    st.header("What-If Analysis")
+# Segmentations offered by the forecast panel, besides the backend's derived dimensions
+FORECAST_DIMENSIONS = {
+    'Region': 'client_geographical_region',
+    'Residence Status': 'client_residence_status',
+    'Deposit Type': 'deposit_type',
+    'Deposit Cadence': 'deposit_cadence',
+}
+
+# Bar colours of the scenario and ROI comparisons
+SCENARIO_COLORS = {
+    'Pessimistic': 'red',
+    'Expected': 'yellow',
+    'Optimistic': 'green'
+}
+
+GRAPH = graph.ComputeGraph()
+
+@GRAPH.node('monthly_metrics', inputs=graph.FILTER_INPUTS, resources=('backend', 'snapshot_store'))
+def monthly_metrics_node(data_version, date_range, regions, statuses, backend, snapshot_store):
+    # Monthly metrics come from the snapshot store when available
+    filters = graph.filters_from(date_range, regions, statuses)
+    return kpis.load_tables('what_if', backend, filters, snapshot_store)['monthly_metrics']
+
+@GRAPH.node('projection', inputs=['monthly_metrics'])
+def projection_node(monthly_metrics):
+    # Damped-trend exponential smoothing over the monthly totals, with a 95% interval
+    totals = monthly_metrics[['Total Deposits']].T
+    month6 = forecast.forecast_segments(totals, horizon=1, level=0.95).iloc[0]
     
-    # Merge data
-    deposit_data['deposit_date'] = pd.to_datetime(deposit_data['deposit_date'])
-    merged_data = pd.merge_asof(
-        deposit_data.sort_values('deposit_date'),
-        calendar_data.sort_values('gregorian_date'),
-        left_on='deposit_date',
-        right_on='gregorian_date',
-        direction='nearest'
+    return {
+        'avg_growth': month6['growth'],
+        'month5_deposits': month6['last_actual'],
+        'projected_month6': month6['forecast'],
+        'lower_bound': month6['lower'],
+        'upper_bound': month6['upper'],
+    }
+
+@GRAPH.node('segment_series', inputs=graph.FILTER_INPUTS + ('forecast_dimension',), resources=('backend',))
+def segment_series_node(data_version, date_range, regions, statuses, forecast_dimension, backend):
+    filters = graph.filters_from(date_range, regions, statuses)
+    return forecast.monthly_segment_series(backend, filters, [forecast_dimension])
+
+@GRAPH.node('segment_forecast', inputs=['segment_series'])
+def segment_forecast_node(segment_series):
+    # Every segment is fitted in one vectorized call; the campaign lift each segment
+    # showed in Month 3 is applied to its Month 6 forecast
+    segment_forecast = forecast.forecast_segments(segment_series, horizon=1, level=0.95)
+    months = segment_series.reindex(columns=kpis.BASELINE_MONTHS + [kpis.CAMPAIGN_MONTH])
+    baseline = months[kpis.BASELINE_MONTHS].mean(axis=1)
+    lift = (months[kpis.CAMPAIGN_MONTH] - baseline) / baseline
+    segment_forecast['campaign_lift'] = lift
+    segment_forecast['projected_campaign_return'] = segment_forecast['forecast'] * lift
+    return segment_forecast
+
+def segment_forecast_figure(segment_forecast, label):
+    fig = go.Figure(go.Bar(
+        x=segment_forecast.index.astype(str),
+        y=segment_forecast['forecast'],
+        error_y=dict(
+            type='data', symmetric=False,
+            array=segment_forecast['upper'] - segment_forecast['forecast'],
+            arrayminus=segment_forecast['forecast'] - segment_forecast['lower']
+        ),
+        name="Month 6 Forecast"
+    ))
+    fig.add_trace(go.Scatter(
+        x=segment_forecast.index.astype(str),
+        y=segment_forecast['last_actual'],
+        mode='markers', name="Month 5 Actual",
+        marker=dict(color='orange', size=10, symbol='diamond')
+    ))
+    fig.update_layout(title=f"Month 6 Deposit Forecast by {label} (95% interval)",
+                      xaxis_title=label, yaxis_title="Deposits ($)")
+    return fig
+
+def scenario_figure(scenarios):
+    scenario_df = pd.DataFrame({
+        'Scenario': scenarios.keys(),
+        'Projected Deposits': scenarios.values()
+    })
+    return px.bar(
+        scenario_df,
+        x='Scenario',
+        y='Projected Deposits',
+        title='Month 6 Scenario Comparison',
+        color='Scenario',
+        color_discrete_map=SCENARIO_COLORS
     )
+
+def roi_figure(roi_scenarios):
+    roi_df = pd.DataFrame({
+        'Scenario': roi_scenarios.keys(),
+        'ROI (%)': roi_scenarios.values()
+    })
+    return px.bar(
+        roi_df,
+        x='Scenario',
+        y='ROI (%)',
+        title='Campaign ROI by Scenario',
+        color='Scenario',
+        color_discrete_map=SCENARIO_COLORS
+    )
+
+@GRAPH.node('scenarios', inputs=['projection', 'pessimistic_growth', 'optimistic_growth'])
+def scenarios_node(projection, pessimistic_growth, optimistic_growth):
+    month5_deposits = projection['month5_deposits']
+    return {
+        'Pessimistic': month5_deposits * (1 + pessimistic_growth),
+        'Expected': projection['projected_month6'],
+        'Optimistic': month5_deposits * (1 + optimistic_growth)
+    }
+
+@GRAPH.node('roi_scenarios', inputs=['monthly_metrics', 'scenarios'])
+def roi_scenarios_node(monthly_metrics, scenarios):
+    # Calculate campaign metrics
+    baseline_months = ['Month 1', 'Month 2']
+    baseline_deposits = monthly_metrics.loc[baseline_months, 'Total Deposits'].mean()
     
-    # Calculate monthly metrics
-    monthly_metrics = merged_data.groupby('month_name').agg({
-        'deposit_amount': ['sum', 'mean', 'std'],
-        'client_id': 'nunique'
-    }).round(2)
-    monthly_metrics.columns = ['Total Deposits', 'Average Deposit', 'Std Deposit', 'Unique Clients']
-    
-    # Month 6 Projection
-    st.subheader("Month 6 Projection")
-    
-    # Calculate growth rates
-    growth_rates = []
-    for i in range(1, 5):
-        current = monthly_metrics.iloc[i]['Total Deposits']
-        previous = monthly_metrics.iloc[i-1]['Total Deposits']
-        growth_rate = (current - previous) / previous
-        growth_rates.append(growth_rate)
+    # Calculate ROI for different scenarios
+    campaign_cost = 5000000  # $5M campaign cost
     
-    avg_growth = np.mean(growth_rates)
-    std_growth = np.std(growth_rates)
+    roi_scenarios = {}
+    for scenario, month6_value in scenarios.items():
+        # Calculate total incremental value
+        incremental_value = (
+            # Month 3 (campaign month)
+            (monthly_metrics.loc['Month 3', 'Total Deposits'] - baseline_deposits) +
+            # Months 4-5
+            sum(monthly_metrics.loc[['Month 4', 'Month 5'], 'Total Deposits'] - baseline_deposits) +
+            # Projected Month 6
+            (month6_value - baseline_deposits)
+        )
+        
+        # Calculate ROI
+        roi = ((incremental_value - campaign_cost) / campaign_cost) * 100
+        roi_scenarios[scenario] = roi
+    return roi_scenarios
+
+def show_analysis(backend, filters, snapshot_store=None, cache=None):
+    st.header("What-If Analysis")
+    note = sampling.approximation_note(backend, filters)
+    if note:
+        st.caption(note)
     
-    # Project Month 6
-    month5_deposits = monthly_metrics.iloc[-1]['Total Deposits']
-    projected_month6 = month5_deposits * (1 + avg_growth)
+    # Derived tables are graph nodes: moving a slider recomputes only the scenario
+    # nodes, while the monthly metrics and growth projection are reused
+    inputs = graph.filter_inputs(backend, filters)
+    resources = {'backend': backend, 'snapshot_store': snapshot_store}
+    memoize = backend.data_version is not None
+    scheduler = sections.SectionScheduler()
     
-    # Calculate confidence interval
-    confidence_level = 0.95
-    z_score = stats.norm.ppf((1 + confidence_level) / 2)
-    margin_error = z_score * (std_growth * month5_deposits)
+    # Month 6 Projection
+    st.subheader("Month 6 Projection")
     
-    lower_bound = projected_month6 - margin_error
-    upper_bound = projected_month6 + margin_error
+    scheduler.submit("Projection", GRAPH.evaluate, 'projection', inputs, resources, memoize)
+    projection = scheduler.result("Projection")
+    avg_growth = projection['avg_growth']
+    projected_month6 = projection['projected_month6']
+    lower_bound = projection['lower_bound']
+    upper_bound = projection['upper_bound']
     
     # Display projections
     col1, col2, col3 = st.columns(3)
@@ -89,78 +204,63 @@ def show_analysis(client_data, deposit_data, calendar_data):
         ) / 100
     
     # Calculate scenarios
-    scenarios = {
-        'Pessimistic': month5_deposits * (1 + pessimistic_growth),
-        'Expected': projected_month6,
-        'Optimistic': month5_deposits * (1 + optimistic_growth)
-    }
+    inputs.update(pessimistic_growth=pessimistic_growth, optimistic_growth=optimistic_growth)
+    scheduler.submit("Scenarios", GRAPH.evaluate, 'scenarios', inputs, resources, memoize)
+    scenarios = scheduler.result("Scenarios")
     
-    # Create scenario comparison
-    scenario_df = pd.DataFrame({
-        'Scenario': scenarios.keys(),
-        'Projected Deposits': scenarios.values()
-    })
+    # ROI per scenario is computed while the scenario figure is built
+    scheduler.submit("ROI scenarios", GRAPH.evaluate, 'roi_scenarios', inputs, resources, memoize)
     
-    fig_scenarios = px.bar(
-        scenario_df,
-        x='Scenario',
-        y='Projected Deposits',
-        title='Month 6 Scenario Comparison',
-        color='Scenario',
-        color_discrete_map={
-            'Pessimistic': 'red',
-            'Expected': 'yellow',
-            'Optimistic': 'green'
-        }
-    )
-    st.plotly_chart(fig_scenarios)
+    # Create scenario comparison
+    scheduler.submit("Scenario figure", figure_cache.cached_figure, cache, backend, filters, 'what_if', 'scenarios',
+                     lambda: scenario_figure(scenarios), pessimistic=pessimistic_growth, optimistic=optimistic_growth)
+    st.plotly_chart(scheduler.result("Scenario figure"))
     
     # Impact Analysis
     st.subheader("Campaign Impact Analysis")
     
-    # Calculate campaign metrics
-    baseline_months = ['Month 1', 'Month 2']
-    baseline_deposits = monthly_metrics.loc[baseline_months, 'Total Deposits'].mean()
-    
-    # Calculate ROI for different scenarios
-    campaign_cost = 5000000  # $5M campaign cost
-    
-    roi_scenarios = {}
-    for scenario, month6_value in scenarios.items():
-        # Calculate total incremental value
-        incremental_value = (
-            # Month 3 (campaign month)
-            (monthly_metrics.loc['Month 3', 'Total Deposits'] - baseline_deposits) +
-            # Months 4-5
-            sum(monthly_metrics.loc[['Month 4', 'Month 5'], 'Total Deposits'] - baseline_deposits) +
-            # Projected Month 6
-            (month6_value - baseline_deposits)
-        )
-        
-        # Calculate ROI
-        roi = ((incremental_value - campaign_cost) / campaign_cost) * 100
-        roi_scenarios[scenario] = roi
+    roi_scenarios = scheduler.result("ROI scenarios")
     
     # Display ROI scenarios
     st.write("#### ROI by Scenario")
-    roi_df = pd.DataFrame({
-        'Scenario': roi_scenarios.keys(),
-        'ROI (%)': roi_scenarios.values()
-    })
+    scheduler.submit("ROI figure", figure_cache.cached_figure, cache, backend, filters, 'what_if', 'roi',
+                     lambda: roi_figure(roi_scenarios), pessimistic=pessimistic_growth, optimistic=optimistic_growth)
+    st.plotly_chart(scheduler.result("ROI figure"))
     
-    fig_roi = px.bar(
-        roi_df,
-        x='Scenario',
-        y='ROI (%)',
-        title='Campaign ROI by Scenario',
-        color='Scenario',
-        color_discrete_map={
-            'Pessimistic': 'red',
-            'Expected': 'yellow',
-            'Optimistic': 'green'
-        }
-    )
-    st.plotly_chart(fig_roi)
+    # Segment Forecasts
+    st.subheader("Segment Forecasts")
+    
+    forecast_dimensions = {**FORECAST_DIMENSIONS, **dimensions.titles(backend.derived_dimensions)}
+    dimension_label = st.selectbox("Forecast by", list(forecast_dimensions), key="forecast_dimension")
+    inputs['forecast_dimension'] = forecast_dimensions[dimension_label]
+    scheduler.submit("Segment forecast", GRAPH.evaluate, 'segment_forecast', inputs, resources, memoize)
+    segment_forecast = scheduler.result("Segment forecast")
+    
+    scheduler.submit("Segment forecast figure", figure_cache.cached_figure, cache, backend, filters, 'what_if',
+                     'segment_forecast', lambda: segment_forecast_figure(segment_forecast, dimension_label),
+                     dimension=dimension_label)
+    st.plotly_chart(scheduler.result("Segment forecast figure"), use_container_width=True)
+    
+    segment_table = segment_forecast[[
+        'last_actual', 'forecast', 'lower', 'upper', 'growth', 'campaign_lift', 'projected_campaign_return'
+    ]].rename(columns={
+        'last_actual': 'Month 5 Actual ($)',
+        'forecast': 'Month 6 Forecast ($)',
+        'lower': 'Lower 95% ($)',
+        'upper': 'Upper 95% ($)',
+        'growth': 'Projected Growth',
+        'campaign_lift': 'Month 3 Campaign Lift',
+        'projected_campaign_return': 'Projected Campaign Return ($)',
+    }).rename_axis(dimension_label)
+    st.dataframe(segment_table.style.format({
+        'Month 5 Actual ($)': '${:,.2f}',
+        'Month 6 Forecast ($)': '${:,.2f}',
+        'Lower 95% ($)': '${:,.2f}',
+        'Upper 95% ($)': '${:,.2f}',
+        'Projected Growth': '{:.1%}',
+        'Month 3 Campaign Lift': '{:.1%}',
+        'Projected Campaign Return ($)': '${:,.2f}',
+    }))
     
     # Key Insights
     st.subheader("Key Insights")
@@ -179,3 +279,6 @@ def show_analysis(client_data, deposit_data, calendar_data):
        - Expected ROI: {roi_scenarios['Expected']:.1f}%
        - Optimistic ROI: {roi_scenarios['Optimistic']:.1f}%
     """)
+    
+    with st.expander("⏱️ Section Timings"):
+        st.dataframe(scheduler.timing_table(), hide_index=True)
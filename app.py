@@ -1,9 +1,55 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from analysis import campaign_analysis, strategy_recommendations, what_if_analysis, dashboard_overview
+from analysis import campaign_analysis, strategy_recommendations, what_if_analysis, dashboard_overview, client_drilldown
+from analysis import ingest, incremental, backends, sql_source, snapshots, figure_cache, graph, sampling, validation, export, kpis, dimensions
 import os
 
+# Deposit source: a single CSV, a directory of daily/monthly partitions or a glob
+DEPOSIT_SOURCE = os.environ.get('DEPOSIT_DATA_PATH', 'deposit_data1.csv')
+
+# When set, deposits are ingested incrementally and only new rows are parsed on refresh
+DEPOSIT_STATE_DIR = os.environ.get('DEPOSIT_STATE_DIR')
+
+# Aggregation engine behind the views: 'pandas' (in memory), 'duckdb' (Parquet, out of core)
+# or 'sqlite' (relational source, aggregates computed in the database)
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'pandas')
+QUERY_PARQUET_DIR = os.environ.get('QUERY_PARQUET_DIR', '.parquet_store')
+
+# Relational source holding the client, deposit and calendar tables
+SQLITE_DATABASE = os.environ.get('SQLITE_DATABASE')
+
+# Deposit rows failing validation (duplicates, orphan clients, dates outside the calendar,
+# negative amounts) are written here per data version ('' keeps them in memory only)
+QUARANTINE_DIR = os.environ.get('QUARANTINE_DIR', '.quarantine')
+
+# JSON list of derived client dimensions (name, title, source column, bins, labels) banded
+# once per client at load time; unset keeps the built-in age groups
+DERIVED_DIMENSIONS = os.environ.get('DERIVED_DIMENSIONS')
+
+# Computed KPI tables are persisted here per data version and filter selection ('' disables)
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '.kpi_snapshots')
+
+# Data versions kept in the snapshot store; older ones are removed ('0' keeps all)
+SNAPSHOT_VERSIONS = int(os.environ.get('SNAPSHOT_VERSIONS', str(snapshots.DEFAULT_MAX_VERSIONS)))
+
+# Memory budget for serialized Plotly figures shared across sessions ('0' disables)
+FIGURE_CACHE_MB = float(os.environ.get('FIGURE_CACHE_MB', '64'))
+
+# Share of deposits kept per stratum (month, region, residence status, type) in approximate mode
+SAMPLE_FRACTION = float(os.environ.get('SAMPLE_FRACTION', str(sampling.DEFAULT_FRACTION)))
+
+# Exported files are written here; row exports stop at EXPORT_MAX_ROWS and are marked truncated
+EXPORT_DIR = os.environ.get('EXPORT_DIR', '.exports')
+EXPORT_MAX_ROWS = int(os.environ.get('EXPORT_MAX_ROWS', str(export.DEFAULT_MAX_ROWS)))
+
+# Page views that can run on the sample, and the graph node their exact recompute fills
+EXACT_NODES = {
+    'campaign': (campaign_analysis.GRAPH, 'tables'),
+    'strategy': (strategy_recommendations.GRAPH, 'tables'),
+    'what_if': (what_if_analysis.GRAPH, 'projection'),
+}
+
 # Set page configuration with a wider layout and custom theme
 st.set_page_config(
     page_title="Debt Relief Campaign Analysis",
@@ -233,29 +279,257 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def load_data():
+@st.cache_resource
+def get_ingestor(deposit_source, state_dir):
+    # One ingestor per process, shared by every session
+    return incremental.IncrementalIngestor(deposit_source, state_dir)
+
+@st.cache_resource
+def get_sqlite_source(database):
+    # Pooled connections are reused across sessions and reruns
+    return sql_source.SQLiteSource(database)
+
+def load_calendar():
+    calendar_data = pd.read_csv('calendar_data.csv')
+    calendar_data['gregorian_date'] = pd.to_datetime(calendar_data['gregorian_date'])
+    return calendar_data
+
+def load_data(deposit_source=DEPOSIT_SOURCE):
     try:
+        if SQLITE_DATABASE:
+            return get_sqlite_source(SQLITE_DATABASE).load_data()
+        
         # Load client data
         client_data = pd.read_csv('client_data.csv')
         
-        # Load deposit data
-        deposit_data = pd.read_csv('deposit_data1.csv')
-        deposit_data['deposit_date'] = pd.to_datetime(deposit_data['deposit_date'])
-        
         # Load calendar data
-        calendar_data = pd.read_csv('calendar_data.csv')
-        calendar_data['gregorian_date'] = pd.to_datetime(calendar_data['gregorian_date'])
+        calendar_data = load_calendar()
+        
+        if DEPOSIT_STATE_DIR:
+            # Fold in rows appended since the last refresh
+            ingestor = get_ingestor(deposit_source, DEPOSIT_STATE_DIR)
+            ingestor.refresh()
+            deposit_data = ingestor.deposits
+        else:
+            # Load deposit partitions in parallel, skipping those outside the calendar
+            deposit_data = ingest.load_deposits(deposit_source, *ingest.calendar_span(calendar_data))
         
         return client_data, deposit_data, calendar_data
+    except FileNotFoundError as e:
+        st.error(f"Error loading data: file not found: {e.filename}")
+    except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+        st.error(f"Error loading data: could not parse the input files: {e}")
+    except KeyError as e:
+        st.error(f"Error loading data: missing column {e}")
     except Exception as e:
+        st.error(f"Error loading data ({type(e).__name__}): {e}")
+    return None, None, None
+
+def validate_data(client_data, deposit_data, calendar_data, data_version):
+    # Bad deposit rows are quarantined before any backend aggregates them
+    return validation.validate_inputs(client_data, deposit_data, calendar_data, QUARANTINE_DIR, data_version)
+
+def input_version():
+    return ingest.file_signature(['client_data.csv', 'calendar_data.csv'])
+
+def current_data_version():
+    # Cheap fingerprint of the inputs; a new value rebuilds the backend and misses old snapshots
+    if SQLITE_DATABASE:
+        return ingest.file_signature([SQLITE_DATABASE])
+    
+    inputs = input_version()
+    if DEPOSIT_STATE_DIR:
+        ingestor = get_ingestor(DEPOSIT_SOURCE, DEPOSIT_STATE_DIR)
+        ingestor.refresh()
+        return f"{inputs}-v{ingestor.data_version}"
+    return f"{inputs}-{ingest.file_signature(ingest.resolve_partitions(DEPOSIT_SOURCE))}"
+
+@st.cache_resource(max_entries=1)
+def get_pandas_backend(data_version, _registry=None):
+    client_data, deposit_data, calendar_data = load_data()
+    if client_data is None or deposit_data is None or calendar_data is None:
+        return None
+    deposit_data, counts = validate_data(client_data, deposit_data, calendar_data, data_version)
+    backend = backends.PandasBackend(client_data, deposit_data, calendar_data, data_version=data_version,
+                                     registry=_registry)
+    backend.validation = counts
+    return backend
+
+@st.cache_resource(max_entries=1)
+def get_incremental_backend(inputs, _registry=None):
+    # Rebuilt only when the client or calendar file changes; appended deposits are folded
+    # into it in place by refresh()
+    try:
+        client_data = pd.read_csv('client_data.csv')
+        calendar_data = load_calendar()
+        return incremental.IncrementalBackend(
+            get_ingestor(DEPOSIT_SOURCE, DEPOSIT_STATE_DIR), client_data, calendar_data, inputs,
+            registry=_registry, quarantine_dir=QUARANTINE_DIR
+        )
+    except FileNotFoundError as e:
+        st.error(f"Error loading data: file not found: {e.filename}")
+    except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+        st.error(f"Error loading data: could not parse the input files: {e}")
+    except KeyError as e:
+        st.error(f"Error loading data: missing column {e}")
+    except Exception as e:
+        st.error(f"Error loading data ({type(e).__name__}): {e}")
+    return None
+
+@st.cache_resource(max_entries=1)
+def get_duckdb_backend(deposit_source, parquet_dir, data_version, _registry=None):
+    # The columnar copy is written once per data version; queries then run inside DuckDB
+    client_data, deposit_data, calendar_data = load_data(deposit_source)
+    if client_data is None:
+        return None
+    deposit_data, counts = validate_data(client_data, deposit_data, calendar_data, data_version)
+    backend = backends.DuckDBBackend.from_frames(
+        client_data, deposit_data, calendar_data, parquet_dir, data_version=data_version, registry=_registry
+    )
+    backend.validation = counts
+    return backend
+
+@st.cache_resource(max_entries=1)
+def get_sqlite_backend(database, data_version, _registry=None):
+    return sql_source.SQLiteBackend(get_sqlite_source(database), data_version=data_version, registry=_registry)
+
+def get_query_backend():
+    try:
+        registry = dimensions.load_registry(DERIVED_DIMENSIONS)
+    except (OSError, ValueError) as e:
+        st.error(f"Error loading derived dimensions: {str(e)}")
+        return None
+    # Custom bands change the segment tables, so they are part of the data version
+    bands = f"-d{registry.fingerprint:x}" if DERIVED_DIMENSIONS else ''
+    try:
+        if DEPOSIT_STATE_DIR and not SQLITE_DATABASE and QUERY_BACKEND not in ('duckdb', 'sqlite'):
+            # One backend per client/calendar version, brought up to date in place; its
+            # caches key on the versions of the months each filter reads
+            backend = get_incremental_backend(f"{input_version()}{bands}", registry)
+            if backend is not None:
+                backend.refresh()
+            return backend
+        data_version = current_data_version() + bands
+    except OSError as e:
         st.error(f"Error loading data: {str(e)}")
-        return None, None, None
+        return None
+    
+    if QUERY_BACKEND == 'duckdb':
+        return get_duckdb_backend(DEPOSIT_SOURCE, QUERY_PARQUET_DIR, data_version, registry)
+    if QUERY_BACKEND == 'sqlite':
+        # Views fetch aggregated result sets; deposit rows never leave the database
+        return get_sqlite_backend(SQLITE_DATABASE, data_version, registry)
+    return get_pandas_backend(data_version, registry)
+
+@st.cache_resource
+def get_snapshot_store(root, max_versions=SNAPSHOT_VERSIONS):
+    return snapshots.SnapshotStore(root, max_versions) if root else None
+
+@st.cache_resource
+def get_figure_cache(max_mb):
+    return figure_cache.FigureCache(max_bytes=int(max_mb * 1024 * 1024)) if max_mb > 0 else None
+
+@st.cache_resource(max_entries=1)
+def get_sampled_backend(data_version, fraction, _backend):
+    # Built once per data version from a full scan of the exact backend
+    return sampling.SampledBackend(_backend, fraction)
+
+@st.cache_resource
+def get_exact_jobs():
+    return sampling.BackgroundJobs()
+
+def approximate_backend(backend, view, filters, snapshot_store):
+    # The sample serves the page until its exact tables for this filter set are computed
+    # in the background; after that the page reads them from the exact backend's graph node
+    sampled = get_sampled_backend(backend.data_version, SAMPLE_FRACTION, backend)
+    jobs = get_exact_jobs()
+    key = (backend.cache_version(filters), view, filters)
+    status = jobs.status(key)
+    
+    if status == 'done':
+        st.sidebar.success("✅ Showing exact values for this page and filter selection.")
+        return backend
+    if status == 'failed':
+        st.sidebar.error(f"Exact computation failed: {jobs.error(key)}")
+    
+    if status != 'running' and st.sidebar.button("🎯 Compute exact values"):
+        compute_graph, node = EXACT_NODES[view]
+        jobs.submit(
+            key, compute_graph.evaluate, node, graph.filter_inputs(backend, filters),
+            {'backend': backend, 'snapshot_store': snapshot_store}, backend.data_version is not None
+        )
+        status = 'running'
+    if status == 'running':
+        st.sidebar.info("⏳ Computing exact values in the background.")
+        st.sidebar.button("🔄 Check again")
+    return sampled
+
+@st.cache_resource
+def get_export_manager(directory, max_rows):
+    # One export pool per process, shared by every session
+    return export.ExportManager(directory, max_rows=max_rows)
+
+def export_status(exports, key, label):
+    # Progress while the export runs, then a download button for the finished file
+    job, status, error = exports.status(key)
+    if status == 'running':
+        total = f" of {job.total:,}" if job.total else ""
+        st.sidebar.progress(job.progress, text=f"{label}: {job.rows:,}{total} written")
+    elif status == 'failed':
+        st.sidebar.error(f"{label} export failed: {error}")
+    elif status == 'done':
+        if job.truncated:
+            st.sidebar.warning(f"{label}: capped at {job.rows:,} rows (EXPORT_MAX_ROWS)")
+        size = f"{job.size / 1e6:,.1f} MB" if job.size >= 1e6 else f"{job.size / 1e3:,.0f} KB"
+        with open(job.path, 'rb') as f:
+            st.sidebar.download_button(
+                f"⬇️ {label} ({size})", data=f,
+                file_name=os.path.basename(job.path), key=f"download_{key[2]}_{key[3]}"
+            )
+    return status
+
+def export_panel(backend, view, filters, snapshot_store):
+    # Files are written by the export pool; the page only polls their progress
+    exports = get_export_manager(EXPORT_DIR, EXPORT_MAX_ROWS)
+    st.sidebar.title("📤 Export")
+    formats = {"CSV": 'csv', "Parquet (zstd)": 'parquet'}
+    fmt = formats[st.sidebar.selectbox("Export format", list(formats), key="export_format")]
+    
+    row_key = exports.row_key(backend, filters, fmt)
+    if exports.status(row_key)[1] in (None, 'failed') and st.sidebar.button("📄 Export filtered deposits"):
+        exports.submit_rows(backend, filters, fmt)
+    statuses = [export_status(exports, row_key, "Filtered deposits")]
+    
+    if view in kpis.VIEW_TABLE_NAMES:
+        table_key = exports.table_key(view, backend, filters, fmt)
+        if exports.status(table_key)[1] in (None, 'failed') and st.sidebar.button("🗂️ Export page tables"):
+            exports.submit_tables(view, backend, filters, fmt, snapshot_store)
+        statuses.append(export_status(exports, table_key, "Page tables"))
+    
+    if 'running' in statuses:
+        st.sidebar.button("🔄 Check export progress")
+
+@st.cache_resource
+def get_sidebar_graph():
+    # app.py re-executes on every rerun, so the graph lives in the resource cache
+    sidebar_graph = graph.ComputeGraph(max_entries=2)
+    
+    @sidebar_graph.node('filter_options', inputs=['data_version'], resources=('backend',))
+    def filter_options(data_version, backend):
+        # Option lists and date bounds depend on the data only, not on the current selection
+        return {
+            'regions': backend.distinct_values('client_geographical_region'),
+            'statuses': backend.distinct_values('client_residence_status'),
+            'date_bounds': backend.date_bounds(),
+        }
+    
+    return sidebar_graph
 
 def main():
     # Load data
-    client_data, deposit_data, calendar_data = load_data()
+    backend = get_query_backend()
     
-    if client_data is None or deposit_data is None or calendar_data is None:
+    if backend is None:
         st.error("⚠️ Failed to load data. Please check the data files and their contents.")
         return
     
@@ -263,69 +537,100 @@ def main():
     st.sidebar.title("📊 Navigation")
     analysis_type = st.sidebar.radio(
         "Choose Analysis Type",
-        ["📋 Overview", "📈 Campaign Performance", "🎯 Strategy Recommendations", "🔮 What-If Analysis"]
+        ["📋 Overview", "📈 Campaign Performance", "🎯 Strategy Recommendations", "🔮 What-If Analysis",
+         "🔎 Client Drill-Down"]
     )
     
     # Add filters in sidebar
     st.sidebar.title("🔍 Filters")
     
+    filter_options = get_sidebar_graph().evaluate(
+        'filter_options', {'data_version': backend.data_version}, {'backend': backend},
+        memoize=backend.data_version is not None
+    )
+    
     # Region filter
-    if 'client_geographical_region' in client_data.columns:
+    regions = filter_options['regions']
+    if regions is not None:
         selected_regions = st.sidebar.multiselect(
             "Filter by Region",
-            options=sorted(client_data['client_geographical_region'].unique()),
-            default=sorted(client_data['client_geographical_region'].unique())
+            options=regions,
+            default=regions
         )
     else:
         selected_regions = None
     
     # Residence status filter
-    if 'client_residence_status' in client_data.columns:
+    statuses = filter_options['statuses']
+    if statuses is not None:
         selected_status = st.sidebar.multiselect(
             "Filter by Residence Status",
-            options=sorted(client_data['client_residence_status'].unique()),
-            default=sorted(client_data['client_residence_status'].unique())
+            options=statuses,
+            default=statuses
         )
     else:
         selected_status = None
     
     # Date range filter
+    min_date, max_date = filter_options['date_bounds']
     date_range = st.sidebar.date_input(
         "Select Date Range",
-        value=(deposit_data['deposit_date'].min(), deposit_data['deposit_date'].max()),
-        min_value=deposit_data['deposit_date'].min(),
-        max_value=deposit_data['deposit_date'].max()
+        value=(min_date, max_date),
+        min_value=min_date,
+        max_value=max_date
     )
     
-    # Apply filters
+    # Filters are pushed down to the query backend; a selection equal to the full
+    # range is left unrestricted so the default view shares one snapshot key
     start_date, end_date = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
+    filters = backends.make_filters(
+        start_date=start_date if start_date > min_date else None,
+        end_date=end_date if end_date < max_date else None,
+        regions=selected_regions if selected_regions is not None and set(selected_regions) != set(regions) else None,
+        statuses=selected_status if selected_status is not None and set(selected_status) != set(statuses) else None
+    )
     
-    filtered_deposit_data = deposit_data[
-        (deposit_data['deposit_date'] >= start_date) &
-        (deposit_data['deposit_date'] <= end_date)
-    ]
-    
-    if selected_regions is not None and selected_status is not None:
-        filtered_client_data = client_data[
-            (client_data['client_geographical_region'].isin(selected_regions)) &
-            (client_data['client_residence_status'].isin(selected_status))
-        ]
-    else:
-        filtered_client_data = client_data.copy()
+    # Rows held back by ingest validation; KPIs below exclude them
+    counts = backend.validation
+    if counts is not None and counts['quarantined']:
+        st.sidebar.title("🧹 Data Quality")
+        st.sidebar.warning(f"{counts['quarantined']:,} of {counts['rows']:,} deposit rows quarantined")
+        with st.sidebar.expander("Quarantine details"):
+            st.dataframe(validation.counts_table(counts), hide_index=True)
+            if counts.get('quarantine_path'):
+                st.caption(f"Rows written to {counts['quarantine_path']}")
+    
+    snapshot_store = get_snapshot_store(SNAPSHOT_DIR)
+    cache = get_figure_cache(FIGURE_CACHE_MB)
+    
+    # Approximate mode: KPIs and charts come from a stratified sample, with error bars
+    st.sidebar.title("⚡ Speed")
+    approximate = st.sidebar.toggle(
+        "Approximate mode",
+        key="approximate_mode",
+        help=f"Estimate KPIs from a {SAMPLE_FRACTION:.0%} stratified sample of deposits while exploring filters"
+    )
+    view = ("campaign" if "Campaign Performance" in analysis_type
+            else "strategy" if "Strategy Recommendations" in analysis_type
+            else "what_if" if "What-If" in analysis_type else None)
+    view_backend = backend
+    if approximate and view is not None:
+        view_backend = approximate_backend(backend, view, filters, snapshot_store)
     
-    filtered_deposit_data = filtered_deposit_data[
-        filtered_deposit_data['client_id'].isin(filtered_client_data['client_id'])
-    ]
+    # Exports always read the exact backend
+    export_panel(backend, view, filters, snapshot_store)
     
     # Display content based on selection
     if "Overview" in analysis_type:
         dashboard_overview.show_overview()
     elif "Campaign Performance" in analysis_type:
-        campaign_analysis.show_analysis(filtered_client_data, filtered_deposit_data, calendar_data)
+        campaign_analysis.show_analysis(view_backend, filters, snapshot_store, cache)
     elif "Strategy Recommendations" in analysis_type:
-        strategy_recommendations.show_analysis(filtered_client_data, filtered_deposit_data, calendar_data)
+        strategy_recommendations.show_analysis(view_backend, filters, snapshot_store, cache)
+    elif "Client Drill-Down" in analysis_type:
+        client_drilldown.show_drilldown(backend)
     else:
-        what_if_analysis.show_analysis(filtered_client_data, filtered_deposit_data, calendar_data)
+        what_if_analysis.show_analysis(view_backend, filters, snapshot_store, cache)
 
 if __name__ == "__main__":
     main()